@@ -31,6 +31,9 @@ QWEN_CONFIG = {
     "allow_llm_to_see_data": True,
     "temperature": 0.7,
     "n_results": 6,
+    "n_results_sql": 6,
+    "n_results_documentation": 6,
+    "n_results_ddl": 6,
     "language": "Chinese",
     "enable_thinking": False #自定义，是否支持流模式，仅qwen3模型。
 }
@@ -47,6 +50,29 @@ EMBEDDING_CONFIG = {
 }
 
 
+# 执行生成的SQL之前的检查(业务数据库)：
+# 只允许单条SELECT；非聚合查询自动加LIMIT；EXPLAIN估算的代价或行数超过上限时拒绝执行并返回执行计划摘要
+SQL_GUARD_CONFIG = {
+    "enabled": True,
+    "max_total_cost": 1e7,  # EXPLAIN估算的总代价上限
+    "max_plan_rows": 1e7,  # EXPLAIN估算的返回行数上限
+    "statement_timeout_ms": 30000,  # 每条查询的执行超时
+    "default_limit": 1000,  # 非聚合查询自动加上的LIMIT，0表示不加
+    "pool_size": 10,  # 业务数据库连接池大小
+    "pool_timeout": 30,  # 连接都在使用时最多等待的秒数
+    "plan_cache_ttl": 60,  # 同一SQL的执行计划摘要复用的秒数
+}
+
+# 执行计划反馈配置：生成的SQL估算代价过高时，把执行计划和索引发回LLM改写，
+# 只有估算代价更低且结果列相同时才采用(需要启用 SQL_GUARD_CONFIG)。可选步骤，会多一次LLM调用，默认关闭
+SQL_PLAN_FEEDBACK_CONFIG = {
+    "enabled": False,
+    "cost_threshold": 1e6,  # 估算总代价超过该值时尝试改写
+    "big_table_rows": 1e6,  # 全表扫描估算行数超过该值的表视为大表
+    "max_partitions": 8,  # 扫描的分区数超过该值时视为没有裁剪分区
+    "max_indexes": 30,  # 提示词中最多列出的索引数
+}
+
 # 应用数据库连接配置 (业务数据库)
 APP_DB_CONFIG = {
     "host": "192.168.67.1",
@@ -59,7 +85,7 @@ APP_DB_CONFIG = {
 # ChromaDB配置
 # CHROMADB_PATH = "."  
 
-# 向量数据库类型， chromadb 或 pgvector
+# 向量数据库类型， chromadb、pgvector 或 pgvector_service(通过独立检索服务访问pgvector)
 VECTOR_DB_TYPE = "pgvector"
 
 # PgVector数据库连接配置 (向量数据库，独立于业务数据库)
@@ -73,6 +99,210 @@ PGVECTOR_CONFIG = {
 
 #PGVECTOR_TABLE = "langchain_pg_embedding"  # PgVector表名
 
+# PgVector检索配置，仅在 VECTOR_DB_TYPE 为 pgvector 时合并到vanna实例的config中
+PGVECTOR_RETRIEVAL_CONFIG = {
+    # 分层检索：先检索表摘要集合(table_summary)，再按表名键值查找详细DDL(table_ddl)
+    # 需要先用 training/run_plan_schema.py 生成表摘要和DDL
+    "hierarchical_ddl": False,
+    "n_results_table": 8,  # 第一阶段选出的表数量
+    # 余弦距离上限，按集合配置，超过的结果不进入提示词；None表示不限制
+    "max_distance": {"sql": None, "ddl": None, "documentation": None, "table_summary": None},
+    # 自适应k：相邻结果距离跳变超过该值时截断后面的结果，例如0.15；None表示不启用
+    "distance_gap": None,
+    # 每个集合进入提示词的token预算；None表示不限制
+    "token_budget": {"sql": 2000, "ddl": 4000, "documentation": 2000},
+    # 固定使用的集合版本，一般不设置，由 training/rebuild_vectordb.py 在重建影子版本时通过环境变量指定
+    # 未设置时跟随 vanna_collection_versions 表中的active版本
+    "collection_version": os.getenv("VECTOR_COLLECTION_VERSION"),
+    "version_check_interval": 30,  # 检查active版本是否切换的间隔(秒)
+    # 训练数据版本(语义缓存的作用域)的缓存时间(秒)：本进程的训练立即生效，其他进程的训练最多延迟这么久
+    "training_data_stamp_ttl": 5,
+}
+
+# 独立检索服务配置 (VECTOR_DB_TYPE = "pgvector_service" 时使用)
+# 启动服务: python -m custompgvector.retrieval_service
+RETRIEVAL_SERVICE_CONFIG = {
+    "url": "http://127.0.0.1:8091",  # 也可以使用Unix socket，例如 "unix:///tmp/vanna_retrieval.sock"
+    "timeout": 10,  # 客户端请求超时(秒)
+    "batch_wait_ms": 5,  # 合并并发请求的等待窗口
+    "max_batch_size": 32,
+    "cache_size": 1024,  # 最近检索结果的LRU缓存条数
+}
+
+# 按提示词类型路由到不同的服务商和模型，未配置的类型使用上面 MODEL_TYPE 对应的默认模型
+# provider: qwen / deepseek，使用 QWEN_CONFIG / DEEPSEEK_CONFIG 中的API密钥；缺少密钥时退回默认模型
+# fallback_model: 生成的SQL无效时使用的更强的模型(目前只对sql生效)，可用fallback_provider指定其服务商
+LLM_ROUTING_CONFIG = {
+    "enabled": True,
+    "routes": {
+        # SQL生成默认使用 MODEL_TYPE 对应的模型，也可以单独指定，例如:
+        # "sql": {"provider": "qwen", "model": "qwen-plus", "fallback_model": "qwen-max"},
+        "summary": {"provider": "qwen", "model": "qwen-turbo"},
+        "followup": {"provider": "qwen", "model": "qwen-turbo"},
+        "plotly": {"provider": "qwen", "model": "qwen-plus"},
+        "question": {"provider": "qwen", "model": "qwen-turbo"},  # 训练时根据SQL生成问题
+    },
+}
+
+# 主备LLM服务商：MODEL_TYPE为主服务商，另一个(qwen/deepseek)为备用服务商，需要设置其API密钥
+# 主服务商连续失败 failure_threshold 次后熔断 recovery_timeout 秒，期间直接使用备用服务商；
+# hedge_prompt_types 中的调用在主服务商超过其p95耗时(不足min_samples次时用default_hedge_delay)仍未返回时，
+# 同时向备用服务商发出相同请求，采用先返回的结果
+LLM_PROVIDER_CONFIG = {
+    "enabled": True,
+    "failure_threshold": 5,
+    "recovery_timeout": 30,
+    "hedge": True,
+    "hedge_prompt_types": ["sql"],
+    "latency_window": 200,  # 每个服务商和提示词类型保留的耗时样本数
+    "min_samples": 20,
+    "default_hedge_delay": 10,
+    "min_hedge_delay": 2,
+    "max_hedge_delay": 30,
+    # 备用服务商使用的模型，不设置时使用其配置中的模型；对冲请求应选响应快的模型
+    "secondary_models": {"deepseek": "deepseek-chat", "qwen": "qwen-plus"},
+}
+
+# SQL提示词中DDL的裁剪：超过max_columns列的表只保留主键/外键和与问题相关的列(按列名和注释匹配)，
+# 并统一为紧凑的 CREATE TABLE 格式
+# embedding_match: 同时按列注释与问题的向量相似度选择列；每个列注释第一次出现时需要调用一次嵌入接口
+DDL_COMPACTION_CONFIG = {
+    "enabled": True,
+    "max_columns": 30,
+    "embedding_match": False,
+    "similarity_threshold": 0.5,
+}
+
+# 服务商上下文缓存(DeepSeek、百炼会对相同的提示词前缀打折并加快响应)：
+# stable_prefix 为True时SQL提示词按 固定说明 -> 按检索排名排列的DDL和文档 -> 示例 -> 问题 组织，
+# 缓存命中的token数见 /api/v0/llm_usage_stats
+PROMPT_CACHE_CONFIG = {
+    "stable_prefix": True,
+}
+
+# LLM用量计量：每次调用的服务商、模型、提示词类型、token数、首个片段耗时、总耗时和用户
+# 追加写入JSONL文件(log_path为None时只在内存中汇总)，汇总见 auth_app 的 /admin/llm_usage
+LLM_USAGE_CONFIG = {
+    "log_path": os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "llm_usage.jsonl"),
+}
+
+# 计算token数使用的分词器：按 MODEL_TYPE 选择，值为模型仓库中的tokenizer.json(或包含它的目录)，
+# 需要预先下载到本地并安装tokenizers；文件不存在时按字符类型估算(中文每字按1个token，预算偏保守)
+TOKENIZER_CONFIG = {
+    "qwen": os.path.join(os.path.dirname(os.path.abspath(__file__)), "tokenizers", "qwen", "tokenizer.json"),
+    "deepseek": os.path.join(os.path.dirname(os.path.abspath(__file__)), "tokenizers", "deepseek", "tokenizer.json"),
+}
+
+# SQL提示词token预算：超出时从排名最靠后的文档、示例、DDL开始丢弃，不再发送超长提示词
+# token数使用上面 TOKENIZER_CONFIG 配置的分词器计算
+PROMPT_BUDGET_CONFIG = {
+    "enabled": True,
+    "max_prompt_tokens": 12000,
+}
+
+# SQL生成的提前结束：
+# - stop_sequences: 发给服务商的停止序列，模型写完```sql代码块后立即停止，不再输出解释
+# - early_stop: 生成SQL时改为流式接收，收到完整SQL(闭合的代码块，或以分号结束且能解析的语句)就关闭连接；
+#   启用思考模式或使用deepseek-reasoner时效果最明显
+SQL_STREAM_CONFIG = {
+    "early_stop": True,
+    "stop_sequences": [";\n```"],
+}
+
+# 日志配置：聊天类的提示词/消息、嵌入接口等热路径的日志通过队列交给后台线程写出
+# level: DEBUG 时输出提示词等大段内容，按 payload_sample_rate 抽样并截断到 max_payload_chars 字符
+# queue_size: 队列满时丢弃日志而不阻塞请求; file: 同时写入的日志文件，None表示只输出到stdout
+LOGGING_CONFIG = {
+    "level": "INFO",
+    "payload_sample_rate": 0.05,
+    "max_payload_chars": 2000,
+    "queue_size": 10000,
+    "file": None,
+}
+
+# LLM客户端连接池配置，同一进程内每个服务地址共用一个连接池
+LLM_CLIENT_CONFIG = {
+    "max_connections": 50,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 30,  # 空闲连接保留时间(秒)
+    "connect_timeout": 5,  # 建立连接超时(秒)
+    "read_timeout": 120,  # 等待响应超时(秒)，流式输出时为两个片段之间的最长间隔
+    "write_timeout": 30,
+    "pool_timeout": 10,  # 等待空闲连接超时(秒)
+    "max_retries": 2,  # 连接错误、429和5xx时的重试次数(SDK自带指数退避)
+}
+
+# generate_sql 精确匹配快速路径：训练集(question_sql)中最相似问题的余弦距离不超过max_distance时，
+# 直接返回训练集中的SQL，不调用LLM。仅 pgvector / pgvector_service 提供带距离的检索；
+# 未命中时这次检索的结果直接用于LLM生成，不再重复检索
+EXACT_MATCH_CONFIG = {
+    "enabled": True,
+    "max_distance": 0.02,
+}
+
+# generate_sql 语义缓存配置：与缓存中问题的余弦相似度不低于阈值、并且数字和日期词(年份、月份、"去年"等)
+# 完全相同时直接返回缓存的SQL。pgvector时训练数据被其他进程或训练脚本修改后缓存整体失效
+SEMANTIC_CACHE_CONFIG = {
+    "enabled": True,
+    "similarity_threshold": 0.99,
+    "ttl": 3600,  # 缓存条目有效期(秒)
+    "max_size": 1000,  # 最多缓存的问题数
+}
+
+# LLM响应缓存：消息列表、模型和temperature完全相同时直接返回之前的结果，按提示词类型开关
+LLM_RESPONSE_CACHE_CONFIG = {
+    "enabled": True,
+    "backend": "memory",  # memory: 进程内LRU; disk: SQLite文件，多个worker共享
+    "path": os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "llm_response_cache.db"),
+    "max_size": 1000,
+    "ttl": 3600,  # 缓存有效期(秒)
+    "prompt_types": {
+        "summary": True,
+        "followup": True,
+        "plotly": True,
+    },
+}
+
+# 生成摘要时大查询结果的统计摘要：行数或内存占用超过阈值时，不再把整个结果转成markdown发给LLM，
+# 而是发送形状、列类型、数值列统计、高频值、分组聚合和首尾样例
+RESULT_DIGEST_CONFIG = {
+    "enabled": True,
+    "max_rows": 200,
+    "max_bytes": 1_000_000,  # DataFrame内存占用(字节)
+    "top_k": 5,  # 非数值列列出的高频值个数
+    "sample_rows": 5,  # 首尾样例各取的行数
+    "max_group_cardinality": 20,  # 分组聚合的分组列最多有多少个不同值
+    "cache_size": 128,  # 缓存的摘要个数
+}
+
+# 查询结果返回后的LLM任务(摘要、追问、图表代码)并行执行配置
+POST_QUERY_CONFIG = {
+    "ask_tasks": ["plotly"],  # /api/v0/ask 默认执行的任务，请求中的tasks参数可以加上summary、followup
+    "stream_tasks": ["summary", "followup", "plotly"],  # /api/v0/ask_stream 默认执行的任务
+    "max_workers": 16,  # 进程内共享线程池的大小，限制同时进行的LLM调用数
+    # 每个任务的超时(秒)。超时后不再等待结果，但已经开始的LLM调用会继续运行到结束并占用线程池
+    "timeouts": {"summary": 60, "followup": 30, "plotly": 60},
+    "n_followup_questions": 5,
+}
+
+# 训练SQL示例时批量生成问题：一个提示词包含多条SQL，模型返回JSON数组；解析失败的条目逐条生成
+QUESTION_GENERATION_CONFIG = {
+    "batch_enabled": True,
+    "batch_size": 20,  # 每个提示词最多包含的SQL条数
+    "max_batch_tokens": 6000,  # 每个提示词中SQL的最大token数，超出时提前分批
+    "max_workers": 4,  # 同时进行的批次数
+    "requests_per_minute": 60,  # 生成问题的LLM请求速率上限，None表示不限制
+}
+
+# 训练时由SQL生成的问题的持久化缓存：键为规范化SQL的哈希，按模型和提示词版本区分
+# 重新训练没有变化的SQL示例时不再调用LLM；生成问题的提示词修改后缓存自动失效，
+# 其他影响问题生成的改动(例如vanna默认提示词随版本变化)需要手动修改prompt_version
+QUESTION_CACHE_CONFIG = {
+    "enabled": True,
+    "path": os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "question_cache.db"),
+    "prompt_version": "1",
+}
+
 # 批处理配置
 BATCH_PROCESSING_ENABLED = True
 BATCH_SIZE = 10
@@ -1,6 +1,7 @@
 from vanna.flask import VannaFlaskApp
 from vanna_llm_factory import create_vanna_instance
 from common import SimpleUserAuth
+from common.llm_usage import set_current_user, usage_meter
 import flask
 
 # 创建vanna实例
@@ -25,6 +26,26 @@ app = VannaFlaskApp(
     debug=True
 )
 
+# 把当前登录用户绑定到请求上下文，LLM用量按用户统计
+@app.flask_app.before_request
+def bind_usage_user():
+    set_current_user(auth.get_user(flask.request))
+
+
+# LLM用量汇总(按用户、提示词类型、服务商和模型)，group_by 可以是 user,prompt_type,provider,model 的组合
+@app.flask_app.route('/admin/llm_usage', methods=['GET'])
+def llm_usage():
+    current_user = auth.get_user(flask.request)
+    if not current_user or current_user.get("role") != "admin":
+        return "权限不足", 403
+
+    group_by = tuple(
+        name for name in flask.request.args.get("group_by", "user").split(",")
+        if name in usage_meter.GROUP_FIELDS
+    ) or ("user",)
+    return flask.jsonify({"group_by": list(group_by), "rows": usage_meter.aggregate(group_by)})
+
+
 # 添加用户管理路由（可选）
 @app.flask_app.route('/admin/add_user', methods=['GET', 'POST'])
 def add_user():
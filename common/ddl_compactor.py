@@ -0,0 +1,311 @@
+"""
+SQL提示词中DDL的裁剪。
+
+宽表(几百列)的完整DDL会让提示词很长、LLM响应变慢。这里把检索到的DDL解析成表和列，
+只保留主键/外键等关键列和与问题相关的列(按列名和注释做词匹配，可选向量匹配)，
+再输出为紧凑统一的 CREATE TABLE 形式。没有宽表的DDL条目不做改动，宽表以外的语句(索引、视图、
+单独的外键、说明文字等)原样保留。
+"""
+import re
+import threading
+from dataclasses import dataclass, field
+
+import numpy as np
+import sqlparse
+from sqlparse import lexer
+from sqlparse import tokens as T
+
+from common.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+_CREATE_TABLE_PATTERN = re.compile(
+    r"CREATE\s+(?:TEMPORARY\s+|TEMP\s+|UNLOGGED\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?([\w.\"`\[\]]+)\s*\(",
+    re.IGNORECASE,
+)
+_TABLE_COMMENT_PATTERN = re.compile(r"COMMENT\s+ON\s+TABLE\s+([\w.\"`]+)\s+IS\s+'((?:[^']|'')*)'", re.IGNORECASE)
+_COLUMN_COMMENT_PATTERN = re.compile(r"COMMENT\s+ON\s+COLUMN\s+([\w.\"`]+)\s+IS\s+'((?:[^']|'')*)'", re.IGNORECASE)
+_INLINE_COMMENT_PATTERN = re.compile(r"\s+COMMENT\s+'((?:[^']|'')*)'", re.IGNORECASE)
+_CONSTRAINT_PATTERN = re.compile(r"(CONSTRAINT|PRIMARY\s+KEY|FOREIGN\s+KEY|UNIQUE|CHECK|INDEX|KEY)\b", re.IGNORECASE)
+_INDEX_PATTERN = re.compile(r"(INDEX|KEY)\b", re.IGNORECASE)
+_KEY_CONSTRAINT_PATTERN = re.compile(r"(PRIMARY\s+KEY|FOREIGN\s+KEY)\s*\(([^)]*)\)", re.IGNORECASE)
+_ASCII_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+_CJK_RUN_PATTERN = re.compile(r"[一-鿿]+")
+
+
+@dataclass
+class ColumnSchema:
+    name: str
+    definition: str
+    comment: str = ""
+    is_key: bool = False
+
+
+@dataclass
+class TableSchema:
+    name: str
+    comment: str = ""
+    columns: list = field(default_factory=list)
+    constraints: list = field(default_factory=list)
+    # 右括号之后的部分，如 PARTITION BY RANGE (created_at)
+    suffix: str = ""
+
+
+@dataclass
+class DDLStatement:
+    text: str
+    table: TableSchema | None = None
+    # COMMENT ON 语句所注释的表
+    comment_of: TableSchema | None = None
+
+
+def _strip_identifier(name: str) -> str:
+    return name.strip().strip('"`[]')
+
+
+def _clean_comment(value: str) -> str:
+    comment = value.strip()
+    comment = comment[2:] if comment.startswith("--") else comment[2:-2]
+    return comment.strip().rstrip(",").strip()
+
+
+def _split_table_body(text: str):
+    """
+    把 CREATE TABLE 左括号之后的内容按顶层逗号切分为列定义和约束，括号内的逗号和换行
+    (如 NUMERIC(12,\n 2)、多行的CHECK)不切分。写在逗号之后同一行的注释属于前一条定义。
+
+    Returns:
+        tuple: ([(定义, 注释)], 右括号之后的内容)；没有匹配的右括号时返回 (None, "")
+    """
+    parts, tokens, comments = [], [], []
+    depth, consumed = 1, 0
+    newline_since_comma = True
+    for ttype, value in lexer.tokenize(text):
+        consumed += len(value)
+        if ttype in T.Comment:
+            comment = _clean_comment(value)
+            if comment:
+                if parts and not newline_since_comma and not "".join(tokens).strip():
+                    parts[-1][1].append(comment)
+                else:
+                    comments.append(comment)
+            newline_since_comma = newline_since_comma or value.endswith("\n")
+            continue
+        if ttype in T.Punctuation and value == "(":
+            depth += 1
+        elif ttype in T.Punctuation and value == ")":
+            depth -= 1
+            if depth == 0:
+                parts.append(("".join(tokens), comments))
+                return [
+                    (" ".join(definition.split()), " ".join(part_comments))
+                    for definition, part_comments in parts if definition.strip()
+                ], text[consumed:]
+        elif ttype in T.Punctuation and value == "," and depth == 1:
+            parts.append(("".join(tokens), comments))
+            tokens, comments = [], []
+            newline_since_comma = False
+            continue
+        newline_since_comma = newline_since_comma or "\n" in value
+        tokens.append(value)
+    return None, ""
+
+
+def parse_create_table(statement: str) -> TableSchema | None:
+    match = _CREATE_TABLE_PATTERN.search(statement)
+    if match is None:
+        return None
+    parts, suffix = _split_table_body(statement[match.end():])
+    if parts is None:
+        return None
+
+    table = TableSchema(name=_strip_identifier(match.group(1)), suffix=suffix.strip().rstrip(";").strip())
+    key_columns = set()
+    for part, comment in parts:
+        if _CONSTRAINT_PATTERN.match(part):
+            for kind, columns in _KEY_CONSTRAINT_PATTERN.findall(part):
+                key_columns.update(_strip_identifier(name).lower() for name in columns.split(","))
+            # MySQL的普通索引(KEY/INDEX)与查询写法无关，其余约束保留
+            if not _INDEX_PATTERN.match(part):
+                table.constraints.append(part)
+            continue
+        inline = _INLINE_COMMENT_PATTERN.search(part)
+        if inline:
+            part = part[:inline.start()] + part[inline.end():]
+        name, _, rest = part.partition(" ")
+        table.columns.append(ColumnSchema(
+            name=_strip_identifier(name),
+            definition=f"{_strip_identifier(name)} {rest}".strip(),
+            comment=inline.group(1).replace("''", "'") if inline else comment,
+            is_key=bool(re.search(r"PRIMARY\s+KEY|REFERENCES", rest, re.IGNORECASE)),
+        ))
+    for column in table.columns:
+        column.is_key = column.is_key or column.name.lower() in key_columns
+    return table
+
+
+def parse_ddl(ddl: str) -> list:
+    """
+    按语句(sqlparse.split)解析DDL，返回 DDLStatement 列表。
+    COMMENT ON 语句中的表注释和列注释合并到同一条DDL中对应的表
+    """
+    statements = [
+        DDLStatement(text=text, table=parse_create_table(text))
+        for text in sqlparse.split(ddl) if text.strip()
+    ]
+    by_name = {}
+    for statement in statements:
+        if statement.table is not None:
+            by_name[statement.table.name.lower()] = statement.table
+            by_name[statement.table.name.split(".")[-1].lower()] = statement.table
+
+    def find_table(name: str):
+        name = _strip_identifier(name).lower()
+        return by_name.get(name) or by_name.get(name.split(".")[-1])
+
+    for statement in statements:
+        if statement.table is not None:
+            continue
+        match = _TABLE_COMMENT_PATTERN.search(statement.text)
+        if match:
+            table = find_table(match.group(1))
+            if table is not None:
+                table.comment = match.group(2).replace("''", "'")
+                statement.comment_of = table
+            continue
+        match = _COLUMN_COMMENT_PATTERN.search(statement.text)
+        if match:
+            table_name, _, column_name = _strip_identifier(match.group(1)).rpartition(".")
+            table = find_table(table_name)
+            if table is None:
+                continue
+            statement.comment_of = table
+            for column in table.columns:
+                if column.name.lower() == column_name.lower():
+                    column.comment = match.group(2).replace("''", "'")
+    return statements
+
+
+def text_terms(text: str) -> set:
+    """英文按单词(下划线分开)，中文按相邻两个字切分的词项集合"""
+    text = (text or "").lower()
+    terms = set(_ASCII_WORD_PATTERN.findall(text.replace("_", " ")))
+    for run in _CJK_RUN_PATTERN.findall(text):
+        if len(run) == 1:
+            terms.add(run)
+        terms.update(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def render_table(table: TableSchema, columns: list, omitted: int) -> str:
+    header = f"CREATE TABLE {table.name} ("
+    if table.comment:
+        header += f" -- {table.comment}"
+    definitions = [(column.definition, column.comment) for column in columns]
+    definitions += [(constraint, "") for constraint in table.constraints]
+    lines = [header]
+    for i, (definition, comment) in enumerate(definitions):
+        line = f"  {definition}{',' if i < len(definitions) - 1 else ''}"
+        if comment:
+            line += f" -- {comment}"
+        lines.append(line)
+    if omitted:
+        lines.append(f"  -- 省略与问题无关的 {omitted} 列")
+    lines.append(f") {table.suffix};" if table.suffix else ");")
+    return "\n".join(lines)
+
+
+class DDLCompactor:
+    def __init__(self, max_columns=30, embedding_function=None, similarity_threshold=0.5, max_cache_size=20000):
+        """
+        Args:
+            max_columns: 每个表最多保留的非关键列数，列数不超过该值的表保留全部列
+            embedding_function: 文本 -> 向量，提供时同时按列注释与问题的向量相似度选择列
+            similarity_threshold: 向量匹配的最低余弦相似度
+        """
+        self.max_columns = max_columns
+        self.embedding_function = embedding_function
+        self.similarity_threshold = similarity_threshold
+        self.max_cache_size = max_cache_size
+        self.column_embeddings = {}
+        self.lock = threading.Lock()
+
+    def _column_embedding(self, text: str):
+        with self.lock:
+            vector = self.column_embeddings.get(text)
+        if vector is None:
+            vector = np.asarray(self.embedding_function(text), dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+            with self.lock:
+                if len(self.column_embeddings) >= self.max_cache_size:
+                    self.column_embeddings.clear()
+                self.column_embeddings[text] = vector
+        return vector
+
+    def _score_columns(self, columns: list, question_terms: set, question_embedding) -> list:
+        scores = []
+        for column in columns:
+            column_terms = text_terms(f"{column.name} {column.comment}")
+            score = float(len(question_terms & column_terms))
+            if question_embedding is not None and column.comment:
+                try:
+                    similarity = float(np.dot(question_embedding, self._column_embedding(column.comment)))
+                except Exception as e:
+                    logger.warning("计算列注释向量失败，只按词匹配裁剪DDL: %s", e)
+                    question_embedding = None
+                else:
+                    if similarity >= self.similarity_threshold:
+                        score += similarity
+            scores.append(score)
+        return scores
+
+    def _compact_table(self, table: TableSchema, question_terms: set, question_embedding) -> str:
+        others = [column for column in table.columns if not column.is_key]
+        scores = self._score_columns(others, question_terms, question_embedding)
+        ranked = sorted(
+            (item for item in zip(scores, range(len(others))) if item[0] > 0),
+            key=lambda item: -item[0],
+        )[:self.max_columns]
+        if ranked:
+            selected = {id(others[index]) for _, index in ranked}
+        else:
+            # 没有与问题匹配的列时保留前面的列，避免只剩主键
+            selected = {id(column) for column in others[:self.max_columns]}
+        # 保持原来的列顺序
+        columns = [column for column in table.columns if column.is_key or id(column) in selected]
+        return render_table(table, columns, len(table.columns) - len(columns))
+
+    def compact(self, ddl: str, question: str, question_embedding=None) -> str:
+        """只改写列数超过 max_columns 的表，其余语句(索引、视图、单独的外键、说明文字等)原样保留"""
+        statements = parse_ddl(ddl)
+        wide = {
+            id(statement.table) for statement in statements
+            if statement.table is not None and len(statement.table.columns) > self.max_columns
+        }
+        if not wide:
+            return ddl
+
+        question_terms = text_terms(question)
+        if question_embedding is not None:
+            question_embedding = np.asarray(question_embedding, dtype=np.float32)
+            question_embedding = question_embedding / (np.linalg.norm(question_embedding) or 1.0)
+
+        rendered = []
+        for statement in statements:
+            if id(statement.table) in wide:
+                rendered.append(self._compact_table(statement.table, question_terms, question_embedding))
+            elif id(statement.comment_of) in wide:
+                # 注释已合并到裁剪后的表中
+                continue
+            else:
+                rendered.append(statement.text)
+        return "\n\n".join(rendered)
+
+    def compact_list(self, ddl_list: list, question: str, question_embedding=None) -> list:
+        compacted = [self.compact(ddl, question, question_embedding) for ddl in ddl_list]
+        before = sum(len(ddl) for ddl in ddl_list)
+        after = sum(len(ddl) for ddl in compacted)
+        if after < before:
+            logger.debug("DDL裁剪: %d -> %d 字符", before, after)
+        return compacted
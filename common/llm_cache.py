@@ -0,0 +1,178 @@
+"""
+LLM响应缓存：以消息列表、模型和temperature的哈希为键缓存submit_prompt的返回结果。
+
+用于摘要、追问和图表代码这类输入完全相同时结果可以复用的调用(例如仪表盘刷新)，
+按提示词类型(prompt_type)单独开关。后端可选进程内LRU(memory)或SQLite文件(disk)。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def get_prompt_type(kwargs: dict) -> str | None:
+    """
+    取出调用方标记的提示词类型。
+    vanna 的 generate_plotly_code 以 submit_prompt(message_log, kwargs=kwargs) 的形式调用，需要再看一层
+    """
+    prompt_type = kwargs.get("prompt_type")
+    if prompt_type is None and isinstance(kwargs.get("kwargs"), dict):
+        prompt_type = kwargs["kwargs"].get("prompt_type")
+    return prompt_type
+
+
+def prompt_cache_key(prompt, model, temperature) -> str:
+    payload = json.dumps(
+        {"messages": prompt, "model": model, "temperature": temperature},
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryBackend:
+    """进程内LRU"""
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.time():
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.items[key] = (value, time.time() + ttl)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+class DiskBackend:
+    """SQLite文件，多个进程可以共享，重启后仍然有效"""
+
+    def __init__(self, path, max_size=10000):
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS llm_response_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=5)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get(self, key):
+        with self.lock, self._connect() as connection:
+            row = connection.execute(
+                "SELECT value, expires_at FROM llm_response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                connection.execute("DELETE FROM llm_response_cache WHERE key = ?", (key,))
+                return None
+            return row[0]
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self.lock, self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO llm_response_cache (key, value, expires_at, created_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now),
+            )
+            connection.execute("DELETE FROM llm_response_cache WHERE expires_at < ?", (now,))
+            connection.execute(
+                "DELETE FROM llm_response_cache WHERE key IN ("
+                "SELECT key FROM llm_response_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_size,),
+            )
+
+    def clear(self):
+        with self.lock, self._connect() as connection:
+            connection.execute("DELETE FROM llm_response_cache")
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl=3600, prompt_types=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.prompt_types = prompt_types or {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def enabled_for(self, prompt_type: str | None) -> bool:
+        return bool(prompt_type) and bool(self.prompt_types.get(prompt_type, False))
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if value:
+            self.backend.set(key, value, self.ttl)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "ttl": self.ttl,
+                "prompt_types": sorted(name for name, enabled in self.prompt_types.items() if enabled),
+            }
+
+
+def create_response_cache(config: dict | None) -> ResponseCache | None:
+    """根据 LLM_RESPONSE_CACHE_CONFIG 创建缓存，未启用时返回None"""
+    if not config or not config.get("enabled"):
+        return None
+
+    backend_type = config.get("backend", "memory")
+    if backend_type == "memory":
+        backend = MemoryBackend(max_size=config.get("max_size", 1000))
+    elif backend_type == "disk":
+        backend = DiskBackend(config["path"], max_size=config.get("max_size", 10000))
+    else:
+        raise ValueError(f"不支持的LLM响应缓存后端: {backend_type}")
+
+    return ResponseCache(backend, ttl=config.get("ttl", 3600), prompt_types=config.get("prompt_types"))
@@ -0,0 +1,162 @@
+"""
+进程内共享的OpenAI兼容客户端。
+
+每个服务地址(base_url)只创建一个httpx连接池，连接数、keep-alive、连接/读取超时和重试次数
+由 app_config.LLM_CLIENT_CONFIG 统一配置；同一进程中的所有vn实例和连接测试共用这些连接。
+"""
+import asyncio
+import threading
+import weakref
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+from common.logger import get_logger
+
+logger = get_logger(__name__)
+
+QWEN_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+DEEPSEEK_BASE_URL = "https://api.deepseek.com/v1"
+
+DEFAULT_CLIENT_CONFIG = {
+    "max_connections": 50,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 30,
+    "connect_timeout": 5,
+    "read_timeout": 120,
+    "write_timeout": 30,
+    "pool_timeout": 10,
+    "max_retries": 2,
+}
+
+_lock = threading.Lock()
+_http_clients = {}
+_clients = {}
+# httpx.AsyncClient 绑定在创建它的事件循环上，按事件循环分别缓存，事件循环关闭前关闭
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _load_client_config(client_config: dict | None) -> dict:
+    if client_config is None:
+        import app_config
+        client_config = getattr(app_config, "LLM_CLIENT_CONFIG", {})
+    return {**DEFAULT_CLIENT_CONFIG, **client_config}
+
+
+def build_timeout(client_config: dict) -> httpx.Timeout:
+    return httpx.Timeout(
+        connect=client_config["connect_timeout"],
+        read=client_config["read_timeout"],
+        write=client_config["write_timeout"],
+        pool=client_config["pool_timeout"],
+    )
+
+
+def build_limits(client_config: dict) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=client_config["max_connections"],
+        max_keepalive_connections=client_config["max_keepalive_connections"],
+        keepalive_expiry=client_config["keepalive_expiry"],
+    )
+
+
+def get_openai_client(api_key: str, base_url: str, client_config: dict | None = None) -> OpenAI:
+    """
+    返回共享的OpenAI客户端。相同base_url的客户端共用一个连接池，
+    连接池参数以该base_url第一次创建时的配置为准
+    """
+    key = (base_url, api_key)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(key)
+        if client is not None:
+            return client
+
+        client_config = _load_client_config(client_config)
+        timeout = build_timeout(client_config)
+        http_client = _http_clients.get(base_url)
+        if http_client is None:
+            http_client = httpx.Client(limits=build_limits(client_config), timeout=timeout)
+            _http_clients[base_url] = http_client
+            logger.info("创建LLM连接池: %s (max_connections=%s)", base_url, client_config["max_connections"])
+
+        # OpenAI客户端会给每个请求单独设置超时，这里也要传入，否则会使用SDK默认的600秒
+        client = OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=http_client,
+            timeout=timeout,
+            max_retries=client_config["max_retries"],
+        )
+        _clients[key] = client
+        return client
+
+
+async def _close_on_loop_shutdown(loop, clients: dict):
+    """
+    事件循环结束时关闭该循环上的连接池。asyncio.run 在关闭事件循环前会调用 loop.shutdown_asyncgens，
+    关闭所有未结束的异步生成器，这个生成器的finally随之执行
+    """
+    try:
+        yield
+    finally:
+        with _lock:
+            _async_clients.pop(loop, None)
+        for http_client in [value for value in clients.values() if isinstance(value, httpx.AsyncClient)]:
+            await http_client.aclose()
+
+
+async def _start(closer):
+    await closer.__anext__()
+
+
+def get_async_openai_client(api_key: str, base_url: str, client_config: dict | None = None) -> AsyncOpenAI:
+    """
+    返回当前事件循环共享的AsyncOpenAI客户端，必须在事件循环中调用。
+    连接池和超时配置与同步客户端相同
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = _async_clients.get(loop)
+        if clients is None:
+            clients = _async_clients[loop] = {}
+            # 生成器需要在事件循环中启动才会被 shutdown_asyncgens 跟踪，引用保存在clients中
+            clients["closer"] = _close_on_loop_shutdown(loop, clients)
+            loop.create_task(_start(clients["closer"]))
+        client = clients.get((base_url, api_key))
+        if client is not None:
+            return client
+
+        client_config = _load_client_config(client_config)
+        timeout = build_timeout(client_config)
+        http_client = clients.get(base_url)
+        if http_client is None:
+            http_client = httpx.AsyncClient(limits=build_limits(client_config), timeout=timeout)
+            clients[base_url] = http_client
+
+        client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=http_client,
+            timeout=timeout,
+            max_retries=client_config["max_retries"],
+        )
+        clients[(base_url, api_key)] = client
+        return client
+
+
+def async_client_for(client: OpenAI) -> AsyncOpenAI:
+    """与同步客户端使用相同服务地址和API密钥的异步客户端"""
+    return get_async_openai_client(client.api_key, str(client.base_url))
+
+
+def close_all_clients():
+    """关闭所有连接池，一般只在进程退出或测试中使用"""
+    with _lock:
+        for http_client in _http_clients.values():
+            http_client.close()
+        _http_clients.clear()
+        _clients.clear()
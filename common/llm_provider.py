@@ -0,0 +1,320 @@
+"""
+多个LLM服务商之间的熔断和对冲请求。
+
+- 每个服务商一个熔断器：连续失败 failure_threshold 次后熔断，recovery_timeout 秒后放行一个探测请求
+- 按 (服务商, 提示词类型) 记录最近的调用耗时
+- 对冲请求：主服务商在其p95耗时内没有返回时，同时向备用服务商发出相同请求，谁先成功用谁的结果；
+  主服务商出错或已熔断时直接使用备用服务商；流式输出已经发出片段后不再切换
+"""
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from common.logger import get_logger
+from common.openai_chat import OpenAIChatMixin
+
+logger = get_logger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """所有服务商都已熔断"""
+
+
+class StreamCancelled(Exception):
+    """流式输出的消费方已断开：on_token回调抛出该异常以中止LLM调用，不计为服务商失败，也不切换服务商"""
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, recovery_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def _state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.recovery_timeout:
+            return "half_open"
+        return "open"
+
+    @property
+    def state(self) -> str:
+        with self.lock:
+            return self._state()
+
+    def acquire(self) -> bool:
+        """
+        即将发出请求时调用。半开状态只放行一个探测请求，探测结束前其余请求按熔断处理
+        """
+        with self.lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                # 探测失败时重新计时
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+    def release(self):
+        """请求被调用方取消，既不算成功也不算失败，让出探测名额"""
+        with self.lock:
+            self.probing = False
+
+
+class LatencyTracker:
+    def __init__(self, window=200):
+        self.window = window
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, key, seconds: float):
+        with self.lock:
+            self.samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, key, percentile=0.95, min_samples=1) -> float | None:
+        with self.lock:
+            samples = sorted(self.samples.get(key, ()))
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile))]
+
+    def stats(self) -> dict:
+        with self.lock:
+            keys = list(self.samples)
+        return {
+            f"{provider}/{prompt_type}": {
+                "count": len(self.samples[(provider, prompt_type)]),
+                "p50": self.percentile((provider, prompt_type), 0.5),
+                "p95": self.percentile((provider, prompt_type), 0.95),
+            }
+            for provider, prompt_type in keys
+        }
+
+
+class ChatClient(OpenAIChatMixin):
+    """备用服务商的聊天客户端：只向OpenAI兼容接口发送提示词，不具备检索和训练能力"""
+
+    def __init__(self, client, model: str, temperature=0.7):
+        self.client = client
+        self.model = model
+        self.temperature = temperature
+
+    def _build_chat_params(self, prompt, **kwargs):
+        chat_params = {
+            "model": self.model,
+            "messages": prompt,
+            "temperature": kwargs.get("temperature", self.temperature),
+        }
+        if kwargs.get("stop"):
+            chat_params["stop"] = kwargs["stop"]
+        return chat_params, self.model
+
+
+class ProviderPool:
+    def __init__(self, primary: str, secondary: str | None = None, secondary_chat: ChatClient | None = None,
+                 failure_threshold=5, recovery_timeout=30, latency_window=200,
+                 hedge=True, hedge_prompt_types=("sql",), min_samples=20,
+                 default_hedge_delay=10, min_hedge_delay=2, max_hedge_delay=30, max_workers=32):
+        """
+        熔断器和耗时统计按实际使用的服务商(客户端的服务地址，见 common.llm_usage.provider_of)区分，
+        模型路由(LLM_ROUTING_CONFIG)把调用发给其他服务商时，统计计入该服务商。
+
+        Args:
+            primary: 主服务商名称(即vn自身的LLM)
+            secondary: 备用服务商名称
+            secondary_chat: 备用服务商的ChatClient
+        """
+        self.primary = primary
+        self.secondary = secondary if secondary_chat is not None else None
+        self.secondary_chat = secondary_chat
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.breakers = {}
+        self.latency = LatencyTracker(latency_window)
+        self.hedge = hedge
+        self.hedge_prompt_types = set(hedge_prompt_types or ())
+        self.min_samples = min_samples
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_delay = max_hedge_delay
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm_provider")
+        self.hedged_requests = 0
+        self.hedge_wins = 0
+        self.lock = threading.Lock()
+
+    def breaker(self, provider: str) -> CircuitBreaker:
+        with self.lock:
+            if provider not in self.breakers:
+                self.breakers[provider] = CircuitBreaker(self.failure_threshold, self.recovery_timeout)
+            return self.breakers[provider]
+
+    def hedge_delay(self, provider: str, prompt_type: str | None) -> float:
+        p95 = self.latency.percentile((provider, prompt_type), 0.95, self.min_samples)
+        if p95 is None:
+            return self.default_hedge_delay
+        return min(self.max_hedge_delay, max(self.min_hedge_delay, p95))
+
+    def _available(self, attempts: list) -> list:
+        available = [attempt for attempt in attempts if self.breaker(attempt[0]).state != "open"]
+        if not available:
+            raise CircuitOpenError(f"LLM服务商均已熔断: {', '.join(name for name, _ in attempts)}")
+        return available
+
+    def _acquire_next(self, queue: list):
+        """从候选中取出下一个熔断器放行的服务商，没有时返回None"""
+        while queue:
+            name, func = queue.pop(0)
+            if self.breaker(name).acquire():
+                return name, func
+        return None
+
+    def _timed(self, provider: str, prompt_type: str | None, func):
+        # 在调用方的上下文中执行，保留用量计量的用户等上下文变量
+        context = contextvars.copy_context()
+        breaker = self.breaker(provider)
+
+        def run():
+            start = time.monotonic()
+            try:
+                response = context.run(func)
+            except StreamCancelled:
+                breaker.release()
+                raise
+            except Exception:
+                breaker.record_failure()
+                raise
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            self.latency.record((provider, prompt_type), time.monotonic() - start)
+            return response
+        return run
+
+    def call(self, prompt_type: str | None, attempts: list, allow_hedge=True, can_failover=None):
+        """
+        按熔断状态和对冲策略调用服务商
+
+        Args:
+            attempts: [(服务商, 无参调用函数)]，按优先级排列
+            allow_hedge: 是否允许同时发出对冲请求(流式输出时不能对冲)
+            can_failover: 返回是否还能改用下一个服务商的函数；流式输出已经把片段交给调用方后，
+                再切换服务商会让两个服务商的输出混在一起，此时直接抛出原错误
+        """
+        queue = self._available(attempts)
+        acquired = self._acquire_next(queue)
+        if acquired is None:
+            raise CircuitOpenError(f"LLM服务商正在探测恢复: {', '.join(name for name, _ in attempts)}")
+        first_name, first_call = acquired
+        if first_name != attempts[0][0]:
+            logger.warning("LLM服务商 %s 已熔断，使用 %s", attempts[0][0], first_name)
+
+        hedge = allow_hedge and self.hedge and queue and prompt_type in self.hedge_prompt_types
+        pending = {self.executor.submit(self._timed(first_name, prompt_type, first_call)): first_name}
+        timeout = self.hedge_delay(first_name, prompt_type) if hedge else None
+        last_error = None
+        while pending:
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # 超过p95耗时仍未返回，发出对冲请求
+                acquired = self._acquire_next(queue)
+                if acquired is not None:
+                    name, func = acquired
+                    logger.debug("%s 超过 %.1fs 未返回，对冲请求 %s", first_name, timeout, name)
+                    with self.lock:
+                        self.hedged_requests += 1
+                    pending[self.executor.submit(self._timed(name, prompt_type, func))] = name
+                timeout = None
+                continue
+
+            for future in done:
+                name = pending.pop(future)
+                error = future.exception()
+                if isinstance(error, StreamCancelled):
+                    raise error
+                if error is None:
+                    if name != first_name and len(pending) > 0:
+                        with self.lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                last_error = error
+
+            if not pending:
+                if can_failover is not None and not can_failover():
+                    raise last_error
+                # 前一个服务商失败，立即改用下一个
+                acquired = self._acquire_next(queue)
+                if acquired is not None:
+                    name, func = acquired
+                    logger.warning("LLM服务商调用失败，改用 %s: %s", name, last_error)
+                    pending[self.executor.submit(self._timed(name, prompt_type, func))] = name
+
+        raise last_error
+
+    async def acall(self, prompt_type: str | None, attempts: list, can_failover=None):
+        """
+        call 的异步版本，只做熔断和失败切换，不发对冲请求
+
+        Args:
+            attempts: [(服务商, 返回协程的无参函数)]，按优先级排列
+        """
+        queue = self._available(attempts)
+        last_error = CircuitOpenError(f"LLM服务商正在探测恢复: {', '.join(name for name, _ in attempts)}")
+        while True:
+            acquired = self._acquire_next(queue)
+            if acquired is None:
+                raise last_error
+            name, func = acquired
+            breaker = self.breaker(name)
+            start = time.monotonic()
+            try:
+                response = await func()
+            except StreamCancelled:
+                breaker.release()
+                raise
+            except Exception as e:
+                breaker.record_failure()
+                logger.warning("LLM服务商 %s 调用失败: %s", name, e)
+                if can_failover is not None and not can_failover():
+                    raise
+                last_error = e
+                continue
+            except BaseException:
+                # 任务被取消(asyncio.CancelledError)时让出探测名额，否则该服务商不会再被放行
+                breaker.release()
+                raise
+            breaker.record_success()
+            self.latency.record((name, prompt_type), time.monotonic() - start)
+            return response
+
+    def stats(self) -> dict:
+        with self.lock:
+            breakers = dict(self.breakers)
+            hedged_requests, hedge_wins = self.hedged_requests, self.hedge_wins
+        return {
+            "primary": self.primary,
+            "secondary": self.secondary,
+            "breakers": {name: breaker.state for name, breaker in breakers.items()},
+            "latency": self.latency.stats(),
+            "hedged_requests": hedged_requests,
+            "hedge_wins": hedge_wins,
+        }
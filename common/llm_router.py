@@ -0,0 +1,64 @@
+"""
+按提示词类型选择服务商和模型。
+
+路由表见 app_config.LLM_ROUTING_CONFIG：SQL生成使用效果最好的模型，
+摘要、追问、图表代码、训练时的问题生成等简单任务使用更快更便宜的模型。
+"""
+from common.llm_client import DEEPSEEK_BASE_URL, QWEN_BASE_URL, get_openai_client
+from common.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+PROMPT_TYPES = ("sql", "summary", "followup", "plotly", "question")
+
+DEFAULT_BASE_URLS = {
+    "qwen": QWEN_BASE_URL,
+    "deepseek": DEEPSEEK_BASE_URL,
+}
+
+
+class LLMRouter:
+    def __init__(self, routes: dict, provider_configs: dict):
+        """
+        Args:
+            routes: {提示词类型: {"provider", "model", "fallback_model"}}
+            provider_configs: {服务商: 配置字典(api_key, base_url)}，例如 {"qwen": QWEN_CONFIG}
+        """
+        self.routes = routes or {}
+        self.provider_configs = provider_configs or {}
+
+    def __repr__(self):
+        # 配置会被打印，不输出服务商配置中的API密钥
+        return f"LLMRouter(routes={self.routes})"
+
+    def _client_for(self, provider: str):
+        provider_config = self.provider_configs.get(provider) or {}
+        if not provider_config.get("api_key"):
+            return None
+        base_url = provider_config.get("base_url", DEFAULT_BASE_URLS.get(provider))
+        return get_openai_client(provider_config["api_key"], base_url)
+
+    def resolve(self, prompt_type: str | None, fallback: bool = False) -> dict | None:
+        """
+        返回提示词类型对应的 {"client", "model"}；没有配置路由，或服务商缺少API密钥时返回None(使用默认模型)。
+        fallback=True 时使用路由中的 fallback_model，没有配置时返回None。
+        """
+        route = self.routes.get(prompt_type) if prompt_type else None
+        if not route:
+            return None
+
+        model = route.get("fallback_model") if fallback else route.get("model")
+        if not model:
+            return None
+
+        provider = route.get("fallback_provider", route.get("provider")) if fallback else route.get("provider")
+        client = self._client_for(provider)
+        if client is None:
+            logger.warning("路由 %s -> %s/%s 缺少API密钥，使用默认模型", prompt_type, provider, model)
+            return None
+        return {"client": client, "model": model, "provider": provider}
+
+    def has_fallback(self, prompt_type: str | None) -> bool:
+        route = self.routes.get(prompt_type) if prompt_type else None
+        return bool(route and route.get("fallback_model"))
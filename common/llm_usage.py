@@ -0,0 +1,222 @@
+"""
+LLM调用的token用量统计，包括服务商上下文缓存(前缀缓存)命中的token数。
+
+- DeepSeek: usage.prompt_cache_hit_tokens / usage.prompt_cache_miss_tokens
+- 百炼(DashScope)兼容接口: usage.prompt_tokens_details.cached_tokens
+流式调用需要设置 stream_options={"include_usage": True}，用量在最后一个(没有choices的)片段中返回。
+
+每次调用的服务商、模型、提示词类型、token数、首个片段耗时、总耗时和用户追加写入JSONL文件，
+并在内存中按用户、提示词类型和模型汇总。用户由Web请求通过 set_current_user 绑定到当前上下文。
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+
+from common.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def extract_usage(usage) -> dict | None:
+    """把不同服务商返回的usage统一为 {prompt_tokens, completion_tokens, cached_tokens}"""
+    if usage is None:
+        return None
+    cached_tokens = getattr(usage, "prompt_cache_hit_tokens", None)
+    if cached_tokens is None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) if details is not None else None
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "cached_tokens": cached_tokens or 0,
+    }
+
+
+def provider_of(client) -> str:
+    base_url = getattr(client, "base_url", None)
+    return getattr(base_url, "host", None) or str(base_url)
+
+
+class UsageStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = {}
+
+    def record(self, provider: str, model: str, usage) -> dict | None:
+        usage = extract_usage(usage)
+        if usage is None:
+            return None
+        with self.lock:
+            totals = self.totals.setdefault(
+                (provider, model),
+                {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0},
+            )
+            totals["requests"] += 1
+            for name, value in usage.items():
+                totals[name] += value
+        if usage["cached_tokens"]:
+            logger.debug("%s 上下文缓存命中 %d/%d tokens", model, usage["cached_tokens"], usage["prompt_tokens"])
+        return usage
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                f"{provider}/{model}": {
+                    **totals,
+                    "cache_hit_rate": totals["cached_tokens"] / totals["prompt_tokens"] if totals["prompt_tokens"] else 0.0,
+                }
+                for (provider, model), totals in self.totals.items()
+            }
+
+
+class UsageMeter:
+    """每次LLM调用的明细追加写入JSONL文件(path为None时只在内存中汇总)"""
+
+    GROUP_FIELDS = ("user", "prompt_type", "provider", "model")
+
+    def __init__(self, path: str | None = None):
+        self.lock = threading.Lock()
+        self.totals = {}
+        self.path = None
+        self._file = None
+        self.configure(path)
+
+    def configure(self, path: str | None):
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.path = path
+            if path:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                # 行缓冲：每条记录一行，进程退出时不会丢失已写入的记录
+                self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def record(self, entry: dict):
+        key = tuple(entry.get(name) for name in self.GROUP_FIELDS)
+        line = json.dumps(entry, ensure_ascii=False) + "\n" if self._file is not None else None
+        with self.lock:
+            totals = self.totals.setdefault(key, {
+                "requests": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0,
+                "latency_ms": 0.0, "max_latency_ms": 0.0, "streamed": 0, "ttft_ms": 0.0,
+            })
+            totals["requests"] += 1
+            totals["errors"] += 1 if entry.get("error") else 0
+            for name in ("prompt_tokens", "completion_tokens", "cached_tokens", "latency_ms"):
+                totals[name] += entry.get(name) or 0
+            totals["max_latency_ms"] = max(totals["max_latency_ms"], entry.get("latency_ms") or 0)
+            if entry.get("ttft_ms") is not None:
+                totals["streamed"] += 1
+                totals["ttft_ms"] += entry["ttft_ms"]
+            if line is not None:
+                self._file.write(line)
+
+    def aggregate(self, group_by=("user",)) -> list:
+        """按 user / prompt_type / provider / model 中的若干字段汇总"""
+        indexes = [self.GROUP_FIELDS.index(name) for name in group_by]
+        groups = {}
+        with self.lock:
+            for key, totals in self.totals.items():
+                group = groups.setdefault(tuple(key[i] for i in indexes), {name: 0 for name in totals})
+                for name, value in totals.items():
+                    group[name] = max(group[name], value) if name == "max_latency_ms" else group[name] + value
+        rows = []
+        for key, totals in groups.items():
+            requests = totals.pop("requests")
+            streamed = totals.pop("streamed")
+            rows.append({
+                **dict(zip(group_by, key)),
+                "requests": requests,
+                **{name: value for name, value in totals.items() if name not in ("latency_ms", "ttft_ms")},
+                "avg_latency_ms": round(totals["latency_ms"] / requests, 1) if requests else 0.0,
+                "avg_ttft_ms": round(totals["ttft_ms"] / streamed, 1) if streamed else None,
+            })
+        return sorted(rows, key=lambda row: -row["prompt_tokens"] - row["completion_tokens"])
+
+
+# 进程内共享
+usage_stats = UsageStats()
+usage_meter = UsageMeter()
+
+_current_user = contextvars.ContextVar("llm_usage_user", default=None)
+
+
+def set_current_user(user) -> contextvars.Token:
+    """把当前请求的用户(SimpleUserAuth.get_user 的结果或用户名)绑定到当前线程/任务"""
+    if isinstance(user, dict):
+        user = user.get("username")
+    return _current_user.set(user)
+
+
+def get_current_user() -> str | None:
+    return _current_user.get()
+
+
+class LLMCall:
+    """
+    一次LLM调用的计量：通过 create/acreate 发出请求；流式调用在输出每个文本片段时调用 token()，
+    流结束(包括提前关闭)时调用 finish()，非流式调用在返回时自动记录
+    """
+
+    def __init__(self, client, model: str, prompt_type: str | None = None):
+        self.client = client
+        self.model = model
+        self.prompt_type = prompt_type
+        self.stream = False
+        self.user = get_current_user()
+        self.usage = None
+        self.started = time.monotonic()
+        self.first_token_at = None
+        self.finished = False
+
+    def create(self, params: dict):
+        self.stream = bool(params.get("stream"))
+        try:
+            response = self.client.chat.completions.create(**params)
+        except Exception as e:
+            self.finish(error=e)
+            raise
+        if not self.stream:
+            self.finish(response.usage)
+        return response
+
+    async def acreate(self, params: dict):
+        self.stream = bool(params.get("stream"))
+        try:
+            response = await self.client.chat.completions.create(**params)
+        except Exception as e:
+            self.finish(error=e)
+            raise
+        if not self.stream:
+            self.finish(response.usage)
+        return response
+
+    def token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+
+    def finish(self, usage=None, error: Exception | None = None):
+        if self.finished:
+            return
+        self.finished = True
+        usage = usage if usage is not None else self.usage
+        provider = provider_of(self.client)
+        counts = usage_stats.record(provider, self.model, usage) or {}
+        now = time.monotonic()
+        usage_meter.record({
+            "ts": round(time.time(), 3),
+            "user": self.user,
+            "provider": provider,
+            "model": self.model,
+            "prompt_type": self.prompt_type,
+            "stream": self.stream,
+            "prompt_tokens": counts.get("prompt_tokens", 0),
+            "completion_tokens": counts.get("completion_tokens", 0),
+            "cached_tokens": counts.get("cached_tokens", 0),
+            # 非流式调用没有首个片段耗时
+            "ttft_ms": round((self.first_token_at - self.started) * 1000, 1) if self.first_token_at else None,
+            "latency_ms": round((now - self.started) * 1000, 1),
+            "error": type(error).__name__ if error is not None else None,
+        })
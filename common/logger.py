@@ -0,0 +1,130 @@
+"""
+应用日志：分级、惰性格式化、大段内容(提示词等)抽样输出，通过队列交给后台线程写出。
+
+热路径上的 print 会在请求线程中同步写stdout(持有GIL)，多KB的提示词写出占请求耗时的明显一部分。
+这里的日志记录只把LogRecord放入有界队列，格式化和写出都在 QueueListener 的后台线程中完成；
+队列满时丢弃记录并计数，不阻塞请求。配置见 app_config.LOGGING_CONFIG。
+"""
+import atexit
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+ROOT_LOGGER_NAME = "vanna_app"
+
+_state = {"listener": None, "handler": None, "sample_rate": 0.0, "max_payload_chars": 2000}
+_lock = threading.Lock()
+
+
+def get_logger(name: str) -> logging.Logger:
+    """应用内的logger都挂在 vanna_app 下，只由 setup_logging 配置，不影响第三方库的日志"""
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}")
+
+
+class DroppingQueueHandler(QueueHandler):
+    """队列满时丢弃记录；记录原样入队，格式化推迟到后台线程"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 同一进程内的队列不需要序列化，msg % args 留给后台线程的Formatter
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _BlockingStopListener(QueueListener):
+    def enqueue_sentinel(self):
+        # 队列满时等待后台线程腾出位置，不能像日志记录一样丢弃结束标记
+        self.queue.put(self._sentinel)
+
+
+class _Truncated:
+    """惰性截断：只在记录真正被格式化时才转成字符串"""
+
+    __slots__ = ("payload", "max_chars")
+
+    def __init__(self, payload, max_chars: int):
+        self.payload = payload
+        self.max_chars = max_chars
+
+    def __str__(self):
+        text = str(self.payload)
+        if self.max_chars and len(text) > self.max_chars:
+            return f"{text[:self.max_chars]}...(共 {len(text)} 字符)"
+        return text
+
+
+def log_payload(logger: logging.Logger, label: str, payload):
+    """
+    按DEBUG级别抽样记录大段内容(完整提示词、消息等)。
+    未开启DEBUG或没有抽中时直接返回，不做任何字符串处理
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    sample_rate = _state["sample_rate"]
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    logger.debug("%s: %s", label, _Truncated(payload, _state["max_payload_chars"]))
+
+
+def setup_logging(config: dict | None = None):
+    """
+    Args:
+        config: level 日志级别; payload_sample_rate 大段内容的抽样比例(0~1);
+            max_payload_chars 大段内容最多输出的字符数; queue_size 队列长度;
+            file 日志文件路径(为None时只输出到stdout)
+    """
+    config = config or {}
+    with _lock:
+        log_queue = queue.Queue(maxsize=config.get("queue_size", 10000))
+        formatter = logging.Formatter(config.get("format", "%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
+        handlers = [logging.StreamHandler(sys.stdout)]
+        if config.get("file"):
+            os.makedirs(os.path.dirname(os.path.abspath(config["file"])), exist_ok=True)
+            handlers.append(logging.FileHandler(config["file"], encoding="utf-8"))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        queue_handler = DroppingQueueHandler(log_queue)
+        root = logging.getLogger(ROOT_LOGGER_NAME)
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        if _state["listener"] is not None:
+            # 先摘掉旧的handler再停止，写出旧队列中剩余的记录
+            _state["listener"].stop()
+        root.addHandler(queue_handler)
+        root.setLevel(config.get("level", "INFO"))
+        root.propagate = False
+
+        listener = _BlockingStopListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        _state.update(
+            listener=listener,
+            handler=queue_handler,
+            sample_rate=float(config.get("payload_sample_rate", 0.0)),
+            max_payload_chars=config.get("max_payload_chars", 2000),
+        )
+
+
+def shutdown_logging():
+    """写出队列中剩余的记录"""
+    with _lock:
+        if _state["listener"] is not None:
+            _state["listener"].stop()
+            _state["listener"] = None
+            if _state["handler"].dropped:
+                print(f"[WARNING] 日志队列已满，共丢弃 {_state['handler'].dropped} 条日志")
+
+
+atexit.register(shutdown_logging)
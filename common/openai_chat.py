@@ -0,0 +1,143 @@
+"""
+OpenAI兼容接口(千问、DeepSeek)的提交逻辑，各聊天类和备用服务商的 ChatClient 共用。
+
+- 调用方传入on_token回调，或生成SQL时启用提前结束(sql_early_stop)时使用流式接收，
+  收到完整SQL后立即关闭流，不再等待后面的解释
+- 每次调用通过 LLMCall 计量token用量和耗时；流被提前关闭或任务被取消时同时关闭底层的HTTP流
+- 模型路由(LLM_ROUTING_CONFIG)可以通过client参数指定其他服务商的客户端
+
+子类提供 self.client，并实现 _build_chat_params(prompt, **kwargs) -> (参数字典, 模型名)，
+只包含各服务商自己的参数(模型选择、温度、停止序列等)。
+"""
+from common.llm_cache import get_prompt_type
+from common.llm_client import async_client_for
+from common.llm_usage import LLMCall
+from common.logger import get_logger, log_payload
+from common.sql_stream import SqlStreamDetector
+
+logger = get_logger(__name__)
+
+
+class OpenAIChatMixin:
+    def _build_chat_params(self, prompt, **kwargs):
+        raise NotImplementedError
+
+    def _use_stream(self, kwargs: dict) -> bool:
+        return kwargs.get("on_token") is not None or bool(kwargs.get("sql_early_stop"))
+
+    def _stream_params(self, prompt, kwargs: dict):
+        chat_params, model = self._build_chat_params(prompt, **kwargs)
+        chat_params["stream"] = True
+        # 最后一个片段返回token用量(含上下文缓存命中数)
+        chat_params["stream_options"] = {"include_usage": True}
+        return chat_params, model
+
+    @staticmethod
+    def _chunk_content(call, chunk, thinking: list):
+        if getattr(chunk, "usage", None):
+            call.usage = chunk.usage
+        if getattr(chunk, "thinking", None):
+            thinking.append(chunk.thinking)
+        if not chunk.choices:
+            return None
+        return getattr(chunk.choices[0].delta, "content", None)
+
+    def stream_submit_prompt(self, prompt, **kwargs):
+        """
+        流式提交提示词，逐个yield模型输出的文本片段(推理内容不输出，只写入日志)。
+        生成器被提前关闭时会同时关闭底层的HTTP流。
+        """
+        chat_params, model = self._stream_params(prompt, kwargs)
+        call = LLMCall(kwargs.get("client") or self.client, model, get_prompt_type(kwargs))
+        response_stream = call.create(chat_params)
+        thinking = []
+        try:
+            for chunk in response_stream:
+                content = self._chunk_content(call, chunk, thinking)
+                if content:
+                    call.token()
+                    yield content
+        except Exception as e:
+            call.finish(error=e)
+            raise
+        finally:
+            try:
+                response_stream.close()
+            finally:
+                call.finish()
+            if thinking:
+                log_payload(logger, "Model thinking process", "".join(thinking))
+
+    def submit_prompt(self, prompt, **kwargs) -> str:
+        if not self._use_stream(kwargs):
+            chat_params, model = self._build_chat_params(prompt, **kwargs)
+            call = LLMCall(kwargs.get("client") or self.client, model, get_prompt_type(kwargs))
+            return call.create(chat_params).choices[0].message.content
+
+        on_token = kwargs.get("on_token")
+        detector = SqlStreamDetector() if kwargs.get("sql_early_stop") else None
+        collected_content = []
+        stream = self.stream_submit_prompt(prompt, **kwargs)
+        try:
+            for token in stream:
+                collected_content.append(token)
+                if on_token is not None:
+                    on_token(token)
+                if detector is not None and detector.feed(token):
+                    logger.debug("已收到完整SQL，提前结束流式输出")
+                    break
+        finally:
+            stream.close()
+        return "".join(collected_content)
+
+    async def astream_submit_prompt(self, prompt, **kwargs):
+        """
+        stream_submit_prompt 的异步版本，逐个yield文本片段。
+        任务被取消或提前停止迭代时关闭底层的HTTP流。
+        """
+        chat_params, model = self._stream_params(prompt, kwargs)
+        call = LLMCall(async_client_for(kwargs.get("client") or self.client), model, get_prompt_type(kwargs))
+        response_stream = await call.acreate(chat_params)
+        thinking = []
+        try:
+            async for chunk in response_stream:
+                content = self._chunk_content(call, chunk, thinking)
+                if content:
+                    call.token()
+                    yield content
+        except Exception as e:
+            call.finish(error=e)
+            raise
+        finally:
+            try:
+                await response_stream.close()
+            finally:
+                call.finish()
+            if thinking:
+                log_payload(logger, "Model thinking process", "".join(thinking))
+
+    async def asubmit_prompt(self, prompt, **kwargs) -> str:
+        """
+        submit_prompt 的异步版本，等待LLM响应时不占用线程；支持on_token回调
+        """
+        if not self._use_stream(kwargs):
+            chat_params, model = self._build_chat_params(prompt, **kwargs)
+            call = LLMCall(async_client_for(kwargs.get("client") or self.client), model, get_prompt_type(kwargs))
+            response = await call.acreate(chat_params)
+            return response.choices[0].message.content
+
+        on_token = kwargs.get("on_token")
+        detector = SqlStreamDetector() if kwargs.get("sql_early_stop") else None
+        collected_content = []
+        stream = self.astream_submit_prompt(prompt, **kwargs)
+        try:
+            async for token in stream:
+                collected_content.append(token)
+                if on_token is not None:
+                    on_token(token)
+                if detector is not None and detector.feed(token):
+                    logger.debug("已收到完整SQL，提前结束流式输出")
+                    break
+        finally:
+            await stream.aclose()
+        return "".join(collected_content)
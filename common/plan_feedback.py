@@ -0,0 +1,147 @@
+"""
+执行计划反馈：生成的SQL估算代价过高时，让LLM改写为等价且更便宜的查询。
+
+EXPLAIN 显示代价超过阈值、大表全表扫描或分区没有被裁剪时，把精简的执行计划和相关表上的索引
+(pg_indexes)连同原SQL发回LLM，要求改写。只有改写后的估算代价更低、结果列(列名和类型)相同，
+并且没有引入原SQL中没有的字面量或LIMIT(即没有新增过滤条件或行数限制)时才采用改写。
+"""
+import sqlparse
+from sqlparse import tokens as T
+
+from common.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 与字面量一样会改变结果行的关键字
+_FILTER_KEYWORDS = {"NULL", "NOT NULL", "TRUE", "FALSE", "LIMIT", "FETCH", "OFFSET"}
+
+
+def plan_problems(summary: dict, cost_threshold=1e6, big_table_rows=1e6, max_partitions=8) -> list:
+    """执行计划中值得改写的问题，没有问题时返回空列表"""
+    problems = []
+    if cost_threshold and summary["total_cost"] > cost_threshold:
+        problems.append(f"估算总代价 {summary['total_cost']:.0f} 超过 {cost_threshold:.0f}")
+    for scan in summary["seq_scans"]:
+        if big_table_rows and (scan["rows"] or 0) > big_table_rows:
+            problems.append(f"大表 {scan['relation']} 全表扫描(估算 {scan['rows']:.0f} 行)")
+    if max_partitions and summary.get("max_append_children", 0) > max_partitions:
+        problems.append(f"扫描了 {summary['max_append_children']} 个分区，分区没有被裁剪")
+    return problems
+
+
+def filter_tokens(sql: str) -> set:
+    """SQL中的字面量和NULL、LIMIT等关键字"""
+    tokens = set()
+    for statement in sqlparse.parse(sql):
+        for token in statement.flatten():
+            if token.ttype in T.Literal:
+                tokens.add(token.value)
+            elif token.ttype in T.Keyword and token.normalized in _FILTER_KEYWORDS:
+                tokens.add(token.normalized)
+    return tokens
+
+
+def added_filters(sql: str, candidate: str) -> set:
+    """
+    改写后新出现的字面量和关键字。等价改写只会调整连接、子查询和聚合的写法，新增的日期、
+    数值或LIMIT意味着LLM加了原问题中没有的过滤条件(如为了裁剪分区)，结果行会不同
+    """
+    return filter_tokens(candidate) - filter_tokens(sql)
+
+
+def condense_plan(summary: dict) -> str:
+    node_types = ", ".join(f"{name} x{count}" for name, count in sorted(summary["node_types"].items()))
+    lines = [
+        f"顶层节点: {summary['top_node']}，估算总代价 {summary['total_cost']:.0f}，估算行数 {summary['plan_rows']:.0f}",
+        f"节点类型: {node_types}",
+    ]
+    for scan in summary["seq_scans"]:
+        lines.append(f"全表扫描: {scan['relation']} (估算 {scan['rows'] or 0:.0f} 行)")
+    return "\n".join(lines)
+
+
+def build_rewrite_prompt(question: str, sql: str, summary: dict, problems: list, indexes: list) -> str:
+    index_lines = "\n".join(f"- {index['definition']}" for index in indexes) or "- (相关表上没有索引)"
+    return (
+        f"下面的PostgreSQL查询用于回答问题: {question}\n\n"
+        f"```sql\n{sql}\n```\n\n"
+        f"EXPLAIN估算的执行计划:\n{condense_plan(summary)}\n\n"
+        f"存在的问题:\n" + "\n".join(f"- {problem}" for problem in problems) + "\n\n"
+        f"相关表上的索引:\n{index_lines}\n\n"
+        "请改写为结果完全相同(列名、列顺序和行都相同)但执行代价更低的查询，"
+        "尽量利用上面的索引、提前过滤和聚合。不要增加原SQL中没有的过滤条件或LIMIT。只返回一条SQL，不要解释。"
+    )
+
+
+class PlanFeedback:
+    def __init__(self, guard, cost_threshold=1e6, big_table_rows=1e6, max_partitions=8, max_indexes=30):
+        """
+        Args:
+            guard: common.sql_guard.SQLGuard，用于EXPLAIN、查询索引和结果列
+            cost_threshold: 估算总代价超过该值时尝试改写
+            big_table_rows: 全表扫描估算行数超过该值的表视为大表
+            max_partitions: Append节点下扫描的分区数超过该值时视为没有裁剪分区
+            max_indexes: 提示词中最多列出的索引数
+        """
+        self.guard = guard
+        self.cost_threshold = cost_threshold
+        self.big_table_rows = big_table_rows
+        self.max_partitions = max_partitions
+        self.max_indexes = max_indexes
+        self.attempted = 0
+        self.accepted = 0
+        self.rejected_filters = 0
+
+    def _plan_summary(self, sql: str) -> dict | None:
+        # 只EXPLAIN，不经过 check：候选SQL不会被执行，不能计入拒绝和LIMIT统计
+        from common.sql_guard import SQLGuardError
+
+        try:
+            return self.guard.plan_summary(sql)
+        except SQLGuardError as e:
+            logger.debug("无法获取执行计划，跳过改写: %s", e)
+            return None
+
+    def improve(self, question: str, sql: str, rewrite) -> str:
+        """
+        Args:
+            rewrite: 提示词 -> 改写后的SQL
+        Returns:
+            str: 采用的SQL，没有问题或改写不满足条件时返回原SQL
+        """
+        summary = self._plan_summary(sql)
+        if summary is None:
+            return sql
+        problems = plan_problems(summary, self.cost_threshold, self.big_table_rows, self.max_partitions)
+        if not problems:
+            return sql
+
+        self.attempted += 1
+        logger.debug("执行计划代价较高，尝试改写SQL: %s", "; ".join(problems))
+        relations = [scan["relation"] for scan in summary["seq_scans"] if scan["relation"]]
+        indexes = self.guard.get_indexes(relations)[:self.max_indexes]
+        candidate = rewrite(build_rewrite_prompt(question, sql, summary, problems, indexes))
+        if not candidate or candidate.strip() == sql.strip():
+            return sql
+
+        added = added_filters(sql, candidate)
+        if added:
+            self.rejected_filters += 1
+            logger.info("改写后的SQL新增了过滤条件或LIMIT(%s)，保留原SQL。\n原SQL: %s\n改写: %s",
+                        ", ".join(sorted(added)), sql, candidate)
+            return sql
+        candidate_summary = self._plan_summary(candidate)
+        if candidate_summary is None or candidate_summary["total_cost"] >= summary["total_cost"]:
+            logger.debug("改写后的SQL估算代价没有降低，保留原SQL")
+            return sql
+        if self.guard.result_columns(candidate) != self.guard.result_columns(sql):
+            logger.debug("改写后的SQL结果列名或类型不同，保留原SQL")
+            return sql
+
+        self.accepted += 1
+        logger.info("采用改写后的SQL，估算代价 %.0f -> %.0f\n原SQL: %s\n改写: %s",
+                    summary["total_cost"], candidate_summary["total_cost"], sql, candidate)
+        return candidate
+
+    def stats(self) -> dict:
+        return {"attempted": self.attempted, "accepted": self.accepted, "rejected_filters": self.rejected_filters}
@@ -0,0 +1,93 @@
+"""
+查询结果返回后的LLM任务(摘要、追问、图表代码)并行执行。
+
+三个任务互不依赖，放到共享的有界线程池中同时提交，哪个先完成先返回哪个，
+每个任务有独立的超时；一个问题的总耗时约等于最慢的单个调用。
+超时只是不再等待结果：已经开始的任务会继续运行到LLM调用结束，期间占用线程池中的一个线程。
+"""
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+POST_QUERY_TASKS = ("summary", "followup", "plotly")
+# /api/v0/ask 默认只生成图表(与原来 visualize=True 的行为一致)，摘要和追问通过请求的tasks参数开启
+ASK_POST_QUERY_TASKS = ("plotly",)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(max_workers: int = 16) -> ThreadPoolExecutor:
+    """进程内共享的线程池，限制同时进行的LLM调用数；max_workers以第一次创建时为准"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="post_query")
+    return _executor
+
+
+def build_post_query_tasks(vn, question: str, sql: str, df, tasks=POST_QUERY_TASKS,
+                           n_followup_questions: int = 5, on_summary_token=None) -> dict:
+    """
+    Returns:
+        dict: {任务名: 无参函数}
+    """
+    def summary():
+        if on_summary_token is not None:
+            return vn.generate_summary(question, df, on_token=on_summary_token)
+        return vn.generate_summary(question, df)
+
+    def followup():
+        questions = vn.generate_followup_questions(question, sql, df, n_questions=n_followup_questions)
+        return [item for item in questions if item.strip()]
+
+    def plotly():
+        plotly_code = vn.generate_plotly_code(
+            question=question,
+            sql=sql,
+            df_metadata=f"Running df.dtypes gives:\n {df.dtypes}",
+        )
+        fig = vn.get_plotly_figure(plotly_code=plotly_code, df=df)
+        return fig.to_json() if fig is not None else None
+
+    available = {"summary": summary, "followup": followup, "plotly": plotly}
+    return {name: available[name] for name in tasks if name in available}
+
+
+def run_tasks(tasks: dict, timeouts=60, max_workers: int = 16):
+    """
+    并行执行任务，按完成顺序逐个yield (任务名, 结果, 异常)；超时的任务yield TimeoutError。
+    超时的任务只有还没开始时才会被取消；已经开始的任务无法中断，会继续运行到LLM调用返回
+    (最长为LLM客户端的读取超时，见 LLM_CLIENT_CONFIG)，结果被丢弃，期间占用线程池中的线程
+
+    Args:
+        tasks: {任务名: 无参函数}
+        timeouts: 所有任务共用的超时秒数，或 {任务名: 超时秒数}
+    """
+    executor = get_executor(max_workers)
+    start = time.monotonic()
+    deadlines = {}
+    futures = {}
+    for name, func in tasks.items():
+        timeout = timeouts.get(name, 60) if isinstance(timeouts, dict) else timeouts
+        # 每个任务在调用方上下文的副本中执行，保留用量计量的用户等上下文变量
+        future = executor.submit(contextvars.copy_context().run, func)
+        futures[future] = name
+        deadlines[future] = start + timeout
+
+    pending = set(futures)
+    while pending:
+        wait_time = max(0, min(deadlines[future] for future in pending) - time.monotonic())
+        done, _ = wait(pending, timeout=wait_time, return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.discard(future)
+            error = future.exception()
+            yield futures[future], (None if error else future.result()), error
+
+        now = time.monotonic()
+        for future in [future for future in pending if deadlines[future] <= now]:
+            pending.discard(future)
+            future.cancel()
+            yield futures[future], None, TimeoutError(f"{futures[future]} 任务超时")
@@ -0,0 +1,118 @@
+"""
+训练时由SQL生成的问题的持久化缓存。
+
+以规范化SQL(去掉注释、统一关键字大小写和字面量以外的空白、去掉结尾分号)的哈希为键，按模型和提示词版本区分，
+保存在SQLite文件中。重新训练没有变化的SQL示例文件时不再调用LLM。
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import sqlparse
+from sqlparse import lexer, tokens as T
+
+
+def normalize_sql(sql: str) -> str:
+    """字面量以外的连续空白合并为一个空格，字符串中的空白不同的SQL仍然是不同的键"""
+    sql = sqlparse.format(sql, strip_comments=True, keyword_case="upper")
+    parts = []
+    for ttype, value in lexer.tokenize(sql):
+        if ttype in T.Whitespace:
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        else:
+            parts.append(value)
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def sql_fingerprint(sql: str) -> str:
+    return hashlib.sha256(normalize_sql(sql).encode("utf-8")).hexdigest()
+
+
+def question_cache_version(model: str | None, prompt_version: str, prompts=()) -> str:
+    """
+    模型或提示词变化后生成的问题不同，使用新的版本号，旧条目不再命中
+
+    Args:
+        prompts: 生成问题使用的提示词(批量和逐条)，版本号包含它们的哈希，修改后自动失效
+    """
+    if prompts:
+        prompt_hash = hashlib.sha256("\x00".join(prompts).encode("utf-8")).hexdigest()[:8]
+        prompt_version = f"{prompt_version}-{prompt_hash}"
+    return f"{model or 'default'}:{prompt_version}"
+
+
+class QuestionCache:
+    def __init__(self, path: str, version: str):
+        self.path = path
+        self.version = version
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS question_cache ("
+                "fingerprint TEXT NOT NULL, version TEXT NOT NULL, question TEXT NOT NULL, created_at REAL NOT NULL, "
+                "PRIMARY KEY (fingerprint, version))"
+            )
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=5)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get_many(self, sqls: list) -> dict:
+        """
+        Returns:
+            dict: {SQL序号: 问题}，只包含命中的条目
+        """
+        fingerprints = [sql_fingerprint(sql) for sql in sqls]
+        found = {}
+        with self.lock, self._connect() as connection:
+            unique = list(set(fingerprints))
+            # SQLite单条语句的参数个数有上限，分段查询
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                rows = connection.execute(
+                    f"SELECT fingerprint, question FROM question_cache WHERE version = ? "
+                    f"AND fingerprint IN ({','.join('?' * len(chunk))})",
+                    (self.version, *chunk),
+                ).fetchall()
+                found.update(rows)
+
+        questions = {index: found[fp] for index, fp in enumerate(fingerprints) if fp in found}
+        with self.lock:
+            self.hits += len(questions)
+            self.misses += len(sqls) - len(questions)
+        return questions
+
+    def get(self, sql: str) -> str | None:
+        return self.get_many([sql]).get(0)
+
+    def set_many(self, pairs: list):
+        """pairs: [(sql, question)]，问题为空的条目不缓存"""
+        now = time.time()
+        rows = [(sql_fingerprint(sql), self.version, question, now) for sql, question in pairs if question]
+        if not rows:
+            return
+        with self.lock, self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO question_cache (fingerprint, version, question, created_at) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    def set(self, sql: str, question: str):
+        self.set_many([(sql, question)])
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "version": self.version}
@@ -0,0 +1,158 @@
+"""
+训练SQL示例时批量生成问题。
+
+一次把多条SQL放进同一个提示词，要求模型返回JSON数组形式的问题列表；多个批次在速率限制下并发执行，
+解析不出来或缺失的条目再逐条调用 generate_question 补齐。
+"""
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common.token_counter import count_tokens
+
+
+BATCH_QUESTION_SYSTEM_PROMPT = (
+    "请你根据下方每条SQL语句推测用户的业务提问。每个问题只包含清晰的中文自然语言问题，"
+    "不要包含任何解释或SQL内容，也不要出现表名，并以问号结尾。\n"
+    "只返回一个JSON数组，每条SQL对应一个元素，格式为："
+    '[{"id": SQL编号, "question": "问题"}]，不要输出其他内容。'
+)
+
+_JSON_ARRAY_PATTERN = re.compile(r"\[.*\]", re.DOTALL)
+
+
+class RateLimiter:
+    """每分钟最多放行 requests_per_minute 个请求，多个线程共用"""
+
+    def __init__(self, requests_per_minute: int | None):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+def normalize_question(question: str) -> str:
+    question = question.strip()
+    if not question.endswith("?") and not question.endswith("？"):
+        question += "?"
+    return question
+
+
+def build_batch_question_prompt(vn, sqls: list) -> list:
+    sql_blocks = "\n\n".join(f"SQL {i}:\n{sql}" for i, sql in enumerate(sqls, start=1))
+    return [
+        vn.system_message(BATCH_QUESTION_SYSTEM_PROMPT),
+        vn.user_message(sql_blocks),
+    ]
+
+
+def parse_batch_questions(response: str, n: int) -> dict:
+    """
+    解析模型返回的JSON数组
+
+    Returns:
+        dict: {SQL序号(从0开始): 问题}，解析失败或缺失的条目不在其中
+    """
+    match = _JSON_ARRAY_PATTERN.search(response or "")
+    if not match:
+        return {}
+    try:
+        items = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    questions = {}
+    for position, item in enumerate(items):
+        if isinstance(item, dict):
+            index, question = item.get("id"), item.get("question")
+            try:
+                index = int(index) - 1
+            except (TypeError, ValueError):
+                continue
+        elif isinstance(item, str) and len(items) == n:
+            # 模型只返回了问题字符串时按顺序对应
+            index, question = position, item
+        else:
+            continue
+        if 0 <= index < n and isinstance(question, str) and question.strip():
+            questions[index] = normalize_question(question)
+    return questions
+
+
+def split_batches(sqls: list, batch_size: int, max_batch_tokens: int | None = None) -> list:
+    """按条数和token数把SQL分批，返回每批的SQL序号列表"""
+    batches = []
+    current, current_tokens = [], 0
+    for index, sql in enumerate(sqls):
+        tokens = count_tokens(sql)
+        if current and (len(current) >= batch_size
+                        or (max_batch_tokens and current_tokens + tokens > max_batch_tokens)):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def generate_questions_batched(vn, sqls: list, batch_size: int = 20, max_workers: int = 4,
+                               requests_per_minute: int | None = None,
+                               max_batch_tokens: int | None = None) -> list:
+    """
+    为一组SQL生成问题
+
+    Returns:
+        list: 与sqls顺序对应的问题；逐条补齐也失败的条目为None
+    """
+    limiter = RateLimiter(requests_per_minute)
+
+    def generate_single(sql):
+        limiter.acquire()
+        try:
+            return normalize_question(vn.generate_question(sql=sql))
+        except Exception as e:
+            print(f"[ERROR] 生成问题时出错: {e}")
+            return None
+
+    def generate_batch(indexes):
+        batch_sqls = [sqls[index] for index in indexes]
+        if len(batch_sqls) == 1:
+            return {indexes[0]: generate_single(batch_sqls[0])}
+
+        limiter.acquire()
+        try:
+            response = vn.submit_prompt(build_batch_question_prompt(vn, batch_sqls), prompt_type="question")
+            parsed = parse_batch_questions(response, len(batch_sqls))
+        except Exception as e:
+            print(f"[WARNING] 批量生成问题失败，改为逐条生成: {e}")
+            parsed = {}
+
+        missing = [position for position in range(len(batch_sqls)) if position not in parsed]
+        if missing:
+            print(f"[WARNING] 批量生成问题有 {len(missing)}/{len(batch_sqls)} 条未能解析，逐条生成")
+        for position in missing:
+            parsed[position] = generate_single(batch_sqls[position])
+        return {indexes[position]: question for position, question in parsed.items()}
+
+    questions = [None] * len(sqls)
+    batches = split_batches(sqls, batch_size, max_batch_tokens)
+    print(f"[INFO] 批量生成问题: {len(sqls)} 条SQL，{len(batches)} 个批次")
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="question_gen") as executor:
+        for result in executor.map(generate_batch, batches):
+            for index, question in result.items():
+                questions[index] = question
+    return questions
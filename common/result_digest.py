@@ -0,0 +1,123 @@
+"""
+大查询结果的统计摘要。
+
+vanna 的 generate_summary 会把整个DataFrame转成markdown放进提示词，结果很大时既慢又会超出上下文。
+超过行数或内存阈值的结果改为发送统计摘要：形状、列类型、数值列的min/max/mean、其他列的高频值、
+首尾几行样例和按低基数列分组的聚合。摘要按DataFrame内容哈希缓存。
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+
+import pandas as pd
+
+
+def dataframe_fingerprint(df: pd.DataFrame) -> str:
+    row_hashes = pd.util.hash_pandas_object(df, index=True).values
+    digest = hashlib.sha256(row_hashes.tobytes())
+    digest.update(repr((list(df.columns), [str(dtype) for dtype in df.dtypes])).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def coerce_decimal_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """psycopg2把NUMERIC列返回为Decimal对象(object类型)，转成数值列后才会计入数值统计"""
+    converted = {}
+    for name, dtype in df.dtypes.items():
+        if dtype != object:
+            continue
+        values = df[name].dropna()
+        if not values.empty and values.map(lambda value: isinstance(value, Decimal)).all():
+            converted[name] = pd.to_numeric(df[name], errors="coerce")
+    if not converted:
+        return df
+    df = df.copy()
+    for name, column in converted.items():
+        df[name] = column
+    return df
+
+
+class ResultDigester:
+    def __init__(self, max_rows=200, max_bytes=1_000_000, top_k=5, sample_rows=5,
+                 max_group_cardinality=20, max_numeric_columns=20, cache_size=128):
+        """
+        Args:
+            max_rows / max_bytes: 行数或内存占用超过阈值时使用摘要，否则仍发送完整markdown
+            top_k: 非数值列列出的高频值个数
+            sample_rows: 首尾样例各取的行数
+            max_group_cardinality: 分组聚合使用的分组列最多有多少个不同值
+        """
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.top_k = top_k
+        self.sample_rows = sample_rows
+        self.max_group_cardinality = max_group_cardinality
+        self.max_numeric_columns = max_numeric_columns
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def needs_digest(self, df) -> bool:
+        if not isinstance(df, pd.DataFrame):
+            return False
+        if len(df) > self.max_rows:
+            return True
+        return bool(self.max_bytes) and df.memory_usage(index=True, deep=False).sum() > self.max_bytes
+
+    def digest(self, df: pd.DataFrame) -> str:
+        try:
+            key = dataframe_fingerprint(df)
+        except TypeError:
+            # 列中含有list/dict等不可哈希的值(例如json列)，不缓存
+            return self.build_digest(df)
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache.move_to_end(key)
+                return cached
+
+        text = self.build_digest(df)
+        with self.lock:
+            self.cache[key] = text
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return text
+
+    def build_digest(self, df: pd.DataFrame) -> str:
+        df = coerce_decimal_columns(df)
+        sections = [f"结果共 {len(df)} 行 {len(df.columns)} 列"]
+        sections.append("列类型:\n" + "\n".join(f"- {name}: {dtype}" for name, dtype in df.dtypes.items()))
+
+        numeric = df.select_dtypes(include="number").iloc[:, :self.max_numeric_columns]
+        if not numeric.empty:
+            stats = numeric.agg(["min", "max", "mean", "sum"]).T
+            stats["nulls"] = numeric.isna().sum()
+            sections.append("数值列统计:\n" + stats.to_markdown(floatfmt=".4g"))
+
+        datetimes = df.select_dtypes(include=["datetime", "datetimetz"])
+        if not datetimes.empty:
+            lines = [f"- {name}: {datetimes[name].min()} ~ {datetimes[name].max()}" for name in datetimes.columns]
+            sections.append("时间列范围:\n" + "\n".join(lines))
+
+        categorical = df.select_dtypes(exclude=["number", "datetime", "datetimetz"])
+        cardinality = {}
+        if not categorical.empty:
+            lines = []
+            for name in categorical.columns:
+                counts = categorical[name].astype(str).value_counts()
+                cardinality[name] = len(counts)
+                top = ", ".join(f"{value}({count})" for value, count in counts.head(self.top_k).items())
+                lines.append(f"- {name}: {len(counts)} 个不同值，最多的是 {top}")
+            sections.append("其他列高频值:\n" + "\n".join(lines))
+
+        group_columns = [name for name, count in cardinality.items() if 1 < count <= self.max_group_cardinality]
+        if group_columns and not numeric.empty:
+            group_column = group_columns[0]
+            grouped = df.groupby(group_column, dropna=False)[list(numeric.columns)].agg(["sum", "mean"])
+            grouped.columns = [f"{column}_{func}" for column, func in grouped.columns]
+            sections.append(f"按 {group_column} 分组聚合:\n" + grouped.to_markdown(floatfmt=".4g"))
+
+        sample = pd.concat([df.head(self.sample_rows), df.tail(self.sample_rows)]) \
+            if len(df) > self.sample_rows * 2 else df
+        sections.append(f"首尾各 {self.sample_rows} 行样例:\n" + sample.to_markdown())
+        return "\n\n".join(sections)
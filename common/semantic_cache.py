@@ -0,0 +1,142 @@
+"""
+generate_sql 的语义缓存：问题向量 -> 生成的SQL。
+
+新问题与缓存中某个问题的余弦相似度不低于阈值、并且两个问题中的数字和日期词完全相同时，
+直接返回缓存的SQL，不再检索和调用LLM(只差年份、月份或数量的问题向量非常接近，但SQL不同)。
+缓存在进程内存中，条目超过 ttl 秒过期；作用域(训练数据版本)变化时整体失效。
+"""
+import re
+import threading
+import time
+
+import numpy as np
+
+# 数字(含日期、时间、小数)、中文数字和相对日期词
+_VALUE_PATTERN = re.compile(
+    r"\d+(?:[.:/-]\d+)*"
+    r"|[零〇一二两三四五六七八九十百千万亿]+"
+    r"|[今去前明后本上下]+(?:个)?(?:年|季度|月|周|星期|天|日)|昨天|昨日|今日|最近|近期"
+)
+
+
+def value_tokens(question: str) -> list:
+    """问题中的数字和日期词，按出现顺序"""
+    return _VALUE_PATTERN.findall(question or "")
+
+
+class SemanticCache:
+    def __init__(self, similarity_threshold=0.99, ttl=3600, max_size=1000):
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # 向量按行存放在矩阵中，一次矩阵乘法算出与所有缓存问题的相似度
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._entries = []
+        self._scope = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # 每次失效加1；生成SQL期间发生过失效的结果不写入缓存
+        self.generation = 0
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _evict_expired(self, now: float):
+        keep = [i for i, entry in enumerate(self._entries) if now - entry["created_at"] < self.ttl]
+        if len(keep) != len(self._entries):
+            self._entries = [self._entries[i] for i in keep]
+            self._vectors = self._vectors[keep]
+
+    def _check_scope(self, scope):
+        # 集合版本切换后，旧版本上生成的SQL不再可信
+        if scope != self._scope:
+            self._clear()
+            self._scope = scope
+
+    def _clear(self):
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._entries = []
+
+    def lookup(self, embedding, scope=None, question: str | None = None) -> dict | None:
+        """
+        查找与问题最相似的缓存条目
+
+        Args:
+            question: 提供时只匹配数字和日期词完全相同的缓存问题
+        Returns:
+            dict | None: 命中时返回 {"question", "sql", "similarity"}
+        """
+        vector = self._normalize(embedding)
+        values = value_tokens(question) if question is not None else None
+        with self.lock:
+            self._check_scope(scope)
+            self._evict_expired(time.time())
+            if self._entries and self._vectors.shape[1] == vector.shape[0]:
+                similarities = self._vectors @ vector
+                for index in np.argsort(-similarities):
+                    if similarities[index] < self.similarity_threshold:
+                        break
+                    entry = self._entries[index]
+                    if values is not None and entry["values"] != values:
+                        continue
+                    self.hits += 1
+                    return {"question": entry["question"], "sql": entry["sql"], "similarity": float(similarities[index])}
+            self.misses += 1
+            return None
+
+    def add(self, embedding, question: str, sql: str, scope=None, generation=None):
+        vector = self._normalize(embedding)
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._check_scope(scope)
+            if self._entries and self._vectors.shape[1] != vector.shape[0]:
+                # embedding模型维度变化，旧向量无法比较
+                self._clear()
+            if not self._entries:
+                self._vectors = vector.reshape(1, -1)
+            else:
+                self._vectors = np.vstack([self._vectors, vector])
+            self._entries.append({
+                "question": question, "sql": sql, "values": value_tokens(question), "created_at": time.time(),
+            })
+            if len(self._entries) > self.max_size:
+                overflow = len(self._entries) - self.max_size
+                self._entries = self._entries[overflow:]
+                self._vectors = self._vectors[overflow:]
+
+    def contains(self, question: str, sql: str) -> bool:
+        """缓存中是否已有同一问题和SQL(例如ask()自动训练刚生成的结果)"""
+        with self.lock:
+            return any(entry["question"] == question and entry["sql"] == sql for entry in self._entries)
+
+    def rebase(self, old_scope, new_scope):
+        """作用域从old_scope变为new_scope是本进程自己造成的、不影响已缓存的结果时，保留缓存条目"""
+        with self.lock:
+            if self._scope == old_scope:
+                self._scope = new_scope
+
+    def invalidate(self):
+        """训练数据变更时调用，清空所有缓存条目"""
+        with self.lock:
+            self._clear()
+            self.invalidations += 1
+            self.generation += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "invalidations": self.invalidations,
+                "similarity_threshold": self.similarity_threshold,
+                "ttl": self.ttl,
+            }
@@ -0,0 +1,290 @@
+"""
+执行生成的SQL之前的检查。
+
+- 只允许单条 SELECT / WITH 查询
+- 非聚合查询没有LIMIT时自动加上LIMIT
+- 先执行 EXPLAIN (FORMAT JSON)，估算代价或返回行数超过上限时拒绝执行，并返回执行计划摘要
+- 每条查询(包括EXPLAIN)都在 statement_timeout 内执行
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import sqlparse
+from sqlparse import sql as sql_tokens
+from sqlparse import tokens as T
+from vanna.exceptions import ValidationError
+
+from common.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+AGGREGATE_FUNCTIONS = {"count", "sum", "avg", "min", "max", "string_agg", "array_agg", "bool_and", "bool_or"}
+
+
+class SQLGuardError(ValidationError):
+    """查询未通过执行前检查，plan_summary 为执行计划摘要(未执行EXPLAIN时为None)"""
+
+    def __init__(self, message: str, plan_summary: dict | None = None):
+        super().__init__(message)
+        self.plan_summary = plan_summary
+
+
+def _walk_top_level(token_list):
+    """遍历不在括号(子查询、CTE定义)中的token"""
+    for token in token_list.tokens:
+        if isinstance(token, sql_tokens.Parenthesis):
+            continue
+        yield token
+        if token.is_group and not isinstance(token, sql_tokens.Function):
+            yield from _walk_top_level(token)
+
+
+def _parse_single_statement(sql: str):
+    statements = [statement for statement in sqlparse.parse(sql) if statement.token_first(skip_cm=True)]
+    if len(statements) != 1:
+        raise SQLGuardError(f"只允许执行单条查询，实际为 {len(statements)} 条")
+    statement = statements[0]
+    if statement.get_type() != "SELECT":
+        raise SQLGuardError(f"只允许执行SELECT查询，实际为 {statement.get_type()}")
+    return statement
+
+
+def _has_over_clause(function) -> bool:
+    """count(*) OVER (...) 是窗口函数，每行都会返回，不是聚合"""
+    for child in function.tokens:
+        first = child.token_first() if child.is_group else child
+        if first is not None and first.ttype is T.Keyword and first.normalized == "OVER":
+            return True
+    return False
+
+
+def is_aggregate_query(statement) -> bool:
+    for token in _walk_top_level(statement):
+        if token.ttype is T.Keyword and token.normalized == "GROUP BY":
+            return True
+        if (
+            isinstance(token, sql_tokens.Function)
+            and (token.get_name() or "").lower() in AGGREGATE_FUNCTIONS
+            and not _has_over_clause(token)
+        ):
+            return True
+    return False
+
+
+def has_top_level_limit(statement) -> bool:
+    return any(
+        token.ttype is T.Keyword and token.normalized in ("LIMIT", "FETCH")
+        for token in _walk_top_level(statement)
+    )
+
+
+def apply_limit(sql: str, limit: int) -> str:
+    """非聚合且没有LIMIT的查询在末尾加上LIMIT"""
+    statement = _parse_single_statement(sql)
+    if not limit or is_aggregate_query(statement) or has_top_level_limit(statement):
+        return sql
+    body = sqlparse.format(str(statement), strip_comments=True).strip().rstrip(";").rstrip()
+    return f"{body}\nLIMIT {int(limit)}"
+
+
+def summarize_plan(plan: dict) -> dict:
+    """从 EXPLAIN (FORMAT JSON) 的结果中取出代价、行数、节点类型和全表扫描"""
+    root = plan["Plan"]
+    node_types = {}
+    seq_scans = []
+    # 分区表没有裁剪分区时Append节点下会扫描所有分区
+    max_append_children = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        node_types[node["Node Type"]] = node_types.get(node["Node Type"], 0) + 1
+        if node["Node Type"] == "Seq Scan":
+            seq_scans.append({
+                "relation": node.get("Relation Name"),
+                "schema": node.get("Schema"),
+                "rows": node.get("Plan Rows"),
+            })
+        if node["Node Type"] in ("Append", "Merge Append"):
+            max_append_children = max(max_append_children, len(node.get("Plans", [])))
+        stack.extend(node.get("Plans", []))
+    return {
+        "top_node": root["Node Type"],
+        "total_cost": root["Total Cost"],
+        "plan_rows": root["Plan Rows"],
+        "node_types": node_types,
+        "seq_scans": sorted(seq_scans, key=lambda scan: -(scan["rows"] or 0)),
+        "max_append_children": max_append_children,
+    }
+
+
+class SQLGuard:
+    def __init__(self, connect_kwargs: dict, max_total_cost=1e7, max_plan_rows=1e7,
+                 statement_timeout_ms=30000, default_limit=1000, pool_size=10, pool_timeout=30,
+                 plan_cache_ttl=60, plan_cache_size=256):
+        """
+        Args:
+            connect_kwargs: psycopg2.connect 的参数
+            max_total_cost: EXPLAIN估算的总代价上限
+            max_plan_rows: EXPLAIN估算的返回行数上限
+            default_limit: 非聚合查询自动加上的LIMIT，0表示不加
+            pool_timeout: 连接池的连接都在使用时最多等待的秒数
+            plan_cache_ttl: 同一SQL的执行计划摘要复用的秒数，执行计划反馈和执行前检查只EXPLAIN一次
+        """
+        self.connect_kwargs = connect_kwargs
+        self.max_total_cost = max_total_cost
+        self.max_plan_rows = max_plan_rows
+        self.statement_timeout_ms = statement_timeout_ms
+        self.default_limit = default_limit
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        # ThreadedConnectionPool 在连接用完时直接抛出PoolError，用信号量让调用方排队等待
+        self._pool_slots = threading.BoundedSemaphore(pool_size)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self.plan_cache_ttl = plan_cache_ttl
+        self.plan_cache_size = plan_cache_size
+        self._plan_cache = OrderedDict()
+        self._plan_cache_lock = threading.Lock()
+        self.rejected = 0
+        self.limited = 0
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    from psycopg2.pool import ThreadedConnectionPool
+                    self._pool = ThreadedConnectionPool(1, self.pool_size, **self.connect_kwargs)
+        return self._pool
+
+    def _execute(self, sql: str, params=None):
+        """在一个事务中设置statement_timeout后执行，执行完回滚(只读查询)并归还连接"""
+        import psycopg2
+
+        if not self._pool_slots.acquire(timeout=self.pool_timeout):
+            raise SQLGuardError(f"等待数据库连接超过 {self.pool_timeout}s，连接池({self.pool_size})已满")
+        try:
+            connection = self.pool.getconn()
+        except Exception:
+            self._pool_slots.release()
+            raise
+        broken = False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL statement_timeout = %s", (int(self.statement_timeout_ms),))
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+                # (列名, 类型OID)
+                columns = [(desc[0], desc[1]) for desc in cursor.description]
+            return rows, columns
+        except psycopg2.errors.QueryCanceled as e:
+            raise SQLGuardError(f"查询超过 {self.statement_timeout_ms}ms 被取消: {e}") from e
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except psycopg2.Error as e:
+            raise ValidationError(e) from e
+        finally:
+            try:
+                if not broken and not connection.closed:
+                    connection.rollback()
+                self.pool.putconn(connection, close=broken or bool(connection.closed))
+            finally:
+                self._pool_slots.release()
+
+    def explain(self, sql: str) -> dict:
+        rows, _ = self._execute(f"EXPLAIN (FORMAT JSON) {sql}")
+        plan = rows[0][0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]
+
+    def result_columns(self, sql: str) -> list:
+        """不取数据，只返回查询结果的 (列名, 类型OID) 列表"""
+        body = sqlparse.format(sql, strip_comments=True).strip().rstrip(";")
+        _, columns = self._execute(f"SELECT * FROM ({body}) AS _columns LIMIT 0")
+        return columns
+
+    def get_indexes(self, tables: list) -> list:
+        """pg_indexes 中这些表(表名或 schema.表名)上的索引定义"""
+        names = sorted({table.split(".")[-1] for table in tables if table})
+        if not names:
+            return []
+        rows, _ = self._execute(
+            "SELECT schemaname, tablename, indexdef FROM pg_indexes WHERE tablename = ANY(%s) "
+            "ORDER BY schemaname, tablename, indexname",
+            (names,),
+        )
+        return [{"schema": row[0], "table": row[1], "definition": row[2]} for row in rows]
+
+    def plan_summary(self, sql: str) -> dict:
+        """
+        加上默认LIMIT后的执行计划摘要，只做EXPLAIN，不检查上限也不计入统计
+
+        Raises:
+            SQLGuardError: 不是单条SELECT查询
+        """
+        guarded_sql = apply_limit(sql, self.default_limit)
+        now = time.monotonic()
+        with self._plan_cache_lock:
+            cached = self._plan_cache.get(guarded_sql)
+            if cached is not None and now - cached[0] < self.plan_cache_ttl:
+                self._plan_cache.move_to_end(guarded_sql)
+                return cached[1]
+
+        summary = summarize_plan(self.explain(guarded_sql))
+        if self.plan_cache_ttl:
+            with self._plan_cache_lock:
+                self._plan_cache[guarded_sql] = (now, summary)
+                self._plan_cache.move_to_end(guarded_sql)
+                while len(self._plan_cache) > self.plan_cache_size:
+                    self._plan_cache.popitem(last=False)
+        return summary
+
+    def check(self, sql: str) -> tuple:
+        """
+        Returns:
+            tuple: (实际执行的SQL, 执行计划摘要)
+        Raises:
+            SQLGuardError: 不是单条SELECT查询，或估算代价/行数超过上限
+        """
+        guarded_sql = apply_limit(sql, self.default_limit)
+        if guarded_sql != sql:
+            self.limited += 1
+            logger.debug("查询没有LIMIT，已加上 LIMIT %s", self.default_limit)
+
+        summary = self.plan_summary(sql)
+        reasons = []
+        if self.max_total_cost and summary["total_cost"] > self.max_total_cost:
+            reasons.append(f"估算代价 {summary['total_cost']:.0f} 超过上限 {self.max_total_cost:.0f}")
+        if self.max_plan_rows and summary["plan_rows"] > self.max_plan_rows:
+            reasons.append(f"估算行数 {summary['plan_rows']:.0f} 超过上限 {self.max_plan_rows:.0f}")
+        if reasons:
+            self.rejected += 1
+            logger.warning("拒绝执行查询: %s", "; ".join(reasons))
+            raise SQLGuardError("查询代价过高，拒绝执行: " + "; ".join(reasons), plan_summary=summary)
+        return guarded_sql, summary
+
+    def run(self, sql: str) -> pd.DataFrame:
+        """自动加上了LIMIT时，DataFrame的 attrs["limit"] 为该LIMIT"""
+        guarded_sql, _ = self.check(sql)
+        rows, columns = self._execute(guarded_sql)
+        df = pd.DataFrame(rows, columns=[name for name, _ in columns])
+        if guarded_sql != sql:
+            df.attrs["limit"] = self.default_limit
+        return df
+
+    def stats(self) -> dict:
+        return {
+            "max_total_cost": self.max_total_cost,
+            "max_plan_rows": self.max_plan_rows,
+            "statement_timeout_ms": self.statement_timeout_ms,
+            "default_limit": self.default_limit,
+            "pool_size": self.pool_size,
+            "rejected": self.rejected,
+            "limited": self.limited,
+        }
@@ -0,0 +1,93 @@
+"""
+SQL生成的提前结束。
+
+模型在SQL之后经常还会输出一段解释，这部分对 extract_sql 没有用。流式输出时用 SqlStreamDetector
+观察已收到的文本，一旦出现完整的SQL(闭合的```sql代码块，或以分号结束且能解析的语句)就关闭流；
+同时给服务商设置停止序列，非流式调用也会在代码块结束处停止。
+"""
+import re
+
+import sqlparse
+
+
+# 停止序列本身不会出现在输出中，finalize_sql_response 负责补回
+SQL_STOP_SEQUENCES = [";\n```"]
+
+_FENCE_PATTERN = re.compile(r"```(?:sql)?[ \t]*\n(.*?)```", re.DOTALL | re.IGNORECASE)
+_STATEMENT_START = re.compile(r"(SELECT|WITH)\b", re.IGNORECASE)
+
+
+def _strip_leading_comments(text: str) -> str:
+    lines = text.lstrip().splitlines()
+    while lines and (not lines[0].strip() or lines[0].strip().startswith("--")):
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def _find_statement_end(text: str) -> int:
+    """返回第一个不在引号、注释和括号中的分号的位置，没有时返回-1"""
+    depth = 0
+    quote = None
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+        elif char == "-" and text.startswith("--", i):
+            newline = text.find("\n", i)
+            if newline == -1:
+                return -1
+            i = newline
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == ";" and depth == 0:
+            return i
+        i += 1
+    return -1
+
+
+def is_complete_sql_response(text: str) -> bool:
+    fence = _FENCE_PATTERN.search(text)
+    if fence and fence.group(1).strip():
+        return True
+    if "```" in text:
+        # 代码块还没有闭合
+        return False
+
+    statement = _strip_leading_comments(text)
+    if not _STATEMENT_START.match(statement):
+        return False
+    end = _find_statement_end(statement)
+    if end == -1:
+        return False
+    parsed = sqlparse.parse(statement[:end + 1])
+    return bool(parsed) and parsed[0].get_type() != "UNKNOWN"
+
+
+class SqlStreamDetector:
+    """逐个接收流式文本片段，收到完整SQL时 feed 返回True"""
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, token: str) -> bool:
+        self.buffer += token
+        # 只有可能结束一条SQL的片段才需要检查
+        if "`" not in token and ";" not in token:
+            return False
+        return is_complete_sql_response(self.buffer)
+
+
+def finalize_sql_response(text: str) -> str:
+    """停止序列截断了结尾的分号和代码块时补全，使 extract_sql 能正常提取"""
+    if text and text.count("```") % 2 == 1:
+        body = text.rstrip()
+        if not body.endswith(";"):
+            body += ";"
+        return body + "\n```"
+    return text
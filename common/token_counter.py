@@ -0,0 +1,140 @@
+"""
+token计数和SQL提示词预算。
+
+使用 app_config.TOKENIZER_CONFIG 中配置的千问/DeepSeek分词器(本地的tokenizer.json)计数，
+分词器在第一次计数时加载一次，之后进程内共用。没有配置、文件不存在或没有安装tokenizers时，
+按字符类型估算：中日韩字符每个按1个token，其余字符约4个字符1个token(对中文偏大，用于预算时偏保守)。
+"""
+import os
+import re
+import threading
+
+from common.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 每条消息的角色、分隔符等额外开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# vanna的generate_sql执行中间SQL后，把查询结果作为最后一条文档追加进去再次生成
+INTERMEDIATE_SQL_DOC_PREFIX = "The following is a pandas DataFrame with the results of the intermediate SQL query"
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
+
+
+def _configured_tokenizer_path() -> str | None:
+    import app_config
+    tokenizer_config = getattr(app_config, "TOKENIZER_CONFIG", {})
+    return tokenizer_config.get(app_config.MODEL_TYPE.lower())
+
+
+def load_tokenizer(path: str | None):
+    """
+    加载分词器并替换进程内缓存的分词器，返回加载的分词器；path为空或加载失败时返回None，改用估算
+
+    Args:
+        path: tokenizer.json 文件，或包含它的模型目录
+    """
+    global _tokenizer, _tokenizer_loaded
+    tokenizer = None
+    if path and os.path.isdir(path):
+        path = os.path.join(path, "tokenizer.json")
+    if path and os.path.exists(path):
+        try:
+            from tokenizers import Tokenizer
+            tokenizer = Tokenizer.from_file(path)
+            logger.info("已加载分词器: %s", path)
+        except ImportError:
+            logger.warning("没有安装tokenizers，按字符类型估算token数")
+        except Exception as e:
+            logger.warning("加载分词器 %s 失败，按字符类型估算token数: %s", path, e)
+    elif path:
+        logger.info("分词器文件 %s 不存在，按字符类型估算token数", path)
+    with _tokenizer_lock:
+        _tokenizer = tokenizer
+        _tokenizer_loaded = True
+    return tokenizer
+
+
+def get_tokenizer():
+    """进程内共用的分词器，第一次调用时按配置加载；不可用时返回None"""
+    if not _tokenizer_loaded:
+        with _tokenizer_lock:
+            loaded = _tokenizer_loaded
+        if not loaded:
+            load_tokenizer(_configured_tokenizer_path())
+    return _tokenizer
+
+
+def estimate_tokens(text: str) -> int:
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+def count_tokens(text) -> int:
+    if not text:
+        return 0
+    if not isinstance(text, str):
+        text = str(text)
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return estimate_tokens(text)
+    return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+def count_message_tokens(messages) -> int:
+    total = 0
+    for message in messages or []:
+        total += count_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+    return total
+
+
+def is_intermediate_sql_doc(doc) -> bool:
+    return isinstance(doc, str) and doc.startswith(INTERMEDIATE_SQL_DOC_PREFIX)
+
+
+def fit_prompt_items(question_sql_list: list, ddl_list: list, doc_list: list, budget: int):
+    """
+    把检索结果裁剪到token预算内。各列表按相关度降序排列，超出预算时从排名最靠后的条目开始丢弃；
+    排名相同时先丢文档，再丢示例，最后丢DDL。至少保留一条DDL，中间SQL的查询结果文档不丢弃
+    (第二次生成就是为了让LLM看到这些数据)。
+
+    Returns:
+        tuple: (question_sql_list, ddl_list, doc_list, 丢弃的条目数)
+    """
+    items = []
+    # (排名, 丢弃优先级, 类型, 下标, token数)
+    for index, example in enumerate(question_sql_list or []):
+        tokens = count_tokens(example.get("question", "")) + \
+            count_tokens(example.get("sql", "")) + 2 * MESSAGE_OVERHEAD_TOKENS
+        items.append((index, 1, "sql", index, tokens))
+    for index, ddl in enumerate(ddl_list or []):
+        items.append((index, 0, "ddl", index, count_tokens(ddl) + MESSAGE_OVERHEAD_TOKENS))
+    pinned = {("ddl", 0)}
+    for index, doc in enumerate(doc_list or []):
+        items.append((index, 2, "documentation", index, count_tokens(doc) + MESSAGE_OVERHEAD_TOKENS))
+        if is_intermediate_sql_doc(doc):
+            pinned.add(("documentation", index))
+
+    total = sum(item[4] for item in items)
+    dropped = set()
+    # 排名越靠后、丢弃优先级越高的越先丢
+    for item in sorted(items, key=lambda item: (item[0], item[1]), reverse=True):
+        if total <= budget:
+            break
+        if (item[2], item[3]) in pinned:
+            continue
+        dropped.add((item[2], item[3]))
+        total -= item[4]
+
+    return (
+        [example for i, example in enumerate(question_sql_list or []) if ("sql", i) not in dropped],
+        [ddl for i, ddl in enumerate(ddl_list or []) if ("ddl", i) not in dropped],
+        [doc for i, doc in enumerate(doc_list or []) if ("documentation", i) not in dropped],
+        len(dropped),
+    )
@@ -1,7 +1,10 @@
 import os
 
-from openai import OpenAI
 from vanna.base import VannaBase
+from common.token_counter import count_message_tokens
+from common.llm_client import DEEPSEEK_BASE_URL, get_openai_client
+from common.openai_chat import OpenAIChatMixin
+from common.logger import get_logger, log_payload
 #from base import VannaBase
 
 
@@ -15,11 +18,19 @@ from vanna.base import VannaBase
 # vn = DeepSeekVanna(config={"api_key": "sk-************", "model": "deepseek-chat"})
 
 
-class DeepSeekChat(VannaBase):
+logger = get_logger(__name__)
+
+
+class DeepSeekChat(OpenAIChatMixin, VannaBase):
+    # 由SQL生成问题的提示词，训练时的问题缓存版本包含它的哈希
+    QUESTION_SYSTEM_PROMPT = (
+        "请你根据下方SQL语句推测用户的业务提问，只返回清晰的自然语言问题，问题要使用中文，不要包含任何解释或SQL内容，也不要出现表名。"
+    )
+
     def __init__(self, config=None):
         VannaBase.__init__(self, config=config)
         
-        print("...DeepSeekChat init...")
+        logger.info("...DeepSeekChat init...")
         if config is None:
             raise ValueError(
                 "For DeepSeek, config must be provided with an api_key and model"
@@ -29,52 +40,44 @@ class DeepSeekChat(VannaBase):
 
         if "model" not in config:
             config["model"] = "deepseek-chat"  # 默认模型
-            print(f"未指定模型，使用默认模型: {config['model']}")
+            logger.info("未指定模型，使用默认模型: %s", config["model"])
         
         # 设置默认值
         self.temperature = config.get("temperature", 0.7)
         self.model = config["model"]
         
-        print("传入的 config 参数如下：")
-        for key, value in config.items():
-            if key != "api_key":  # 不打印API密钥
-                print(f"  {key}: {value}")
+        # 不输出API密钥
+        logger.debug("传入的 config 参数: %s", {key: value for key, value in config.items() if key != "api_key"})
         
-        # 使用标准的OpenAI客户端，但更改基础URL
-        self.client = OpenAI(
-            api_key=config["api_key"], 
-            base_url="https://api.deepseek.com/v1"
-        )
+        # 使用标准的OpenAI客户端，但更改基础URL；进程内共享连接池，超时和重试见 app_config.LLM_CLIENT_CONFIG
+        self.client = get_openai_client(config["api_key"], config.get("base_url", DEEPSEEK_BASE_URL))
     
     def system_message(self, message: str) -> any:
-        print(f"system_content: {message}")
+        log_payload(logger, "system_content", message)
         return {"role": "system", "content": message}
 
     def user_message(self, message: str) -> any:
-        print(f"\nuser_content: {message}")
+        log_payload(logger, "user_content", message)
         return {"role": "user", "content": message}
 
     def assistant_message(self, message: str) -> any:
-        print(f"assistant_content: {message}")
+        log_payload(logger, "assistant_content", message)
         return {"role": "assistant", "content": message}
 
-    def submit_prompt(self, prompt, **kwargs) -> str:
+    def _build_chat_params(self, prompt, **kwargs):
         if prompt is None:
             raise Exception("Prompt is None")
 
         if len(prompt) == 0:
             raise Exception("Prompt is empty")
 
-        # Count the number of tokens in the message log
-        # Use 4 as an approximation for the number of characters per token
-        num_tokens = 0
-        for message in prompt:
-            num_tokens += len(message["content"]) / 4
+        # 用分词器计算消息的token数(中文按字符数估算时会少算很多)
+        num_tokens = count_message_tokens(prompt)
         
         # 从配置和参数中获取model设置，kwargs优先
         model = kwargs.get("model", self.model)
         
-        print(f"\nUsing model {model} for {num_tokens} tokens (approx)")
+        logger.debug("Using model %s for %s tokens (approx)", model, num_tokens)
         
         # 创建请求参数
         chat_params = {
@@ -82,18 +85,14 @@ class DeepSeekChat(VannaBase):
             "messages": prompt,
             "temperature": kwargs.get("temperature", self.temperature),
         }
-        
-        try:
-            chat_response = self.client.chat.completions.create(**chat_params)
-            # 返回生成的文本
-            return chat_response.choices[0].message.content
-        except Exception as e:
-            print(f"DeepSeek API调用失败: {e}")
-            raise
-
-    def generate_sql(self, question: str, **kwargs) -> str:
-        # 使用父类的 generate_sql
-        sql = super().generate_sql(question, **kwargs)
+        # SQL提示词会带上停止序列(SQL_STREAM_CONFIG)，模型写完SQL代码块后不再输出解释
+        if kwargs.get("stop"):
+            chat_params["stop"] = kwargs["stop"]
+        return chat_params, model
+
+    def extract_sql(self, llm_response: str) -> str:
+        # 使用父类的 extract_sql，generate_sql 和 agenerate_sql 都会经过这里
+        sql = super().extract_sql(llm_response)
         
         # 替换 "\_" 为 "_"，解决特殊字符转义问题
         sql = sql.replace("\\_", "_")
@@ -104,9 +103,7 @@ class DeepSeekChat(VannaBase):
     def generate_question(self, sql: str, **kwargs) -> str:
         # 这里可以自定义提示词/逻辑
         prompt = [
-            self.system_message(
-                "请你根据下方SQL语句推测用户的业务提问，只返回清晰的自然语言问题，问题要使用中文，不要包含任何解释或SQL内容，也不要出现表名。"
-            ),
+            self.system_message(self.QUESTION_SYSTEM_PROMPT),
             self.user_message(sql)
         ]
         response = self.submit_prompt(prompt, **kwargs)
@@ -1 +1,2 @@
 from .custom_pgvector import PG_VectorStore
+from .retrieval_client import PG_VectorStoreClient
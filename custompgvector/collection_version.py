@@ -0,0 +1,197 @@
+"""
+向量集合的版本管理，用于蓝绿方式重建向量库。
+
+每个版本有一组带前缀的集合(例如 v20250101_120000__sql)，默认版本 "default" 对应原来不带前缀的集合。
+vanna_collection_versions 表记录各版本的状态，同一时刻只有一个 active 版本，
+PG_VectorStore 定期读取 active 版本并切换到对应的集合。
+"""
+from sqlalchemy import bindparam, text
+
+
+DEFAULT_VERSION = "default"
+
+VERSION_TABLE = "vanna_collection_versions"
+
+BASE_COLLECTIONS = ("sql", "ddl", "documentation", "table_summary", "table_ddl")
+
+
+def collection_name(base_name: str, version: str | None) -> str:
+    """返回某个版本下集合的实际名称"""
+    if not version or version == DEFAULT_VERSION:
+        return base_name
+    return f"{version}__{base_name}"
+
+
+def version_collection_names(version: str | None) -> list:
+    return [collection_name(base_name, version) for base_name in BASE_COLLECTIONS]
+
+
+def ensure_version_table(engine):
+    """
+    创建版本表，并把原来不带前缀的集合登记为 "default" 版本：版本表为空时设为active；
+    已经重建过但没有登记 "default" 时，如果这些集合还在就登记为retired。
+    登记后它和其他旧版本一样可以回滚，也会被 garbage_collect_versions 清理
+    """
+    with engine.begin() as connection:
+        connection.execute(text(
+            f"""
+            CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (
+                version VARCHAR PRIMARY KEY,
+                status VARCHAR NOT NULL,
+                embedding_model VARCHAR,
+                embedding_dimension INTEGER,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                activated_at TIMESTAMPTZ
+            )
+        """
+        ))
+        # 保证任意时刻最多只有一个active版本
+        connection.execute(text(
+            f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_{VERSION_TABLE}_active
+            ON {VERSION_TABLE} (status) WHERE status = 'active'
+        """
+        ))
+        _register_default_version(connection)
+
+
+def _register_default_version(connection):
+    rows = connection.execute(text(f"SELECT version, status FROM {VERSION_TABLE}")).fetchall()
+    if any(version == DEFAULT_VERSION for version, _ in rows):
+        return
+    if rows and not _default_collections_exist(connection):
+        return
+    # 没有active版本时应用使用的就是默认集合
+    active = not any(status == "active" for _, status in rows)
+    # 并发创建时只有一个事务能写入
+    connection.execute(text(
+        f"""
+        INSERT INTO {VERSION_TABLE} (version, status, activated_at)
+        VALUES (:version, :status, {"now()" if active else "NULL"})
+        ON CONFLICT DO NOTHING
+    """
+    ), {"version": DEFAULT_VERSION, "status": "active" if active else "retired"})
+
+
+def _default_collections_exist(connection) -> bool:
+    if not connection.execute(text("SELECT to_regclass('langchain_pg_collection')")).scalar():
+        return False
+    query = text(
+        "SELECT 1 FROM langchain_pg_collection WHERE name IN :names LIMIT 1"
+    ).bindparams(bindparam("names", expanding=True))
+    return connection.execute(query, {"names": version_collection_names(DEFAULT_VERSION)}).scalar() is not None
+
+
+def get_active_version(engine) -> dict | None:
+    """
+    返回当前active版本的记录；版本表不存在或没有active版本时返回None(即使用默认集合)
+    """
+    with engine.connect() as connection:
+        exists = connection.execute(text("SELECT to_regclass(:table_name)"), {"table_name": VERSION_TABLE}).scalar()
+        if not exists:
+            return None
+        row = connection.execute(text(
+            f"""
+            SELECT version, embedding_model, embedding_dimension
+            FROM {VERSION_TABLE}
+            WHERE status = 'active'
+        """
+        )).mappings().fetchone()
+    return dict(row) if row else None
+
+
+def register_version(engine, version: str, embedding_model: str, embedding_dimension: int):
+    ensure_version_table(engine)
+    with engine.begin() as connection:
+        connection.execute(text(
+            f"""
+            INSERT INTO {VERSION_TABLE} (version, status, embedding_model, embedding_dimension)
+            VALUES (:version, 'building', :embedding_model, :embedding_dimension)
+            ON CONFLICT (version) DO UPDATE
+            SET status = 'building', embedding_model = EXCLUDED.embedding_model,
+                embedding_dimension = EXCLUDED.embedding_dimension
+        """
+        ), {"version": version, "embedding_model": embedding_model, "embedding_dimension": embedding_dimension})
+
+
+def activate_version(engine, version: str):
+    """在同一个事务中把旧的active版本置为retired并激活新版本，读取方只会看到切换前或切换后的状态"""
+    with engine.begin() as connection:
+        connection.execute(text(f"LOCK TABLE {VERSION_TABLE} IN EXCLUSIVE MODE"))
+        connection.execute(text(
+            f"UPDATE {VERSION_TABLE} SET status = 'retired' WHERE status = 'active'"
+        ))
+        updated = connection.execute(text(
+            f"""
+            UPDATE {VERSION_TABLE} SET status = 'active', activated_at = now()
+            WHERE version = :version
+        """
+        ), {"version": version})
+        if updated.rowcount == 0:
+            raise ValueError(f"版本不存在: {version}")
+
+
+def count_version_items(engine, version: str) -> dict:
+    """统计某个版本下每个集合的条目数和零向量数"""
+    query = text(
+        """
+        SELECT c.name, count(e.id) AS items,
+               count(e.id) FILTER (WHERE vector_norm(e.embedding) < 1e-6) AS zero_vectors
+        FROM langchain_pg_collection c
+        LEFT JOIN langchain_pg_embedding e ON e.collection_id = c.uuid
+        WHERE c.name IN :names
+        GROUP BY c.name
+    """
+    ).bindparams(bindparam("names", expanding=True))
+    with engine.connect() as connection:
+        rows = connection.execute(query, {"names": version_collection_names(version)}).mappings().fetchall()
+    return {row["name"]: {"items": row["items"], "zero_vectors": row["zero_vectors"]} for row in rows}
+
+
+def list_versions(engine) -> list:
+    ensure_version_table(engine)
+    with engine.connect() as connection:
+        rows = connection.execute(text(
+            f"""
+            SELECT version, status, embedding_model, embedding_dimension, created_at, activated_at
+            FROM {VERSION_TABLE}
+            ORDER BY created_at DESC
+        """
+        )).mappings().fetchall()
+    return [dict(row) for row in rows]
+
+
+def drop_version(engine, version: str):
+    """删除某个版本的所有集合和向量，不允许删除active版本"""
+    names = version_collection_names(version)
+    with engine.begin() as connection:
+        status = connection.execute(
+            text(f"SELECT status FROM {VERSION_TABLE} WHERE version = :version"), {"version": version}
+        ).scalar()
+        if status == "active":
+            raise ValueError(f"不能删除active版本: {version}")
+        connection.execute(text(
+            """
+            DELETE FROM langchain_pg_embedding
+            WHERE collection_id IN (SELECT uuid FROM langchain_pg_collection WHERE name IN :names)
+        """
+        ).bindparams(bindparam("names", expanding=True)), {"names": names})
+        connection.execute(text(
+            "DELETE FROM langchain_pg_collection WHERE name IN :names"
+        ).bindparams(bindparam("names", expanding=True)), {"names": names})
+        connection.execute(text(f"DELETE FROM {VERSION_TABLE} WHERE version = :version"), {"version": version})
+
+
+def garbage_collect_versions(engine, keep: int = 2) -> list:
+    """
+    保留最近的 keep 个非active版本(用于回滚)，删除其余已退役或构建失败的版本
+
+    Returns:
+        list: 被删除的版本
+    """
+    inactive = [item for item in list_versions(engine) if item["status"] != "active"]
+    dropped = []
+    for item in inactive[keep:]:
+        drop_version(engine, item["version"])
+        dropped.append(item["version"])
+    return dropped
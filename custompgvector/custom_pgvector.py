@@ -1,17 +1,25 @@
 import ast
 import json
 import logging
+import threading
+import time
 import uuid
+from collections import OrderedDict
 
 import pandas as pd
 from langchain_core.documents import Document
 from langchain_postgres.vectorstores import PGVector
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, text
 
 from vanna.exceptions import ValidationError
 from vanna.base import VannaBase
 from vanna.types import TrainingPlan, TrainingPlanItem
 
+from .collection_version import DEFAULT_VERSION, get_active_version
+from .collection_version import collection_name as versioned_collection_name
+
+logger = logging.getLogger(__name__)
+
 
 class PG_VectorStore(VannaBase):
     def __init__(self, config=None):
@@ -25,26 +33,201 @@ class PG_VectorStore(VannaBase):
             self.connection_string = config.get("connection_string")
             self.n_results = config.get("n_results", 10)
 
+        # 每个集合可单独配置k，未配置时使用n_results
+        self.n_results_by_collection = {
+            name: config.get(f"n_results_{name}", self.n_results)
+            for name in ("sql", "ddl", "documentation")
+        }
+        # 余弦距离上限，超过的结果直接丢弃；None表示不限制
+        self.max_distance = config.get("max_distance") or {}
+        # 自适应k：相邻两个结果的距离跳变超过该值时截断；None表示不启用
+        self.distance_gap = config.get("distance_gap")
+        # 每个集合进入提示词的token预算；None表示不限制
+        self.token_budget = config.get("token_budget") or {}
+
+        # 同一个问题会依次检索sql/ddl/documentation，缓存问题向量避免重复调用embedding接口
+        self._question_embeddings = OrderedDict()
+        self._question_embeddings_lock = threading.Lock()
+        self._question_embeddings_size = config.get("question_embedding_cache_size", 128)
+
         if config and "embedding_function" in config:
             self.embedding_function = config.get("embedding_function")
         else:
             raise ValueError("No embedding_function was found.")
 
-        self.sql_collection = PGVector(
-            embeddings=self.embedding_function,
-            collection_name="sql",
-            connection=self.connection_string,
-        )
-        self.ddl_collection = PGVector(
-            embeddings=self.embedding_function,
-            collection_name="ddl",
-            connection=self.connection_string,
-        )
-        self.documentation_collection = PGVector(
-            embeddings=self.embedding_function,
-            collection_name="documentation",
-            connection=self.connection_string,
-        )
+        # 分层检索：先在精简的表摘要集合中检索表，再按表名键值查找详细DDL
+        self.hierarchical_ddl = config.get("hierarchical_ddl", False)
+        self.n_results_table = config.get("n_results_table", self.n_results)
+        self._engine = None
+
+        # 集合版本：配置了collection_version时固定读写该版本(重建影子版本时使用)，
+        # 否则跟随 vanna_collection_versions 中的active版本，定期检查是否已切换
+        self.pinned_version = config.get("collection_version")
+        self.version_check_interval = config.get("version_check_interval", 30)
+        self._version_checked_at = 0.0
+        self._version_lock = threading.Lock()
+        self.collection_version = None
+        self._collections = {}
+        # training_data_stamp 需要扫描集合中的全部条目，结果缓存 training_data_stamp_ttl 秒；
+        # 本进程写入训练数据后立即失效，其他进程的写入最多延迟这么久生效
+        self.training_data_stamp_ttl = config.get("training_data_stamp_ttl", 5)
+        self._stamp = None
+        self._stamp_checked_at = 0.0
+        self._stamp_generation = 0
+        self._stamp_lock = threading.Lock()
+        if self.pinned_version:
+            self._load_collections(self.pinned_version)
+        else:
+            self.refresh_collection_version(force=True)
+
+        if self.hierarchical_ddl:
+            self._ensure_table_name_index()
+
+    def _load_collections(self, version: str):
+        base_names = ["sql", "ddl", "documentation"]
+        if self.hierarchical_ddl:
+            base_names += ["table_summary", "table_ddl"]
+        collections = {
+            base_name: PGVector(
+                embeddings=self.embedding_function,
+                collection_name=versioned_collection_name(base_name, version),
+                connection=self.connection_string,
+            )
+            for base_name in base_names
+        }
+        # 整体替换引用，正在进行的检索继续使用旧的集合对象
+        self._collections = collections
+        self.collection_version = version
+
+    def refresh_collection_version(self, force: bool = False) -> str:
+        """
+        检查active版本是否已切换，切换后重新加载集合。返回当前使用的版本
+        """
+        if self.pinned_version:
+            return self.collection_version
+        now = time.monotonic()
+        if not force and now - self._version_checked_at < self.version_check_interval:
+            return self.collection_version
+
+        with self._version_lock:
+            if not force and now - self._version_checked_at < self.version_check_interval:
+                return self.collection_version
+            self._version_checked_at = now
+            try:
+                active = get_active_version(self.engine)
+            except Exception as e:
+                logger.error(f"Failed to read active collection version: {e}")
+                active = None
+                if self.collection_version is not None:
+                    return self.collection_version
+
+            version = active["version"] if active else DEFAULT_VERSION
+            if version == self.collection_version:
+                return version
+
+            # 新版本使用了不同的embedding模型时，当前进程的embedding_function无法检索该版本，继续使用旧版本
+            model_name = getattr(self.embedding_function, "model_name", None)
+            if (
+                active
+                and self.collection_version is not None
+                and active.get("embedding_model")
+                and model_name
+                and active["embedding_model"] != model_name
+            ):
+                logger.warning(
+                    f"Active collection version {version} uses embedding model {active['embedding_model']}, "
+                    f"but this process uses {model_name}; keep using version {self.collection_version}."
+                )
+                return self.collection_version
+
+            self._load_collections(version)
+            with self._question_embeddings_lock:
+                self._question_embeddings.clear()
+            logger.info("向量集合版本已切换为: %s", version)
+            return version
+
+    def training_data_stamp(self) -> tuple:
+        """
+        当前集合版本和其中条目的 (条目数, 最大xmin)。其他进程或训练脚本增删改训练数据后会变化，
+        用于让进程内的缓存(语义缓存)跟随数据库中的训练数据失效
+        """
+        version = self.refresh_collection_version()
+        with self._stamp_lock:
+            stamp = self._stamp
+            generation = self._stamp_generation
+            if (
+                stamp is not None
+                and stamp[0] == version
+                and time.monotonic() - self._stamp_checked_at < self.training_data_stamp_ttl
+            ):
+                return stamp
+
+        checked_at = time.monotonic()
+        query = text(
+            """
+            SELECT count(e.id), coalesce(max(e.xmin::text::bigint), 0)
+            FROM langchain_pg_collection c
+            JOIN langchain_pg_embedding e ON e.collection_id = c.uuid
+            WHERE c.name IN :names
+        """
+        ).bindparams(bindparam("names", expanding=True))
+        with self.engine.connect() as connection:
+            count, max_xmin = connection.execute(query, {"names": self._current_collection_names()}).fetchone()
+        stamp = (version, count, max_xmin)
+        with self._stamp_lock:
+            # 查询期间本进程写入了训练数据时，结果可能已经过时，不缓存
+            if generation == self._stamp_generation:
+                self._stamp = stamp
+                self._stamp_checked_at = checked_at
+        return stamp
+
+    def _invalidate_training_data_stamp(self):
+        with self._stamp_lock:
+            self._stamp = None
+            self._stamp_generation += 1
+
+    @property
+    def sql_collection(self):
+        return self._collections["sql"]
+
+    @property
+    def ddl_collection(self):
+        return self._collections["ddl"]
+
+    @property
+    def documentation_collection(self):
+        return self._collections["documentation"]
+
+    @property
+    def table_summary_collection(self):
+        return self._collections["table_summary"]
+
+    @property
+    def table_ddl_collection(self):
+        return self._collections["table_ddl"]
+
+    def _current_collection_names(self) -> list:
+        return [versioned_collection_name(base_name, self.collection_version) for base_name in self._collections]
+
+    @property
+    def engine(self):
+        # 复用同一个engine，避免每次键值查找都新建连接池
+        if self._engine is None:
+            self._engine = create_engine(self.connection_string)
+        return self._engine
+
+    def _ensure_table_name_index(self):
+        # 键值查找按 cmetadata->>'table_name' 过滤，建表达式索引保证表数量增长时查询耗时不变
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(text(
+                    """
+                    CREATE INDEX IF NOT EXISTS ix_langchain_pg_embedding_table_name
+                    ON langchain_pg_embedding ((cmetadata ->> 'table_name'))
+                    """
+                ))
+        except Exception as e:
+            logger.error(f"Failed to create table_name index: {e}")
 
     def add_question_sql(self, question: str, sql: str, **kwargs) -> str:
         question_sql_json = json.dumps(
@@ -61,6 +244,7 @@ class PG_VectorStore(VannaBase):
             metadata={"id": id, "createdat": createdat},
         )
         self.sql_collection.add_documents([doc], ids=[doc.metadata["id"]])
+        self._invalidate_training_data_stamp()
 
         return id
 
@@ -71,6 +255,7 @@ class PG_VectorStore(VannaBase):
             metadata={"id": _id},
         )
         self.ddl_collection.add_documents([doc], ids=[doc.metadata["id"]])
+        self._invalidate_training_data_stamp()
         return _id
 
     def add_documentation(self, documentation: str, **kwargs) -> str:
@@ -80,8 +265,171 @@ class PG_VectorStore(VannaBase):
             metadata={"id": _id},
         )
         self.documentation_collection.add_documents([doc], ids=[doc.metadata["id"]])
+        self._invalidate_training_data_stamp()
         return _id
 
+    def add_table_schema(self, table_name: str, summary: str, ddl: str, **kwargs) -> str:
+        """
+        写入一张表的精简摘要(用于第一阶段检索)和详细DDL(用于第二阶段键值查找)。
+        id由集合版本和表名确定，重复训练同一张表时会覆盖旧记录而不是追加。
+        """
+        if not self.hierarchical_ddl:
+            raise ValueError("hierarchical_ddl is not enabled in config.")
+
+        table_key = str(uuid.uuid5(uuid.NAMESPACE_URL, self._table_key(table_name)))
+        summary_id = table_key + "-tbl"
+        ddl_id = table_key + "-ddl"
+
+        summary_doc = Document(
+            page_content=summary,
+            metadata={"id": summary_id, "table_name": table_name},
+        )
+        ddl_doc = Document(
+            page_content=ddl,
+            metadata={"id": ddl_id, "table_name": table_name},
+        )
+        self.table_summary_collection.add_documents([summary_doc], ids=[summary_id])
+        self.table_ddl_collection.add_documents([ddl_doc], ids=[ddl_id])
+        self._invalidate_training_data_stamp()
+        return ddl_id
+
+    def _table_key(self, table_name: str) -> str:
+        """
+        所有版本的集合共用 langchain_pg_embedding 表，id是主键。id中必须包含版本，
+        否则重建影子版本时会覆盖线上版本的记录；默认版本沿用原来只含表名的键
+        """
+        if not self.collection_version or self.collection_version == DEFAULT_VERSION:
+            return f"table:{table_name}"
+        return f"table:{self.collection_version}:{table_name}"
+
+    def get_table_ddl(self, table_names: list) -> list:
+        """按表名直接从table_ddl集合中取出详细DDL，不做向量检索，返回顺序与table_names一致"""
+        if not table_names:
+            return []
+
+        query = text(
+            """
+            SELECT e.cmetadata ->> 'table_name' AS table_name, e.document
+            FROM langchain_pg_embedding e
+            JOIN langchain_pg_collection c ON e.collection_id = c.uuid
+            WHERE c.name = :collection_name
+              AND e.cmetadata ->> 'table_name' IN :table_names
+        """
+        ).bindparams(bindparam("table_names", expanding=True))
+
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                query,
+                {
+                    "collection_name": versioned_collection_name("table_ddl", self.collection_version),
+                    "table_names": list(table_names),
+                },
+            ).fetchall()
+
+        ddl_by_table = {row.table_name: row.document for row in rows}
+        return [ddl_by_table[name] for name in table_names if name in ddl_by_table]
+
+    def _get_hierarchical_ddl(self, question: str) -> list:
+        summaries = self._search("table_summary", question, k=self.n_results_table)
+        table_names = []
+        for document, _ in summaries:
+            table_name = document.metadata.get("table_name")
+            if table_name and table_name not in table_names:
+                table_names.append(table_name)
+        return self._apply_token_budget("ddl", self.get_table_ddl(table_names))
+
+    def _embed_question(self, question: str) -> list:
+        with self._question_embeddings_lock:
+            if question in self._question_embeddings:
+                self._question_embeddings.move_to_end(question)
+                return self._question_embeddings[question]
+
+        embedding = self.embedding_function.embed_query(question)
+
+        with self._question_embeddings_lock:
+            self._question_embeddings[question] = embedding
+            while len(self._question_embeddings) > self._question_embeddings_size:
+                self._question_embeddings.popitem(last=False)
+        return embedding
+
+    def cache_question_embeddings(self, embeddings: dict):
+        """写入预先批量计算好的问题向量"""
+        with self._question_embeddings_lock:
+            for question, embedding in embeddings.items():
+                self._question_embeddings[question] = embedding
+                self._question_embeddings.move_to_end(question)
+            while len(self._question_embeddings) > self._question_embeddings_size:
+                self._question_embeddings.popitem(last=False)
+
+    def _search(self, collection_name: str, question: str, k: int | None = None) -> list:
+        """
+        在指定集合中检索，返回经过距离阈值、自适应k筛选后的 [(Document, distance), ...]，按距离升序
+        """
+        self.refresh_collection_version()
+        if k is None:
+            k = self.n_results_by_collection.get(collection_name, self.n_results)
+        if not question or not question.strip():
+            # 空问题(例如首页的示例问题)无法计算有效向量，直接取前k条
+            return self._sample_documents(collection_name, k)
+
+        collection = self.get_collection(collection_name)
+        results = collection.similarity_search_with_score_by_vector(
+            embedding=self._embed_question(question), k=k
+        )
+
+        max_distance = self.max_distance.get(collection_name)
+        selected = []
+        previous_distance = None
+        for document, distance in results:
+            # 被 training/repair_zero_vectors.py 隔离的条目向量无效，不参与检索
+            if document.metadata.get("quarantined"):
+                continue
+            if max_distance is not None and distance > max_distance:
+                break
+            if (
+                self.distance_gap is not None
+                and previous_distance is not None
+                and distance - previous_distance > self.distance_gap
+            ):
+                break
+            selected.append((document, distance))
+            previous_distance = distance
+        return selected
+
+    def _sample_documents(self, collection_name: str, k: int) -> list:
+        query = text(
+            """
+            SELECT e.document, e.cmetadata
+            FROM langchain_pg_embedding e
+            JOIN langchain_pg_collection c ON e.collection_id = c.uuid
+            WHERE c.name = :collection_name
+              AND COALESCE((e.cmetadata ->> 'quarantined')::boolean, false) = false
+            LIMIT :k
+        """
+        )
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                query,
+                {"collection_name": versioned_collection_name(collection_name, self.collection_version), "k": k},
+            ).fetchall()
+        return [(Document(page_content=row.document, metadata=row.cmetadata or {}), 0.0) for row in rows]
+
+    def _apply_token_budget(self, collection_name: str, contents: list) -> list:
+        """按排名顺序保留内容，直到超出该集合的token预算；至少保留第一条"""
+        budget = self.token_budget.get(collection_name)
+        if budget is None:
+            return contents
+
+        kept = []
+        used_tokens = 0
+        for content in contents:
+            tokens = self.str_to_approx_token_count(content)
+            if kept and used_tokens + tokens > budget:
+                break
+            kept.append(content)
+            used_tokens += tokens
+        return kept
+
     def get_collection(self, collection_name):
         match collection_name:
             case "sql":
@@ -90,20 +438,34 @@ class PG_VectorStore(VannaBase):
                 return self.ddl_collection
             case "documentation":
                 return self.documentation_collection
+            case "table_summary" if self.hierarchical_ddl:
+                return self.table_summary_collection
+            case "table_ddl" if self.hierarchical_ddl:
+                return self.table_ddl_collection
             case _:
                 raise ValueError("Specified collection does not exist.")
 
-    def get_similar_question_sql(self, question: str) -> list:
-        documents = self.sql_collection.similarity_search(query=question, k=self.n_results)
-        return [ast.literal_eval(document.page_content) for document in documents]
+    def get_similar_question_sql_with_distances(self, question: str, **kwargs) -> list:
+        """与 get_similar_question_sql 相同，附带余弦距离: [(question_sql, distance), ...]，供精确匹配快速路径判断"""
+        documents = self._search("sql", question)
+        contents = self._apply_token_budget("sql", [document.page_content for document, _ in documents])
+        return [(ast.literal_eval(content), float(distance)) for content, (_, distance) in zip(contents, documents)]
+
+    def get_similar_question_sql(self, question: str, **kwargs) -> list:
+        return [item for item, _ in self.get_similar_question_sql_with_distances(question)]
 
     def get_related_ddl(self, question: str, **kwargs) -> list:
-        documents = self.ddl_collection.similarity_search(query=question, k=self.n_results)
-        return [document.page_content for document in documents]
+        if self.hierarchical_ddl:
+            ddl_list = self._get_hierarchical_ddl(question)
+            # 尚未训练表摘要时退回到原来的平铺检索
+            if ddl_list:
+                return ddl_list
+        documents = self._search("ddl", question)
+        return self._apply_token_budget("ddl", [document.page_content for document, _ in documents])
 
     def get_related_documentation(self, question: str, **kwargs) -> list:
-        documents = self.documentation_collection.similarity_search(query=question, k=self.n_results)
-        return [document.page_content for document in documents]
+        documents = self._search("documentation", question)
+        return self._apply_token_budget("documentation", [document.page_content for document, _ in documents])
 
     def train(
         self,
@@ -118,14 +480,14 @@ class PG_VectorStore(VannaBase):
             raise ValidationError("Please provide a SQL query.")
 
         if documentation:
-            logging.info(f"Adding documentation: {documentation}")
+            logger.info(f"Adding documentation: {documentation}")
             return self.add_documentation(documentation)
 
         if sql and question:
             return self.add_question_sql(question=question, sql=sql, createdat=createdat)
 
         if ddl:
-            logging.info(f"Adding ddl: {ddl}")
+            logger.info(f"Adding ddl: {ddl}")
             return self.add_ddl(ddl)
 
         if plan:
@@ -138,12 +500,18 @@ class PG_VectorStore(VannaBase):
                     self.add_question_sql(question=item.item_name, sql=item.item_value)
 
     def get_training_data(self, **kwargs) -> pd.DataFrame:
-        # Establishing the connection
-        engine = create_engine(self.connection_string)
+        self.refresh_collection_version()
 
-        # Querying the 'langchain_pg_embedding' table
-        query_embedding = "SELECT cmetadata, document FROM langchain_pg_embedding"
-        df_embedding = pd.read_sql(query_embedding, engine)
+        # Querying the 'langchain_pg_embedding' table, limited to the collections of the current version
+        query_embedding = text(
+            """
+            SELECT e.cmetadata, e.document
+            FROM langchain_pg_embedding e
+            JOIN langchain_pg_collection c ON e.collection_id = c.uuid
+            WHERE c.name IN :names
+        """
+        ).bindparams(bindparam("names", expanding=True))
+        df_embedding = pd.read_sql(query_embedding, self.engine, params={"names": self._current_collection_names()})
 
         # List to accumulate the processed rows
         processed_rows = []
@@ -161,14 +529,14 @@ class PG_VectorStore(VannaBase):
                     question = doc_dict.get("question")
                     content = doc_dict.get("sql")
                 except (ValueError, SyntaxError):
-                    logging.info(f"Skipping row with custom_id {custom_id} due to parsing error.")
+                    logger.info(f"Skipping row with custom_id {custom_id} due to parsing error.")
                     continue
             elif training_data_type in ["documentation", "ddl"]:
                 question = None  # Default value for question
                 content = document
             else:
                 # If the suffix is not recognized, skip this row
-                logging.info(f"Skipping row with custom_id {custom_id} due to unrecognized training data type.")
+                logger.info(f"Skipping row with custom_id {custom_id} due to unrecognized training data type.")
                 continue
 
             # Append the processed data to the list
@@ -182,42 +550,45 @@ class PG_VectorStore(VannaBase):
         return df_processed
 
     def remove_training_data(self, id: str, **kwargs) -> bool:
-        # Create the database engine
-        engine = create_engine(self.connection_string)
+        engine = self.engine
 
         # SQL DELETE statement
         delete_statement = text(
             """
             DELETE FROM langchain_pg_embedding
             WHERE cmetadata ->> 'id' = :id
+              AND collection_id IN (SELECT uuid FROM langchain_pg_collection WHERE name IN :names)
         """
-        )
+        ).bindparams(bindparam("names", expanding=True))
 
         # Connect to the database and execute the delete statement
         with engine.connect() as connection:
             # Start a transaction
             with connection.begin() as transaction:
                 try:
-                    result = connection.execute(delete_statement, {"id": id})
+                    result = connection.execute(
+                        delete_statement, {"id": id, "names": self._current_collection_names()}
+                    )
                     # Commit the transaction if the delete was successful
                     transaction.commit()
+                    self._invalidate_training_data_stamp()
                     # Check if any row was deleted and return True or False accordingly
                     return result.rowcount > 0
                 except Exception as e:
                     # Rollback the transaction in case of error
-                    logging.error(f"An error occurred: {e}")
+                    logger.error(f"An error occurred: {e}")
                     transaction.rollback()
                     return False
 
     def remove_collection(self, collection_name: str) -> bool:
-        engine = create_engine(self.connection_string)
+        engine = self.engine
 
         # Determine the suffix to look for based on the collection name
         suffix_map = {"ddl": "ddl", "sql": "sql", "documentation": "doc"}
         suffix = suffix_map.get(collection_name)
 
         if not suffix:
-            logging.info("Invalid collection name. Choose from 'ddl', 'sql', or 'documentation'.")
+            logger.info("Invalid collection name. Choose from 'ddl', 'sql', or 'documentation'.")
             return False
 
         # SQL query to delete rows based on the condition
@@ -225,28 +596,30 @@ class PG_VectorStore(VannaBase):
             f"""
             DELETE FROM langchain_pg_embedding
             WHERE cmetadata->>'id' LIKE '%{suffix}'
+              AND collection_id IN (SELECT uuid FROM langchain_pg_collection WHERE name IN :names)
         """
-        )
+        ).bindparams(bindparam("names", expanding=True))
 
         # Execute the deletion within a transaction block
         with engine.connect() as connection:
             with connection.begin() as transaction:
                 try:
-                    result = connection.execute(query)
+                    result = connection.execute(query, {"names": self._current_collection_names()})
                     transaction.commit()  # Explicitly commit the transaction
+                    self._invalidate_training_data_stamp()
                     if result.rowcount > 0:
-                        logging.info(
+                        logger.info(
                             f"Deleted {result.rowcount} rows from "
                             f"langchain_pg_embedding where collection is {collection_name}."
                         )
                         return True
                     else:
-                        logging.info(f"No rows deleted for collection {collection_name}.")
+                        logger.info(f"No rows deleted for collection {collection_name}.")
                         return False
                 except Exception as e:
-                    logging.error(f"An error occurred: {e}")
+                    logger.error(f"An error occurred: {e}")
                     transaction.rollback()  # Rollback in case of error
                     return False
 
-    def generate_embedding(self, *args, **kwargs):
-        pass
+    def generate_embedding(self, data: str, **kwargs) -> list:
+        return self.embedding_function.embed_query(data)
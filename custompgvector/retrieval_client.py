@@ -0,0 +1,190 @@
+import contextlib
+import contextvars
+import http.client
+import json
+import threading
+from urllib.parse import urlparse
+
+import pandas as pd
+from vanna.base import VannaBase
+from vanna.exceptions import ValidationError
+from vanna.types import TrainingPlan, TrainingPlanItem
+
+
+# 只读接口可以安全重试；/add 等写接口重试可能写入重复的训练数据
+_READ_ONLY_POSTS = ("/retrieve",)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        import socket
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.unix_path)
+        self.sock = sock
+
+
+class PG_VectorStoreClient(VannaBase):
+    """
+    检索服务(custompgvector/retrieval_service.py)的客户端，
+    worker进程内不持有PGVector客户端和数据库连接。
+    """
+
+    def __init__(self, config=None):
+        if not config or "retrieval_service_url" not in config:
+            raise ValueError(
+                "A valid 'config' dictionary with a 'retrieval_service_url' is required.")
+
+        VannaBase.__init__(self, config=config)
+
+        self.service_url = urlparse(config["retrieval_service_url"])
+        self.timeout = config.get("retrieval_service_timeout", 10)
+        self.embedding_function = config.get("embedding_function")
+        # 每个线程一个keep-alive连接
+        self._local = threading.local()
+        # retrieval_scope 内(一次 generate_sql)的检索结果，依次调用的三个检索方法只发一次请求；
+        # 使用ContextVar，agenerate_sql 放到不同线程中的检索也能共用
+        self._retrieval_memo = contextvars.ContextVar(f"retrieval_memo_{id(self)}", default=None)
+
+    def _get_connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            if self.service_url.scheme == "unix":
+                connection = _UnixHTTPConnection(self.service_url.path, timeout=self.timeout)
+            else:
+                connection = http.client.HTTPConnection(
+                    self.service_url.hostname, self.service_url.port, timeout=self.timeout
+                )
+            self._local.connection = connection
+        return connection
+
+    def _request(self, method: str, path: str, payload: dict | None = None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"}
+        attempts = 2 if method == "GET" or path in _READ_ONLY_POSTS else 1
+
+        for attempt in range(attempts):
+            connection = self._get_connection()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = json.loads(response.read().decode("utf-8"))
+                break
+            except (http.client.HTTPException, ConnectionError, OSError):
+                # 服务端关闭了keep-alive连接时，只读请求重连一次
+                connection.close()
+                self._local.connection = None
+                if attempt == attempts - 1:
+                    raise
+
+        if not data.get("success"):
+            raise Exception(f"检索服务调用失败: {data.get('message')}")
+        return data.get("data")
+
+    @contextlib.contextmanager
+    def retrieval_scope(self):
+        """在作用域内记住检索结果；作用域外每次调用都请求检索服务，不会用到其他请求的旧结果"""
+        token = self._retrieval_memo.set({})
+        try:
+            yield
+        finally:
+            self._retrieval_memo.reset(token)
+
+    def _retrieve(self, question: str, **kwargs) -> dict:
+        memo = self._retrieval_memo.get()
+        key = (question, tuple(sorted((name, repr(value)) for name, value in kwargs.items())))
+        if memo is not None and key in memo:
+            return memo[key]
+        results = self._request("POST", "/retrieve", {"question": question})
+        if memo is not None:
+            memo[key] = results
+        return results
+
+    def _invalidate(self):
+        memo = self._retrieval_memo.get()
+        if memo is not None:
+            memo.clear()
+
+    def get_similar_question_sql_with_distances(self, question: str, **kwargs) -> list:
+        """见 PG_VectorStore.get_similar_question_sql_with_distances"""
+        return [(item, distance) for item, distance in self._retrieve(question, **kwargs)["sql"]]
+
+    def get_similar_question_sql(self, question: str, **kwargs) -> list:
+        return [item for item, _ in self._retrieve(question, **kwargs)["sql"]]
+
+    def get_related_ddl(self, question: str, **kwargs) -> list:
+        return self._retrieve(question, **kwargs)["ddl"]
+
+    def get_related_documentation(self, question: str, **kwargs) -> list:
+        return self._retrieve(question, **kwargs)["documentation"]
+
+    def add_question_sql(self, question: str, sql: str, **kwargs) -> str:
+        self._invalidate()
+        return self._request("POST", "/add", {"kind": "question_sql", "question": question, "sql": sql})["id"]
+
+    def add_ddl(self, ddl: str, **kwargs) -> str:
+        self._invalidate()
+        return self._request("POST", "/add", {"kind": "ddl", "ddl": ddl})["id"]
+
+    def add_documentation(self, documentation: str, **kwargs) -> str:
+        self._invalidate()
+        return self._request("POST", "/add", {"kind": "documentation", "documentation": documentation})["id"]
+
+    def add_table_schema(self, table_name: str, summary: str, ddl: str, **kwargs) -> str:
+        self._invalidate()
+        return self._request(
+            "POST", "/add", {"kind": "table_schema", "table_name": table_name, "summary": summary, "ddl": ddl}
+        )["id"]
+
+    def train(
+        self,
+        question: str | None = None,
+        sql: str | None = None,
+        ddl: str | None = None,
+        documentation: str | None = None,
+        plan: TrainingPlan | None = None,
+    ):
+        if question and not sql:
+            raise ValidationError("Please provide a SQL query.")
+
+        if documentation:
+            return self.add_documentation(documentation)
+
+        if sql and question:
+            return self.add_question_sql(question=question, sql=sql)
+
+        if ddl:
+            return self.add_ddl(ddl)
+
+        if plan:
+            for item in plan._plan:
+                if item.item_type == TrainingPlanItem.ITEM_TYPE_DDL:
+                    self.add_ddl(item.item_value)
+                elif item.item_type == TrainingPlanItem.ITEM_TYPE_IS:
+                    self.add_documentation(item.item_value)
+                elif item.item_type == TrainingPlanItem.ITEM_TYPE_SQL and item.item_name:
+                    self.add_question_sql(question=item.item_name, sql=item.item_value)
+
+    def training_data_stamp(self) -> tuple:
+        """见 PG_VectorStore.training_data_stamp"""
+        return tuple(self._request("GET", "/training_data_stamp"))
+
+    def get_training_data(self, **kwargs) -> pd.DataFrame:
+        return pd.DataFrame(self._request("GET", "/training_data"))
+
+    def remove_training_data(self, id: str, **kwargs) -> bool:
+        self._invalidate()
+        return self._request("POST", "/remove", {"id": id})["success"]
+
+    def remove_collection(self, collection_name: str) -> bool:
+        self._invalidate()
+        return self._request("POST", "/remove_collection", {"collection_name": collection_name})["success"]
+
+    def generate_embedding(self, data: str, **kwargs) -> list:
+        if self.embedding_function is None:
+            raise ValueError("No embedding_function was found.")
+        return self.embedding_function.embed_query(data)
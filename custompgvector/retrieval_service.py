@@ -0,0 +1,310 @@
+"""
+独立的检索服务：在一个进程中持有 PG_VectorStore，供所有Web worker共享。
+
+worker 通过 PG_VectorStoreClient(VECTOR_DB_TYPE = "pgvector_service") 访问本服务，
+不再各自创建 PGVector 客户端和数据库连接池。
+
+启动方式:
+    python -m custompgvector.retrieval_service
+"""
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from vanna.exceptions import ImproperlyConfigured
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app_config
+from common import result
+from custompgvector.custom_pgvector import PG_VectorStore
+from embedding_function import get_embedding_function
+
+
+RETRIEVAL_KINDS = ("sql", "ddl", "documentation")
+
+
+class RetrievalOnlyStore(PG_VectorStore):
+    """只提供检索和训练数据读写的 PG_VectorStore，不具备LLM能力"""
+
+    def system_message(self, message: str) -> any:
+        return {"role": "system", "content": message}
+
+    def user_message(self, message: str) -> any:
+        return {"role": "user", "content": message}
+
+    def assistant_message(self, message: str) -> any:
+        return {"role": "assistant", "content": message}
+
+    def submit_prompt(self, prompt, **kwargs) -> str:
+        # 检索服务进程不配置LLM，需要生成内容的调用应在web worker中通过 CustomVannaDynamic 完成
+        raise ImproperlyConfigured("检索服务没有配置LLM，不能调用 submit_prompt")
+
+
+class EmbeddingBatcher:
+    """
+    合并并发请求中的问题向量计算：在 batch_wait_ms 窗口内到达的问题去重后一次性计算，
+    结果写入 store 的问题向量缓存，随后的检索直接命中缓存。
+    """
+
+    def __init__(self, store, batch_wait_ms=5, max_batch_size=32):
+        self.store = store
+        self.batch_wait = batch_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.pending = []
+        self.condition = threading.Condition()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def embed(self, question: str) -> list:
+        future = Future()
+        with self.condition:
+            self.pending.append((question, future))
+            self.condition.notify()
+        return future.result()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                deadline = time.monotonic() + self.batch_wait
+                while len(self.pending) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch = self.pending[:self.max_batch_size]
+                self.pending = self.pending[self.max_batch_size:]
+
+            questions = list(dict.fromkeys(question for question, _ in batch))
+            try:
+                embeddings = dict(zip(questions, self.store.embedding_function.embed_documents(questions)))
+                self.store.cache_question_embeddings(embeddings)
+                for question, future in batch:
+                    future.set_result(embeddings[question])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+class RetrievalCache:
+    """最近检索结果的LRU缓存，训练数据变更时整体清空"""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+class RetrievalService:
+    def __init__(self, store, batch_wait_ms=5, max_batch_size=32, cache_size=1024):
+        self.store = store
+        self.batcher = EmbeddingBatcher(store, batch_wait_ms=batch_wait_ms, max_batch_size=max_batch_size)
+        self.cache = RetrievalCache(max_size=cache_size)
+
+    def retrieve(self, question: str, kinds=RETRIEVAL_KINDS) -> dict:
+        # 缓存键包含集合版本，蓝绿切换后不会返回旧版本的结果
+        version = self.store.refresh_collection_version()
+        results = {}
+        missing = []
+        for kind in kinds:
+            cached = self.cache.get((version, kind, question))
+            if cached is None:
+                missing.append(kind)
+            else:
+                results[kind] = cached
+
+        if missing:
+            self.batcher.embed(question)
+            for kind in missing:
+                if kind == "sql":
+                    # [[question_sql, distance], ...]，客户端据此提供精确匹配所需的距离
+                    value = self.store.get_similar_question_sql_with_distances(question)
+                elif kind == "ddl":
+                    value = self.store.get_related_ddl(question)
+                elif kind == "documentation":
+                    value = self.store.get_related_documentation(question)
+                else:
+                    raise ValueError(f"不支持的检索类型: {kind}")
+                self.cache.set((version, kind, question), value)
+                results[kind] = value
+        return results
+
+    def add(self, kind: str, payload: dict) -> str:
+        if kind == "question_sql":
+            _id = self.store.add_question_sql(question=payload["question"], sql=payload["sql"])
+        elif kind == "ddl":
+            _id = self.store.add_ddl(payload["ddl"])
+        elif kind == "documentation":
+            _id = self.store.add_documentation(payload["documentation"])
+        elif kind == "table_schema":
+            _id = self.store.add_table_schema(
+                table_name=payload["table_name"], summary=payload["summary"], ddl=payload["ddl"]
+            )
+        else:
+            raise ValueError(f"不支持的训练数据类型: {kind}")
+        self.cache.clear()
+        return _id
+
+    def training_data_stamp(self) -> list:
+        return list(self.store.training_data_stamp())
+
+    def get_training_data(self) -> list:
+        df = self.store.get_training_data()
+        return df.to_dict(orient="records")
+
+    def remove_training_data(self, id: str) -> bool:
+        removed = self.store.remove_training_data(id)
+        self.cache.clear()
+        return removed
+
+    def remove_collection(self, collection_name: str) -> bool:
+        removed = self.store.remove_collection(collection_name)
+        self.cache.clear()
+        return removed
+
+
+def make_handler(service):
+    class RetrievalRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, body, status=200):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _read_json(self):
+            length = int(self.headers.get("Content-Length", 0))
+            if length == 0:
+                return {}
+            return json.loads(self.rfile.read(length).decode("utf-8"))
+
+        def do_GET(self):
+            try:
+                if self.path == "/health":
+                    self._send_json(result.success(data={"status": "ok"}))
+                elif self.path == "/training_data":
+                    self._send_json(result.success(data=service.get_training_data()))
+                elif self.path == "/training_data_stamp":
+                    self._send_json(result.success(data=service.training_data_stamp()))
+                else:
+                    self._send_json(result.failed(message="未知的接口", code=404), status=404)
+            except Exception as e:
+                self._send_json(result.failed(message=str(e)), status=500)
+
+        def do_POST(self):
+            try:
+                payload = self._read_json()
+                if self.path == "/retrieve":
+                    data = service.retrieve(payload["question"], payload.get("kinds", RETRIEVAL_KINDS))
+                elif self.path == "/add":
+                    data = {"id": service.add(payload["kind"], payload)}
+                elif self.path == "/remove":
+                    data = {"success": service.remove_training_data(payload["id"])}
+                elif self.path == "/remove_collection":
+                    data = {"success": service.remove_collection(payload["collection_name"])}
+                else:
+                    self._send_json(result.failed(message="未知的接口", code=404), status=404)
+                    return
+                self._send_json(result.success(data=data))
+            except Exception as e:
+                self._send_json(result.failed(message=str(e)), status=500)
+
+        def log_message(self, format, *args):
+            # 检索请求频繁，不逐条打印访问日志
+            pass
+
+    return RetrievalRequestHandler
+
+
+class RetrievalHTTPServer(ThreadingHTTPServer):
+    # 多个worker同时建立连接，默认的监听队列长度(5)不够用
+    request_queue_size = 128
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler 需要 (host, port) 形式的客户端地址
+        return request, ("unix", 0)
+
+
+def create_store(config_module=None) -> RetrievalOnlyStore:
+    if config_module is None:
+        config_module = app_config
+
+    if config_module.MODEL_TYPE.lower() == "deepseek":
+        model_config = config_module.DEEPSEEK_CONFIG
+    else:
+        model_config = config_module.QWEN_CONFIG
+
+    db_cfg = config_module.PGVECTOR_CONFIG
+    config = {key: value for key, value in model_config.items() if key.startswith("n_results")}
+    config["connection_string"] = (
+        f"postgresql://{db_cfg['user']}:{db_cfg['password']}@"
+        f"{db_cfg['host']}:{db_cfg['port']}/{db_cfg['dbname']}"
+    )
+    config.update(getattr(config_module, "PGVECTOR_RETRIEVAL_CONFIG", {}))
+    config["embedding_function"] = get_embedding_function()
+    return RetrievalOnlyStore(config=config)
+
+
+def create_server(service, url: str):
+    handler = make_handler(service)
+    parsed = urlparse(url)
+    if parsed.scheme == "unix":
+        if os.path.exists(parsed.path):
+            os.remove(parsed.path)
+        return ThreadingUnixHTTPServer(parsed.path, handler)
+    return RetrievalHTTPServer((parsed.hostname or "127.0.0.1", parsed.port or 8091), handler)
+
+
+def main():
+    service_config = app_config.RETRIEVAL_SERVICE_CONFIG
+    service = RetrievalService(
+        create_store(),
+        batch_wait_ms=service_config.get("batch_wait_ms", 5),
+        max_batch_size=service_config.get("max_batch_size", 32),
+        cache_size=service_config.get("cache_size", 1024),
+    )
+    server = create_server(service, service_config["url"])
+    print(f"检索服务已启动: {service_config['url']}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,32 @@
 import os
 from openai import OpenAI
 from vanna.base import VannaBase
+from common.token_counter import count_message_tokens
+from common.llm_client import QWEN_BASE_URL, get_openai_client
+from common.openai_chat import OpenAIChatMixin
+from common.logger import get_logger, log_payload
 
+logger = get_logger(__name__)
+
+
+class QianWenAI_Chat(OpenAIChatMixin, VannaBase):
+  # 由SQL生成问题的提示词，训练时的问题缓存版本包含它的哈希
+  QUESTION_SYSTEM_PROMPT = (
+    "请你根据下方SQL语句推测用户的业务提问，只返回清晰的自然语言问题，不要包含任何解释或SQL内容，也不要出现表名，问题要使用中文，并以问号结尾。"
+  )
 
-class QianWenAI_Chat(VannaBase):
   def __init__(self, client=None, config=None):
-    print("...QianWenAI_Chat init...")
+    logger.info("...QianWenAI_Chat init...")
     VannaBase.__init__(self, config=config)
 
-    print("传入的 config 参数如下：")
-    for key, value in self.config.items():
-        print(f"  {key}: {value}")
+    # 不输出API密钥
+    logger.debug("传入的 config 参数: %s", {key: value for key, value in self.config.items() if key != "api_key"})
 
     # default parameters - can be overrided using config
     self.temperature = 0.7
 
     if "temperature" in config:
-      print(f"temperature is changed to: {config['temperature']}")
+      logger.info("temperature is changed to: %s", config["temperature"])
       self.temperature = config["temperature"]
 
     if "api_type" in config:
@@ -43,55 +53,40 @@ class QianWenAI_Chat(VannaBase):
       return
 
     if "api_key" in config:
-      if "base_url" not in config:
-        self.client = OpenAI(api_key=config["api_key"],
-                             base_url="https://dashscope.aliyuncs.com/compatible-mode/v1")
-      else:
-        self.client = OpenAI(api_key=config["api_key"],
-                             base_url=config["base_url"])
+      # 使用进程内共享的连接池，超时和重试见 app_config.LLM_CLIENT_CONFIG
+      self.client = get_openai_client(config["api_key"], config.get("base_url", QWEN_BASE_URL))
    
   def system_message(self, message: str) -> any:
-    print(f"system_content: {message}")
+    log_payload(logger, "system_content", message)
     return {"role": "system", "content": message}
 
   def user_message(self, message: str) -> any:
-    print(f"\nuser_content: {message}")
+    log_payload(logger, "user_content", message)
     return {"role": "user", "content": message}
 
   def assistant_message(self, message: str) -> any:
-    print(f"assistant_content: {message}")
+    log_payload(logger, "assistant_content", message)
     return {"role": "assistant", "content": message}
 
-  def submit_prompt(self, prompt, **kwargs) -> str:
+  def _build_chat_params(self, prompt, **kwargs):
+    """构造chat.completions.create的公共参数，返回 (参数字典, 模型名)"""
     if prompt is None:
       raise Exception("Prompt is None")
 
     if len(prompt) == 0:
       raise Exception("Prompt is empty")
 
-    # Count the number of tokens in the message log
-    # Use 4 as an approximation for the number of characters per token
-    num_tokens = 0
-    for message in prompt:
-      num_tokens += len(message["content"]) / 4
+    # 用分词器计算消息的token数(中文按字符数估算时会少算很多)
+    num_tokens = count_message_tokens(prompt)
 
-    # 从配置和参数中获取enable_thinking设置
-    # 优先使用参数中传入的值，如果没有则从配置中读取，默认为False
-    enable_thinking = kwargs.get("enable_thinking", self.config.get("enable_thinking", False))
-    
     # 公共参数
     common_params = {
       "messages": prompt,
-      "stop": None,
+      # SQL提示词会带上停止序列(SQL_STREAM_CONFIG)，模型写完SQL代码块后不再输出解释
+      "stop": kwargs.get("stop"),
       "temperature": self.temperature,
     }
-    
-    # 如果启用了thinking，则使用流式处理，但不直接传递enable_thinking参数
-    if enable_thinking:
-      common_params["stream"] = True
-      # 千问API不接受enable_thinking作为参数，可能需要通过header或其他方式传递
-      # 也可能它只是默认启用stream=True时的thinking功能
-    
+
     model = None
     # 确定使用的模型
     if kwargs.get("model", None) is not None:
@@ -113,55 +108,20 @@ class QianWenAI_Chat(VannaBase):
       else:
         model = "qwen-plus"
       common_params["model"] = model
-    
-    print(f"\nUsing model {model} for {num_tokens} tokens (approx)")
-    
-    if enable_thinking:
-      # 流式处理模式
-      print("使用流式处理模式，启用thinking功能")
-      
-      # 检查是否需要通过headers传递enable_thinking参数
-      response_stream = self.client.chat.completions.create(**common_params)
-      
-      # 收集流式响应
-      collected_thinking = []
-      collected_content = []
-      
-      for chunk in response_stream:
-        # 处理thinking部分
-        if hasattr(chunk, 'thinking') and chunk.thinking:
-          collected_thinking.append(chunk.thinking)
-        
-        # 处理content部分
-        if hasattr(chunk.choices[0].delta, 'content') and chunk.choices[0].delta.content:
-          collected_content.append(chunk.choices[0].delta.content)
-      
-      # 可以在这里处理thinking的展示逻辑，如保存到日志等
-      if collected_thinking:
-        print("Model thinking process:", "".join(collected_thinking))
-      
-      # 返回完整的内容
-      return "".join(collected_content)
-    else:
-      # 非流式处理模式
-      print("使用非流式处理模式")
-      response = self.client.chat.completions.create(**common_params)
-      
-      # Find the first response from the chatbot that has text in it (some responses may not have text)
-      for choice in response.choices:
-        if "text" in choice:
-          return choice.text
-
-      # If no response with text is found, return the first response's content (which may be empty)
-      return response.choices[0].message.content
+
+    logger.debug("Using model %s for %s tokens (approx)", model, num_tokens)
+    return common_params, model
+
+  def _use_stream(self, kwargs: dict) -> bool:
+    # 从配置和参数中获取enable_thinking设置，优先使用参数中传入的值，默认为False；启用时使用流式处理
+    enable_thinking = kwargs.get("enable_thinking", self.config.get("enable_thinking", False))
+    return enable_thinking or super()._use_stream(kwargs)
 
 # 为了解决通过sql生成question时，question是英文的问题。
   def generate_question(self, sql: str, **kwargs) -> str:
       # 这里可以自定义提示词/逻辑
       prompt = [
-          self.system_message(
-              "请你根据下方SQL语句推测用户的业务提问，只返回清晰的自然语言问题，不要包含任何解释或SQL内容，也不要出现表名，问题要使用中文，并以问号结尾。"
-          ),
+          self.system_message(self.QUESTION_SYSTEM_PROMPT),
           self.user_message(sql)
       ]
       response = self.submit_prompt(prompt, **kwargs)
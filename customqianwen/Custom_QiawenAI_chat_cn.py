@@ -4,11 +4,18 @@
 """
 import os
 from openai import OpenAI
+from common.token_counter import count_message_tokens
+from common.llm_client import QWEN_BASE_URL, get_openai_client
+from common.openai_chat import OpenAIChatMixin
+from common.logger import get_logger, log_payload
 from vanna.base import VannaBase
 from typing import List, Dict, Any, Optional
 
 
-class QianWenAI_Chat_CN(VannaBase):
+logger = get_logger(__name__)
+
+
+class QianWenAI_Chat_CN(OpenAIChatMixin, VannaBase):
     """
     中文千问AI聊天类，直接继承VannaBase
     实现正确的方法名(get_sql_prompt而不是generate_sql_prompt)
@@ -21,12 +28,11 @@ class QianWenAI_Chat_CN(VannaBase):
             client: 可选，OpenAI兼容的客户端
             config: 配置字典，包含API密钥等配置
         """
-        print("初始化QianWenAI_Chat_CN...")
+        logger.info("初始化QianWenAI_Chat_CN...")
         VannaBase.__init__(self, config=config)
 
-        print("传入的 config 参数如下：")
-        for key, value in self.config.items():
-            print(f"  {key}: {value}")
+        # 不输出API密钥
+        logger.debug("传入的 config 参数: %s", {key: value for key, value in self.config.items() if key != "api_key"})
 
         # 设置语言为中文
         self.language = "Chinese"
@@ -35,7 +41,7 @@ class QianWenAI_Chat_CN(VannaBase):
         self.temperature = 0.7
 
         if "temperature" in config:
-            print(f"temperature is changed to: {config['temperature']}")
+            logger.info("temperature is changed to: %s", config["temperature"])
             self.temperature = config["temperature"]
 
         if "api_type" in config:
@@ -62,14 +68,10 @@ class QianWenAI_Chat_CN(VannaBase):
             return
 
         if "api_key" in config:
-            if "base_url" not in config:
-                self.client = OpenAI(api_key=config["api_key"],
-                                    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1")
-            else:
-                self.client = OpenAI(api_key=config["api_key"],
-                                    base_url=config["base_url"])
+            # 使用进程内共享的连接池，超时和重试见 app_config.LLM_CLIENT_CONFIG
+            self.client = get_openai_client(config["api_key"], config.get("base_url", QWEN_BASE_URL))
         
-        print("中文千问AI初始化完成")
+        logger.info("中文千问AI初始化完成")
     
     def _response_language(self) -> str:
         """
@@ -81,26 +83,26 @@ class QianWenAI_Chat_CN(VannaBase):
         """
         创建系统消息
         """
-        print(f"[DEBUG] 系统消息: {message}")
+        log_payload(logger, "系统消息", message)
         return {"role": "system", "content": message}
 
     def user_message(self, message: str) -> any:
         """
         创建用户消息
         """
-        print(f"[DEBUG] 用户消息: {message}")
+        log_payload(logger, "用户消息", message)
         return {"role": "user", "content": message}
 
     def assistant_message(self, message: str) -> any:
         """
         创建助手消息
         """
-        print(f"[DEBUG] 助手消息: {message}")
+        log_payload(logger, "助手消息", message)
         return {"role": "assistant", "content": message}
 
-    def submit_prompt(self, prompt, **kwargs) -> str:
+    def _build_chat_params(self, prompt, **kwargs):
         """
-        提交提示词到LLM
+        构造chat.completions.create的公共参数，返回 (参数字典, 模型名)
         """
         if prompt is None:
             raise Exception("Prompt is None")
@@ -108,29 +110,17 @@ class QianWenAI_Chat_CN(VannaBase):
         if len(prompt) == 0:
             raise Exception("Prompt is empty")
 
-        # Count the number of tokens in the message log
-        # Use 4 as an approximation for the number of characters per token
-        num_tokens = 0
-        for message in prompt:
-            num_tokens += len(message["content"]) / 4
+        # 用分词器计算消息的token数(中文按字符数估算时会少算很多)
+        num_tokens = count_message_tokens(prompt)
 
-        # 从配置和参数中获取enable_thinking设置
-        # 优先使用参数中传入的值，如果没有则从配置中读取，默认为False
-        enable_thinking = kwargs.get("enable_thinking", self.config.get("enable_thinking", False))
-        
         # 公共参数
         common_params = {
             "messages": prompt,
-            "stop": None,
+            # SQL提示词会带上停止序列(SQL_STREAM_CONFIG)，模型写完SQL代码块后不再输出解释
+            "stop": kwargs.get("stop"),
             "temperature": self.temperature,
         }
         
-        # 如果启用了thinking，则使用流式处理，但不直接传递enable_thinking参数
-        if enable_thinking:
-            common_params["stream"] = True
-            # 千问API不接受enable_thinking作为参数，可能需要通过header或其他方式传递
-            # 也可能它只是默认启用stream=True时的thinking功能
-        
         model = None
         # 确定使用的模型
         if kwargs.get("model", None) is not None:
@@ -153,46 +143,15 @@ class QianWenAI_Chat_CN(VannaBase):
                 model = "qwen-plus"
             common_params["model"] = model
         
-        print(f"\nUsing model {model} for {num_tokens} tokens (approx)")
-        
-        if enable_thinking:
-            # 流式处理模式
-            print("使用流式处理模式，启用thinking功能")
-            
-            # 检查是否需要通过headers传递enable_thinking参数
-            response_stream = self.client.chat.completions.create(**common_params)
-            
-            # 收集流式响应
-            collected_thinking = []
-            collected_content = []
-            
-            for chunk in response_stream:
-                # 处理thinking部分
-                if hasattr(chunk, 'thinking') and chunk.thinking:
-                    collected_thinking.append(chunk.thinking)
-                
-                # 处理content部分
-                if hasattr(chunk.choices[0].delta, 'content') and chunk.choices[0].delta.content:
-                    collected_content.append(chunk.choices[0].delta.content)
-            
-            # 可以在这里处理thinking的展示逻辑，如保存到日志等
-            if collected_thinking:
-                print("Model thinking process:", "".join(collected_thinking))
-            
-            # 返回完整的内容
-            return "".join(collected_content)
-        else:
-            # 非流式处理模式
-            print("使用非流式处理模式")
-            response = self.client.chat.completions.create(**common_params)
-            
-            # Find the first response from the chatbot that has text in it (some responses may not have text)
-            for choice in response.choices:
-                if "text" in choice:
-                    return choice.text
+        logger.debug("Using model %s for %s tokens (approx)", model, num_tokens)
+        return common_params, model
 
-            # If no response with text is found, return the first response's content (which may be empty)
-            return response.choices[0].message.content
+    def _use_stream(self, kwargs: dict) -> bool:
+        """
+        从配置和参数中获取enable_thinking设置，优先使用参数中传入的值，默认为False；启用时使用流式处理
+        """
+        enable_thinking = kwargs.get("enable_thinking", self.config.get("enable_thinking", False))
+        return enable_thinking or super()._use_stream(kwargs)
 
     # 核心方法：get_sql_prompt
     def get_sql_prompt(self, question: str, 
@@ -203,22 +162,24 @@ class QianWenAI_Chat_CN(VannaBase):
         """
         生成SQL查询的中文提示词
         """
-        print("[DEBUG] 正在生成中文SQL提示词...")
-        print(f"[DEBUG] 问题: {question}")
-        print(f"[DEBUG] 相关SQL数量: {len(question_sql_list) if question_sql_list else 0}")
-        print(f"[DEBUG] 相关DDL数量: {len(ddl_list) if ddl_list else 0}")
-        print(f"[DEBUG] 相关文档数量: {len(doc_list) if doc_list else 0}")
+        logger.debug(
+            "正在生成中文SQL提示词，问题: %s，相关SQL %d 条，DDL %d 条，文档 %d 条",
+            question, len(question_sql_list or []), len(ddl_list or []), len(doc_list or []),
+        )
         
         # 获取dialect
         dialect = getattr(self, 'dialect', 'SQL')
         
-        # 创建基础提示词
+        # 提示词按 固定说明 -> DDL和文档 -> 示例 -> 问题 的顺序组织：
+        # 用户问题只出现在最后，不同问题的提示词开头相同，服务商的上下文缓存(前缀缓存)才能命中
         messages = [
             self.system_message(
-                f"""你是一个专业的SQL助手，根据用户的问题生成正确的{dialect}查询语句。
-                你只需生成SQL语句，不需要任何解释或评论。
-                用户问题: {question}
-                """
+                f"你是一个专业的SQL助手，根据用户的问题和下面提供的表结构、文档生成正确的{dialect}查询语句。\n"
+                "要求:\n"
+                "1. 仅输出SQL语句，不要有任何解释或说明\n"
+                f"2. 确保语法正确，符合{dialect}标准\n"
+                "3. 不要使用不存在的表或字段\n"
+                "4. 查询应尽可能高效"
             )
         ]
 
@@ -227,13 +188,9 @@ class QianWenAI_Chat_CN(VannaBase):
             ddl_text = "\n\n".join([f"-- DDL项 {i+1}:\n{ddl}" for i, ddl in enumerate(ddl_list)])
             messages.append(
                 self.user_message(
-                    f"""
-                    以下是可能相关的数据库表结构定义，请基于这些信息生成SQL:
-                    
-                    {ddl_text}
-                    
-                    记住，这些只是参考信息，可能并不包含所有需要的表和字段。
-                    """
+                    "以下是可能相关的数据库表结构定义，请基于这些信息生成SQL:\n\n"
+                    f"{ddl_text}\n\n"
+                    "记住，这些只是参考信息，可能并不包含所有需要的表和字段。"
                 )
             )
 
@@ -242,11 +199,8 @@ class QianWenAI_Chat_CN(VannaBase):
             doc_text = "\n\n".join([f"-- 文档项 {i+1}:\n{doc}" for i, doc in enumerate(doc_list)])
             messages.append(
                 self.user_message(
-                    f"""
-                    以下是可能有用的业务逻辑文档:
-                    
-                    {doc_text}
-                    """
+                    "以下是可能有用的业务逻辑文档:\n\n"
+                    f"{doc_text}"
                 )
             )
 
@@ -259,30 +213,17 @@ class QianWenAI_Chat_CN(VannaBase):
                 
             messages.append(
                 self.user_message(
-                    f"""
-                    以下是与当前问题相似的问题及其对应的SQL查询:
-                    
-                    {qs_text}
-                    
-                    请参考这些样例来生成当前问题的SQL查询。
-                    """
+                    "以下是与当前问题相似的问题及其对应的SQL查询:\n\n"
+                    f"{qs_text}"
+                    "请参考这些样例来生成当前问题的SQL查询。"
                 )
             )
 
-        # 添加最终的用户请求和限制
+        # 最后添加用户问题
         messages.append(
             self.user_message(
-                f"""
-                根据以上信息，为以下问题生成一个{dialect}查询语句:
-                
-                问题: {question}
-                
-                要求:
-                1. 仅输出SQL语句，不要有任何解释或说明
-                2. 确保语法正确，符合{dialect}标准
-                3. 不要使用不存在的表或字段
-                4. 查询应尽可能高效
-                """
+                f"根据以上信息，为以下问题生成一个{dialect}查询语句:\n\n"
+                f"问题: {question}"
             )
         )
 
@@ -296,7 +237,7 @@ class QianWenAI_Chat_CN(VannaBase):
         """
         生成后续问题的中文提示词
         """
-        print("[DEBUG] 正在生成中文后续问题提示词...")
+        logger.debug("正在生成中文后续问题提示词...")
         
         messages = [
             self.system_message(
@@ -334,7 +275,7 @@ class QianWenAI_Chat_CN(VannaBase):
         """
         生成摘要的中文提示词
         """
-        print("[DEBUG] 正在生成中文摘要提示词...")
+        logger.debug("正在生成中文摘要提示词...")
         
         messages = [
             self.system_message(
@@ -361,7 +302,7 @@ class QianWenAI_Chat_CN(VannaBase):
         """
         生成Python可视化代码的中文提示词
         """
-        print("[DEBUG] 正在生成中文Python可视化提示词...")
+        logger.debug("正在生成中文Python可视化提示词...")
         
         instructions = chart_instructions if chart_instructions else "生成一个适合展示数据的图表"
         
@@ -3,6 +3,24 @@ import time
 import numpy as np
 from typing import List, Callable
 
+from common.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class EmbeddingError(Exception):
+    """embedding接口调用失败或返回了无效向量(如零向量)"""
+    pass
+
+
+# 范数低于该值的向量视为零向量，写入向量库会污染相似度检索
+ZERO_NORM_THRESHOLD = 1e-6
+
+
+def is_zero_vector(vector: List[float], threshold: float = ZERO_NORM_THRESHOLD) -> bool:
+    return not vector or float(np.linalg.norm(vector)) < threshold
+
+
 class EmbeddingFunction:
     def __init__(self, model_name: str, api_key: str, base_url: str, embedding_dimension: int):
         self.model_name = model_name
@@ -42,7 +60,7 @@ class EmbeddingFunction:
         Returns:
             List[List[float]]: 嵌入向量列表
         """
-        print(f"调用embed_documents方法，处理{len(texts)}个文档")
+        logger.debug("调用embed_documents方法，处理%d个文档", len(texts))
         return self.__call__(texts)
 
     def embed_query(self, text: str) -> List[float]:
@@ -54,12 +72,12 @@ class EmbeddingFunction:
         Returns:
             List[float]: 嵌入向量
         """
-        print(f"调用embed_query方法，处理查询文本")
+        logger.debug("调用embed_query方法，处理查询文本")
         embeddings = self.__call__([text])
         # 返回第一个嵌入向量（因为只有一个文本）
         if embeddings and len(embeddings) > 0:
             return embeddings[0]
-        return [0.0] * self.embedding_dimension
+        raise EmbeddingError("embedding接口未返回向量")
 
     def __call__(self, input) -> List[List[float]]:
         """
@@ -70,6 +88,9 @@ class EmbeddingFunction:
             
         Returns:
             List[List[float]]: 嵌入向量列表
+            
+        Raises:
+            EmbeddingError: 接口调用失败或返回零向量时抛出，避免零向量被写入向量库
         """
         if not isinstance(input, list):
             input = [input]
@@ -97,14 +118,16 @@ class EmbeddingFunction:
                 
                 if "data" in result and len(result["data"]) > 0:
                     vector = result["data"][0]["embedding"]
-                    embeddings.append(vector)
                 else:
                     raise ValueError(f"API返回无效: {result}")
+
+                if is_zero_vector(vector):
+                    raise ValueError("API返回了零向量")
+                embeddings.append(vector)
                     
             except Exception as e:
-                print(f"获取embedding时出错: {e}")
-                # 使用实例的 embedding_dimension 来创建零向量
-                embeddings.append([0.0] * self.embedding_dimension)
+                logger.error("获取embedding时出错: %s", e)
+                raise EmbeddingError(f"获取embedding失败: {e}") from e
                 
         return embeddings
     
@@ -119,11 +142,11 @@ class EmbeddingFunction:
         Returns:
             List[float]: 嵌入向量
         """
-        print(f"生成嵌入向量，文本长度: {len(text)} 字符")
+        logger.debug("生成嵌入向量，文本长度: %d 字符", len(text))
         
         # 处理空文本
         if not text or len(text.strip()) == 0:
-            print("输入文本为空，返回零向量")
+            logger.warning("输入文本为空，返回零向量")
             # self.embedding_dimension 在初始化时已被强制要求
             # 因此不应该为 None 或需要默认值
             if self.embedding_dimension is None:
@@ -149,7 +172,7 @@ class EmbeddingFunction:
                     url = url.rstrip("/")  # 移除尾部斜杠，避免双斜杠
                     if not url.endswith("/v1/embeddings"):
                         url = f"{url}/embeddings"
-                print(f"请求URL: {url}")
+                logger.debug("请求URL: %s", url)
                 
                 response = requests.post(
                     url, 
@@ -161,14 +184,14 @@ class EmbeddingFunction:
                 # 检查响应状态
                 if response.status_code != 200:
                     error_msg = f"API请求错误: {response.status_code}, {response.text}"
-                    print(error_msg)
+                    logger.warning("%s", error_msg)
                     
                     # 根据错误码判断是否需要重试
                     if response.status_code in (429, 500, 502, 503, 504):
                         retries += 1
                         if retries <= self.max_retries:
                             wait_time = self.retry_interval * (2 ** (retries - 1))  # 指数退避
-                            print(f"等待 {wait_time} 秒后重试 ({retries}/{self.max_retries})")
+                            logger.info("等待 %s 秒后重试 (%d/%d)", wait_time, retries, self.max_retries)
                             time.sleep(wait_time)
                             continue
                     
@@ -184,39 +207,39 @@ class EmbeddingFunction:
                     # 如果是首次调用且未提供维度，则自动设置
                     if self.embedding_dimension is None:
                         self.embedding_dimension = len(vector)
-                        print(f"自动设置embedding维度为: {self.embedding_dimension}")
+                        logger.info("自动设置embedding维度为: %d", self.embedding_dimension)
                     else:
                         # 验证向量维度
                         actual_dim = len(vector)
                         if actual_dim != self.embedding_dimension:
-                            print(f"向量维度不匹配: 期望 {self.embedding_dimension}, 实际 {actual_dim}")
+                            logger.warning("向量维度不匹配: 期望 %s, 实际 %s", self.embedding_dimension, actual_dim)
                     
+                    if is_zero_vector(vector):
+                        raise ValueError("API返回了零向量")
+
                     # 如果需要归一化
                     if self.normalize_embeddings:
                         vector = self._normalize_vector(vector)
                     
-                    print(f"成功生成embedding向量，维度: {len(vector)}")
+                    logger.debug("成功生成embedding向量，维度: %d", len(vector))
                     return vector
                 else:
                     error_msg = f"API返回格式异常: {result}"
-                    print(error_msg)
+                    logger.warning("%s", error_msg)
                     raise ValueError(error_msg)
                 
             except Exception as e:
-                print(f"生成embedding时出错: {str(e)}")
+                logger.warning("生成embedding时出错: %s", e)
                 retries += 1
                 
                 if retries <= self.max_retries:
                     wait_time = self.retry_interval * (2 ** (retries - 1))  # 指数退避
-                    print(f"等待 {wait_time} 秒后重试 ({retries}/{self.max_retries})")
+                    logger.info("等待 %s 秒后重试 (%d/%d)", wait_time, retries, self.max_retries)
                     time.sleep(wait_time)
                 else:
-                    print(f"已达到最大重试次数 ({self.max_retries})，生成embedding失败")
-                    # 决定是返回零向量还是重新抛出异常
-                    if self.embedding_dimension:
-                        print(f"返回零向量 (维度: {self.embedding_dimension})")
-                        return [0.0] * self.embedding_dimension
-                    raise
+                    logger.error("已达到最大重试次数 (%d)，生成embedding失败", self.max_retries)
+                    # 不再返回零向量，零向量写入向量库后会污染所有相似度检索
+                    raise EmbeddingError(f"生成embedding失败: {e}") from e
         
         # 这里不应该到达，但为了完整性添加
         raise RuntimeError("生成embedding失败")
@@ -1,11 +1,22 @@
 # 给dataops 对话助手返回结果
 from vanna.flask import VannaFlaskApp
 from vanna_llm_factory import create_vanna_instance
-from flask import request, jsonify
+from flask import request, jsonify, Response, stream_with_context
 import pandas as pd
+import contextvars
+import json
+import queue
+import threading
 from common import result
+from common.post_query import ASK_POST_QUERY_TASKS, POST_QUERY_TASKS, build_post_query_tasks, run_tasks
+from common.llm_provider import StreamCancelled
+from common.llm_usage import usage_stats
+from common.logger import get_logger
+import app_config
 
 vn = create_vanna_instance()
+post_query_cfg = getattr(app_config, "POST_QUERY_CONFIG", {})
+logger = get_logger(__name__)
 
 # 实例化 VannaFlaskApp
 app = VannaFlaskApp(
@@ -28,24 +39,243 @@ def ask_full():
     if not question:
         return jsonify(result.failed(message="未提供问题", code=400)), 400
 
-    sql, df, fig = vn.ask(
+    vn.reset_sql_guard_state()
+    # 图表代码与摘要、追问一起在下面并行生成
+    sql, df, _ = vn.ask(
         question=question,
         print_results=False,
-        visualize=True,
+        visualize=False,
         allow_llm_to_see_data=True
     )
 
+    guard_error = vn.get_last_sql_guard_error()
+    if df is None and guard_error is not None:
+        # 查询未通过执行前检查，返回原因和执行计划摘要
+        return jsonify(result.failed(
+            message=str(guard_error), code=400,
+            data={"sql": sql, "plan_summary": guard_error.plan_summary},
+        )), 400
+
     rows, columns = [], []
+    post_query = {}
     if isinstance(df, pd.DataFrame) and not df.empty:
         rows = df.head(1000).to_dict(orient="records")
         columns = list(df.columns)
 
+        tasks = build_post_query_tasks(
+            vn, question, sql, df,
+            tasks=req.get("tasks", post_query_cfg.get("ask_tasks", ASK_POST_QUERY_TASKS)),
+            n_followup_questions=post_query_cfg.get("n_followup_questions", 5),
+        )
+        errors = {}
+        for name, value, error in run_tasks(
+            tasks,
+            timeouts=post_query_cfg.get("timeouts", 60),
+            max_workers=post_query_cfg.get("max_workers", 16),
+        ):
+            if error is not None:
+                logger.warning("%s 生成失败: %s", name, error)
+                errors[name] = str(error)
+            else:
+                post_query[name] = value
+        if errors:
+            post_query["errors"] = errors
+
     return jsonify(result.success(data={
         "sql": sql,
+        "sql_path": vn.get_last_sql_path(),
         "rows": rows,
-        "columns": columns
+        "columns": columns,
+        # 非聚合查询被自动加上的LIMIT截断时，结果不是全部数据
+        "limited": vn.get_last_sql_guard_limit() is not None,
+        "limit": vn.get_last_sql_guard_limit(),
+        "summary": post_query.get("summary"),
+        "followup_questions": post_query.get("followup"),
+        "plotly_figure": post_query.get("plotly"),
+        "errors": post_query.get("errors", {}),
     }))
 
 
+# 语义缓存命中率等统计
+@app.flask_app.route('/api/v0/semantic_cache_stats', methods=['GET'])
+def semantic_cache_stats():
+    if getattr(vn, "semantic_cache", None) is None:
+        return jsonify(result.success(data={"enabled": False}))
+    return jsonify(result.success(data={"enabled": True, **vn.semantic_cache.stats()}))
+
+
+# LLM响应缓存命中率统计
+@app.flask_app.route('/api/v0/llm_cache_stats', methods=['GET'])
+def llm_cache_stats():
+    if getattr(vn, "response_cache", None) is None:
+        return jsonify(result.success(data={"enabled": False}))
+    return jsonify(result.success(data={"enabled": True, **vn.response_cache.stats()}))
+
+
+# LLM服务商熔断状态、耗时和对冲请求统计
+@app.flask_app.route('/api/v0/llm_provider_stats', methods=['GET'])
+def llm_provider_stats():
+    if getattr(vn, "provider_pool", None) is None:
+        return jsonify(result.success(data={"enabled": False}))
+    return jsonify(result.success(data={"enabled": True, **vn.provider_pool.stats()}))
+
+
+# SQL执行前检查的配置和拒绝次数
+@app.flask_app.route('/api/v0/sql_guard_stats', methods=['GET'])
+def sql_guard_stats():
+    if getattr(vn, "sql_guard", None) is None:
+        return jsonify(result.success(data={"enabled": False}))
+    data = {"enabled": True, **vn.sql_guard.stats()}
+    if getattr(vn, "plan_feedback", None) is not None:
+        data["plan_feedback"] = vn.plan_feedback.stats()
+    return jsonify(result.success(data=data))
+
+
+# 按服务商和模型统计的token用量和上下文缓存命中的token数
+@app.flask_app.route('/api/v0/llm_usage_stats', methods=['GET'])
+def llm_usage_stats():
+    return jsonify(result.success(data=usage_stats.stats()))
+
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def _stream_llm_call(event, func, *args, **kwargs):
+    """
+    在后台线程中执行LLM调用，把on_token回调收到的文本片段逐个转成SSE事件。
+    一次生成可能调用LLM多次(先生成中间SQL、无效时用备用模型重新生成)，片段带有调用序号call。
+    客户端断开(生成器被关闭)后，下一个片段到达时on_token抛出StreamCancelled，中止LLM调用并关闭服务商的流。
+    调用结束后返回 (结果, 异常)
+    """
+    tokens = queue.Queue()
+    cancel = threading.Event()
+    outcome = {}
+    calls = [0]
+
+    def on_llm_call():
+        calls[0] += 1
+
+    def on_token(token):
+        if cancel.is_set():
+            raise StreamCancelled("客户端已断开，停止生成")
+        tokens.put({"token": token, "call": calls[0]})
+
+    def worker():
+        try:
+            outcome["result"] = func(*args, on_token=on_token, on_llm_call=on_llm_call, **kwargs)
+        except Exception as e:
+            outcome["error"] = e
+        finally:
+            tokens.put(None)
+
+    # 在请求上下文的副本中执行，用量计量能取到当前用户等上下文变量
+    threading.Thread(target=contextvars.copy_context().run, args=(worker,), daemon=True).start()
+    try:
+        while True:
+            token = tokens.get()
+            if token is None:
+                break
+            yield _sse_event(event, token)
+    finally:
+        cancel.set()
+    return outcome.get("result"), outcome.get("error")
+
+
+def _stream_post_query_tasks(question, sql, df, tasks=None):
+    """
+    并行生成摘要、追问和图表，摘要的文本片段和各任务的结果按到达顺序转成SSE事件
+    """
+    events = queue.Queue()
+    cancel = threading.Event()
+
+    def on_summary_token(token):
+        if cancel.is_set():
+            raise StreamCancelled("客户端已断开，停止生成摘要")
+        events.put(("summary_token", {"token": token}))
+
+    post_query_tasks = build_post_query_tasks(
+        vn, question, sql, df,
+        tasks=tasks or post_query_cfg.get("stream_tasks", POST_QUERY_TASKS),
+        n_followup_questions=post_query_cfg.get("n_followup_questions", 5),
+        on_summary_token=on_summary_token,
+    )
+
+    def worker():
+        try:
+            for name, value, error in run_tasks(
+                post_query_tasks,
+                timeouts=post_query_cfg.get("timeouts", 60),
+                max_workers=post_query_cfg.get("max_workers", 16),
+            ):
+                if error is not None:
+                    events.put(("error", {"stage": name, "message": str(error)}))
+                else:
+                    events.put((name, {name: value}))
+        finally:
+            events.put(None)
+
+    threading.Thread(target=contextvars.copy_context().run, args=(worker,), daemon=True).start()
+    try:
+        while True:
+            item = events.get()
+            if item is None:
+                break
+            yield _sse_event(*item)
+    finally:
+        cancel.set()
+
+
+# 流式版本的ask接口(Server-Sent Events)：依次推送SQL片段、查询结果，再并行推送摘要、追问和图表
+# sql_token 事件带有LLM调用序号call：序号变化表示重新生成(中间SQL的结果返回后或换用备用模型)，最终以sql事件为准
+@app.flask_app.route('/api/v0/ask_stream', methods=['POST'])
+def ask_stream():
+    req = request.get_json(force=True)
+    question = req.get("question", None)
+    if not question:
+        return jsonify(result.failed(message="未提供问题", code=400)), 400
+
+    def generate():
+        def generate_sql(**kwargs):
+            # get_last_sql_path 按线程记录，需要在执行generate_sql的后台线程中读取
+            return vn.generate_sql(**kwargs), vn.get_last_sql_path()
+
+        sql_result, error = yield from _stream_llm_call(
+            "sql_token", generate_sql, question=question, allow_llm_to_see_data=True
+        )
+        if error is not None:
+            yield _sse_event("error", {"stage": "sql", "message": str(error)})
+            return
+        sql, sql_path = sql_result
+        yield _sse_event("sql", {"sql": sql, "sql_path": sql_path})
+
+        try:
+            df = vn.run_sql(sql)
+        except Exception as e:
+            yield _sse_event("error", {
+                "stage": "run_sql",
+                "message": str(e),
+                "plan_summary": getattr(e, "plan_summary", None),
+            })
+            return
+
+        rows, columns = [], []
+        if isinstance(df, pd.DataFrame) and not df.empty:
+            rows = df.head(1000).to_dict(orient="records")
+            columns = list(df.columns)
+        yield _sse_event("rows", {"rows": rows, "columns": columns})
+
+        if isinstance(df, pd.DataFrame) and not df.empty:
+            yield from _stream_post_query_tasks(question, sql, df, req.get("tasks"))
+
+        yield _sse_event("done", {})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 print("正在启动Flask应用...")
 app.run(host="0.0.0.0", port=8084, debug=True)
\ No newline at end of file
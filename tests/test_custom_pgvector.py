@@ -0,0 +1,96 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("langchain_postgres")
+
+from common.ddl_compactor import DDLCompactor
+from custompgvector.custom_pgvector import PG_VectorStore
+
+
+def test_table_keys_differ_between_collection_versions():
+    def key(version):
+        return PG_VectorStore._table_key(SimpleNamespace(collection_version=version), "public.orders")
+    assert key(None) == key("default") == "table:public.orders"
+    assert key("v20250101_120000") != key("v20250201_120000")
+    assert key("v20250101_120000") != key("default")
+
+
+class FakeEmbeddings:
+    def embed_query(self, text):
+        # "收入"和"营收"含义相近，向量相同
+        return [1.0, 0.0] if "收入" in text or "营收" in text else [0.0, 1.0]
+
+
+def _generate_embedding():
+    store = SimpleNamespace(embedding_function=FakeEmbeddings())
+    return lambda text: PG_VectorStore.generate_embedding(store, text)
+
+
+def test_generate_embedding_uses_embedding_function():
+    assert _generate_embedding()("本月收入") == [1.0, 0.0]
+
+
+def test_ddl_compaction_matches_columns_by_store_embedding():
+    generate_embedding = _generate_embedding()
+    lines = ["CREATE TABLE sales (", "  id BIGINT PRIMARY KEY,"]
+    lines += [f"  col_{i} TEXT, -- 字段{i}" for i in range(5)]
+    lines += ["  amt NUMERIC -- 营收", ");"]
+    compactor = DDLCompactor(max_columns=1, embedding_function=generate_embedding)
+    question = "上月收入多少"
+    compacted = compactor.compact("\n".join(lines), question, generate_embedding(question))
+    assert "amt NUMERIC" in compacted
+    assert "col_0" not in compacted
+
+
+class FakeEngine:
+    def __init__(self):
+        self.queries = 0
+
+    def connect(self):
+        engine = self
+
+        class Connection:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, query, params):
+                engine.queries += 1
+                return SimpleNamespace(fetchone=lambda: (engine.queries, 100 + engine.queries))
+
+        return Connection()
+
+
+def _stamp_store(ttl=60):
+    return SimpleNamespace(
+        refresh_collection_version=lambda: "default",
+        engine=FakeEngine(),
+        _current_collection_names=lambda: ["sql", "ddl", "documentation"],
+        training_data_stamp_ttl=ttl,
+        _stamp=None,
+        _stamp_checked_at=0.0,
+        _stamp_generation=0,
+        _stamp_lock=threading.Lock(),
+    )
+
+
+def test_training_data_stamp_is_cached_until_local_write():
+    store = _stamp_store()
+    first = PG_VectorStore.training_data_stamp(store)
+    assert PG_VectorStore.training_data_stamp(store) == first
+    assert store.engine.queries == 1
+
+    PG_VectorStore._invalidate_training_data_stamp(store)
+    assert PG_VectorStore.training_data_stamp(store) != first
+    assert store.engine.queries == 2
+
+
+def test_training_data_stamp_expires_after_ttl():
+    store = _stamp_store(ttl=0)
+    PG_VectorStore.training_data_stamp(store)
+    PG_VectorStore.training_data_stamp(store)
+    assert store.engine.queries == 2
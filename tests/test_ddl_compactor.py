@@ -0,0 +1,74 @@
+from common.ddl_compactor import DDLCompactor, parse_create_table, parse_ddl, text_terms
+
+
+def _wide_table(columns=40):
+    lines = ["CREATE TABLE orders (", "  id BIGINT PRIMARY KEY, -- 订单ID"]
+    lines += [f"  col_{i} TEXT, -- 字段{i}" for i in range(columns)]
+    lines += [
+        "  amount NUMERIC(12,",
+        "    2) NOT NULL CHECK (",
+        "      amount >= 0",
+        "    ), -- 订单金额",
+        "  customer_id BIGINT,",
+        "  FOREIGN KEY (customer_id) REFERENCES customers (id)",
+        ") PARTITION BY RANGE (id);",
+    ]
+    return "\n".join(lines)
+
+
+def test_multiline_column_definition():
+    table = parse_create_table(_wide_table(2))
+    columns = {column.name: column for column in table.columns}
+    assert columns["amount"].definition == "amount NUMERIC(12, 2) NOT NULL CHECK ( amount >= 0 )"
+    assert columns["amount"].comment == "订单金额"
+    assert columns["col_1"].comment == "字段1"
+    assert columns["id"].is_key and columns["customer_id"].is_key
+    assert table.constraints == ["FOREIGN KEY (customer_id) REFERENCES customers (id)"]
+    assert table.suffix == "PARTITION BY RANGE (id)"
+
+
+def test_comment_on_line_before_column_belongs_to_next_column():
+    table = parse_create_table("CREATE TABLE t (\n  a INT,\n  -- 客户名称\n  name TEXT\n);")
+    assert [(column.name, column.comment) for column in table.columns] == [("a", ""), ("name", "客户名称")]
+
+
+def test_comment_on_statements():
+    statements = parse_ddl(
+        "CREATE TABLE public.t (a INT, b TEXT);\n"
+        "COMMENT ON TABLE public.t IS '测试表';\n"
+        "COMMENT ON COLUMN public.t.b IS '名称; 含分号';"
+    )
+    table = statements[0].table
+    assert table.comment == "测试表"
+    assert table.columns[1].comment == "名称; 含分号"
+    assert statements[2].comment_of is table
+
+
+def test_narrow_item_is_unchanged():
+    ddl = "create table t (\n  a int,  -- x\n  b text\n);\ncreate index t_a on t (a);"
+    assert DDLCompactor(max_columns=30).compact(ddl, "问题") == ddl
+
+
+def test_wide_table_keeps_keys_and_relevant_columns():
+    ddl = _wide_table() + "\nCREATE INDEX orders_amount ON orders (amount);\n" \
+        "COMMENT ON COLUMN orders.col_3 IS '客户等级';\n这张表按月分区。"
+    compacted = DDLCompactor(max_columns=5).compact(ddl, "各客户等级的订单金额")
+    assert "id BIGINT PRIMARY KEY" in compacted
+    assert "customer_id BIGINT" in compacted
+    assert "amount NUMERIC(12, 2)" in compacted
+    assert "col_3 TEXT, -- 客户等级" in compacted
+    assert "col_20" not in compacted
+    assert ") PARTITION BY RANGE (id);" in compacted
+    # 宽表以外的语句原样保留，已合并的 COMMENT ON 不再重复
+    assert "CREATE INDEX orders_amount ON orders (amount);" in compacted
+    assert "这张表按月分区。" in compacted
+    assert "COMMENT ON" not in compacted
+
+
+def test_unparsed_ddl_is_unchanged():
+    ddl = "CREATE VIEW v AS SELECT 1;"
+    assert DDLCompactor(max_columns=1).compact(ddl, "问题") == ddl
+
+
+def test_text_terms():
+    assert text_terms("order_amount 订单金额") == {"order", "amount", "订单", "单金", "金额"}
@@ -0,0 +1,18 @@
+import asyncio
+
+from common import llm_client
+
+
+def test_async_clients_are_closed_with_their_loop():
+    http_clients = []
+
+    async def main():
+        client = llm_client.get_async_openai_client("key", "http://127.0.0.1:9/v1", client_config={})
+        assert client is llm_client.get_async_openai_client("key", "http://127.0.0.1:9/v1", client_config={})
+        http_clients.append(client._client)
+
+    for _ in range(2):
+        asyncio.run(main())
+    assert http_clients[0] is not http_clients[1]
+    assert all(http_client.is_closed for http_client in http_clients)
+    assert len(llm_client._async_clients) == 0
@@ -0,0 +1,161 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from common.llm_provider import CircuitBreaker, CircuitOpenError, ProviderPool, StreamCancelled
+
+
+def _fail(message="boom"):
+    def call():
+        raise RuntimeError(message)
+    return call
+
+
+def _pool(**kwargs):
+    return ProviderPool("qwen", "deepseek", secondary_chat=object(), **kwargs)
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=60)
+    breaker.record_failure()
+    assert breaker.acquire()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.acquire()
+
+
+def test_half_open_allows_single_probe():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == "half_open"
+    assert breaker.acquire()
+    assert not breaker.acquire()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.acquire() and breaker.acquire()
+
+
+def test_failed_probe_reopens_breaker():
+    breaker = CircuitBreaker(failure_threshold=5, recovery_timeout=60)
+    breaker.opened_at = time.monotonic() - 120
+    assert breaker.acquire()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_released_probe_can_be_retried():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0)
+    breaker.record_failure()
+    assert breaker.acquire()
+    breaker.release()
+    assert breaker.acquire()
+
+
+def test_failover_to_next_provider():
+    pool = _pool(hedge=False)
+    result = pool.call("sql", [("a", _fail()), ("b", lambda: "from b")])
+    assert result == "from b"
+    assert pool.breaker("a").failures == 1
+    assert pool.breaker("b").failures == 0
+
+
+def test_no_failover_after_tokens_emitted():
+    pool = _pool(hedge=False)
+    called = []
+    with pytest.raises(RuntimeError):
+        pool.call("sql", [("a", _fail()), ("b", lambda: called.append("b"))], can_failover=lambda: False)
+    assert called == []
+
+
+def test_stream_cancelled_is_not_a_failure():
+    pool = _pool(hedge=False)
+
+    def cancelled():
+        raise StreamCancelled()
+    with pytest.raises(StreamCancelled):
+        pool.call("sql", [("a", cancelled), ("b", lambda: "from b")])
+    assert pool.breaker("a").failures == 0
+
+
+def test_all_open_raises_circuit_open():
+    pool = _pool(failure_threshold=1, recovery_timeout=60)
+    pool.breaker("a").record_failure()
+    pool.breaker("b").record_failure()
+    with pytest.raises(CircuitOpenError):
+        pool.call("sql", [("a", lambda: "a"), ("b", lambda: "b")])
+
+
+def test_stats_keyed_on_called_provider():
+    pool = _pool(hedge=False)
+    pool.call("sql", [("api.deepseek.com", lambda: "ok")])
+    stats = pool.stats()
+    assert list(stats["breakers"]) == ["api.deepseek.com"]
+    assert "api.deepseek.com/sql" in stats["latency"]
+
+
+def test_hedge_when_primary_is_slow():
+    pool = _pool(default_hedge_delay=0.05, min_hedge_delay=0)
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return "from a"
+    try:
+        result = pool.call("sql", [("a", slow), ("b", lambda: "from b")])
+    finally:
+        release.set()
+    assert result == "from b"
+    assert pool.stats()["hedged_requests"] == 1
+    assert pool.stats()["hedge_wins"] == 1
+
+
+def test_no_hedge_when_disallowed():
+    pool = _pool(default_hedge_delay=0.01, min_hedge_delay=0)
+
+    def slow():
+        time.sleep(0.1)
+        return "from a"
+    assert pool.call("sql", [("a", slow), ("b", lambda: "from b")], allow_hedge=False) == "from a"
+    assert pool.stats()["hedged_requests"] == 0
+
+
+def test_acall_failover_and_no_failover_after_tokens():
+    pool = _pool()
+
+    async def fail():
+        raise RuntimeError("boom")
+
+    async def ok():
+        return "from b"
+    assert asyncio.run(pool.acall("sql", [("a", fail), ("b", ok)])) == "from b"
+    with pytest.raises(RuntimeError):
+        asyncio.run(pool.acall("sql", [("a", fail), ("b", ok)], can_failover=lambda: False))
+
+
+def test_cancelled_probe_releases_breaker():
+    pool = _pool(failure_threshold=1, recovery_timeout=0)
+    pool.breaker("a").record_failure()
+    started = None
+
+    async def hang():
+        started.set()
+        await asyncio.sleep(60)
+
+    async def ok():
+        return "from a"
+
+    async def main():
+        nonlocal started
+        started = asyncio.Event()
+        task = asyncio.create_task(pool.acall("sql", [("a", hang)]))
+        await started.wait()
+        assert pool.breaker("a").probing
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert not pool.breaker("a").probing
+        return await pool.acall("sql", [("a", ok)])
+    assert asyncio.run(main()) == "from a"
@@ -0,0 +1,101 @@
+import asyncio
+from types import SimpleNamespace
+
+from common import openai_chat
+from common.llm_provider import ChatClient
+from common.llm_usage import usage_meter
+
+
+def _chunk(content=None, usage=None):
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=content))] if content is not None else []
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def __aiter__(self):
+        return self._aiter()
+
+    async def _aiter(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class AsyncFakeStream(FakeStream):
+    async def close(self):
+        self.closed = True
+
+
+class FakeCompletions:
+    def __init__(self, stream):
+        self.stream = stream
+        self.params = []
+
+    def create(self, **params):
+        self.params.append(params)
+        if params.get("stream"):
+            return self.stream
+        message = SimpleNamespace(content="select 1")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+class AsyncFakeCompletions(FakeCompletions):
+    async def create(self, **params):
+        return FakeCompletions.create(self, **params)
+
+
+def _client(completions):
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions), base_url=SimpleNamespace(host="fake-llm"))
+
+
+SQL_CHUNKS = [_chunk("```sql\nselect 1\n"), _chunk("```"), _chunk("\n解释"), _chunk(usage=SimpleNamespace(prompt_tokens=3, completion_tokens=2))]
+
+
+def test_submit_without_streaming_returns_message_content():
+    completions = FakeCompletions(None)
+    chat = ChatClient(_client(completions), "qwen-plus")
+    assert chat.submit_prompt([{"role": "user", "content": "q"}], stop=[";"]) == "select 1"
+    assert completions.params[0]["model"] == "qwen-plus"
+    assert completions.params[0]["stop"] == [";"]
+    assert "stream" not in completions.params[0]
+
+
+def test_sql_early_stop_closes_the_stream():
+    stream = FakeStream(SQL_CHUNKS)
+    completions = FakeCompletions(stream)
+    chat = ChatClient(_client(completions), "qwen-plus")
+    tokens = []
+    response = chat.submit_prompt([{"role": "user", "content": "q"}], sql_early_stop=True, on_token=tokens.append)
+    assert response == "```sql\nselect 1\n```"
+    assert tokens == ["```sql\nselect 1\n", "```"]
+    assert stream.closed
+    assert completions.params[0]["stream_options"] == {"include_usage": True}
+
+
+def test_streamed_usage_is_metered():
+    chat = ChatClient(_client(FakeCompletions(FakeStream(SQL_CHUNKS))), "metered-model")
+    assert chat.submit_prompt([{"role": "user", "content": "q"}], on_token=lambda token: None).endswith("解释")
+    totals = usage_meter.totals[(None, None, "fake-llm", "metered-model")]
+    assert totals["requests"] == 1
+    assert totals["prompt_tokens"] == 3
+    assert totals["streamed"] == 1
+
+
+def test_async_submit_streams_through_async_client(monkeypatch):
+    stream = AsyncFakeStream(SQL_CHUNKS)
+    async_client = _client(AsyncFakeCompletions(stream))
+    monkeypatch.setattr(openai_chat, "async_client_for", lambda client: async_client)
+    chat = ChatClient(_client(FakeCompletions(None)), "qwen-plus")
+    response = asyncio.run(chat.asubmit_prompt([{"role": "user", "content": "q"}], sql_early_stop=True))
+    assert response == "```sql\nselect 1\n```"
+    assert stream.closed
+    assert asyncio.run(chat.asubmit_prompt([{"role": "user", "content": "q"}])) == "select 1"
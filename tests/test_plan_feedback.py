@@ -0,0 +1,64 @@
+from common.plan_feedback import PlanFeedback, added_filters
+
+
+class FakeGuard:
+    def __init__(self, costs, columns):
+        self.costs = costs
+        self.columns = columns
+
+    def plan_summary(self, sql):
+        return {"total_cost": self.costs[sql], "plan_rows": 10, "top_node": "Seq Scan",
+                "node_types": {"Seq Scan": 1}, "seq_scans": [], "max_append_children": 0}
+
+    def get_indexes(self, relations):
+        return []
+
+    def result_columns(self, sql):
+        return self.columns[sql]
+
+
+ORIGINAL = "SELECT region, SUM(amount) AS total FROM orders WHERE status = 'paid' GROUP BY region"
+
+
+def test_added_filters():
+    assert added_filters(ORIGINAL, ORIGINAL.replace("orders", "public.orders")) == set()
+    assert added_filters(ORIGINAL, ORIGINAL + " LIMIT 100") == {"LIMIT", "100"}
+    assert added_filters(
+        ORIGINAL, ORIGINAL.replace("WHERE", "WHERE created_at >= '2024-01-01' AND")
+    ) == {"'2024-01-01'"}
+    assert added_filters(ORIGINAL, ORIGINAL.replace("WHERE", "WHERE region IS NOT NULL AND")) == {"NOT NULL"}
+
+
+def _improve(candidate, candidate_cost=10, candidate_columns=None):
+    columns = [("region", 25), ("total", 1700)]
+    guard = FakeGuard(
+        {ORIGINAL: 1e7, candidate: candidate_cost},
+        {ORIGINAL: columns, candidate: candidate_columns or columns},
+    )
+    feedback = PlanFeedback(guard, cost_threshold=1e6)
+    return feedback.improve("各地区已支付订单金额", ORIGINAL, lambda prompt: candidate), feedback
+
+
+def test_accepts_cheaper_equivalent_rewrite():
+    candidate = ORIGINAL.replace("FROM orders", "FROM orders o")
+    sql, feedback = _improve(candidate)
+    assert sql == candidate
+    assert feedback.stats()["accepted"] == 1
+
+
+def test_rejects_rewrite_with_new_filter():
+    sql, feedback = _improve(ORIGINAL.replace("WHERE", "WHERE created_at >= '2024-01-01' AND"))
+    assert sql == ORIGINAL
+    assert feedback.stats()["rejected_filters"] == 1
+
+
+def test_rejects_rewrite_with_different_column_types():
+    candidate = ORIGINAL.replace("FROM orders", "FROM orders o")
+    sql, _ = _improve(candidate, candidate_columns=[("region", 25), ("total", 701)])
+    assert sql == ORIGINAL
+
+
+def test_rejects_more_expensive_rewrite():
+    candidate = ORIGINAL.replace("FROM orders", "FROM orders o")
+    sql, _ = _improve(candidate, candidate_cost=2e7)
+    assert sql == ORIGINAL
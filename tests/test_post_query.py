@@ -0,0 +1,36 @@
+import threading
+import time
+
+from common.post_query import ASK_POST_QUERY_TASKS, build_post_query_tasks, run_tasks
+
+
+def test_ask_builds_only_plotly_by_default():
+    assert list(build_post_query_tasks(None, "q", "select 1", None, tasks=ASK_POST_QUERY_TASKS)) == ["plotly"]
+
+
+def test_results_in_completion_order_and_errors():
+    def fail():
+        raise ValueError("bad")
+
+    def slow():
+        time.sleep(0.05)
+        return "slow"
+    results = list(run_tasks({"slow": slow, "fast": lambda: "fast", "fail": fail}, timeouts=5))
+    names = [name for name, _, _ in results]
+    assert names[-1] == "slow"
+    assert ("fast", "fast", None) in results
+    assert isinstance(dict((name, error) for name, _, error in results)["fail"], ValueError)
+
+
+def test_timed_out_task_keeps_running():
+    release = threading.Event()
+    finished = threading.Event()
+
+    def stuck():
+        release.wait(5)
+        finished.set()
+    results = list(run_tasks({"stuck": stuck}, timeouts={"stuck": 0.05}))
+    assert isinstance(results[0][2], TimeoutError)
+    assert not finished.is_set()
+    release.set()
+    assert finished.wait(5)
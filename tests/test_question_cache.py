@@ -0,0 +1,30 @@
+from common.question_cache import QuestionCache, normalize_sql, question_cache_version, sql_fingerprint
+
+
+def test_normalize_collapses_whitespace_and_comments():
+    sql = "select a,\n    b  -- 注释\nfrom t\twhere x = 1 ;"
+    assert normalize_sql(sql) == "SELECT a, b FROM t WHERE x = 1"
+    assert sql_fingerprint(sql) == sql_fingerprint("SELECT a, b FROM t WHERE x = 1")
+
+
+def test_whitespace_inside_literals_is_kept():
+    assert normalize_sql("SELECT * FROM t WHERE name = 'a  b'") == "SELECT * FROM t WHERE name = 'a  b'"
+    assert sql_fingerprint("SELECT * FROM t WHERE name = 'a  b'") != sql_fingerprint(
+        "SELECT * FROM t WHERE name = 'a b'"
+    )
+    assert normalize_sql('SELECT "my  col" FROM t') == 'SELECT "my  col" FROM t'
+
+
+def test_version_includes_prompts():
+    assert question_cache_version(None, "1") == "default:1"
+    batch = question_cache_version("qwen", "1", ("批量", "单条"))
+    assert batch.startswith("qwen:1-")
+    assert batch != question_cache_version("qwen", "1", ("批量", "单条提示词修改"))
+
+
+def test_cache_round_trip(tmp_path):
+    cache = QuestionCache(str(tmp_path / "cache.db"), "v1")
+    cache.set_many([("select 1", "问题一?"), ("select 2", "")])
+    assert cache.get_many(["SELECT 1;", "select 2", "select 3"]) == {0: "问题一?"}
+    assert QuestionCache(str(tmp_path / "cache.db"), "v2").get("select 1") is None
+    assert cache.stats()["hits"] == 1
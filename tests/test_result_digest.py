@@ -0,0 +1,37 @@
+from decimal import Decimal
+
+import pandas as pd
+
+from common.result_digest import ResultDigester, coerce_decimal_columns
+
+
+def _orders(rows=300):
+    return pd.DataFrame({
+        "region": [["华东", "华北", "华南"][i % 3] for i in range(rows)],
+        "amount": [Decimal(i) / 10 for i in range(rows)],
+        "note": [None if i % 2 else Decimal("1.5") for i in range(rows)],
+    })
+
+
+def test_decimal_columns_become_numeric():
+    df = coerce_decimal_columns(_orders())
+    assert pd.api.types.is_numeric_dtype(df["amount"])
+    assert pd.api.types.is_numeric_dtype(df["note"])
+    assert not pd.api.types.is_numeric_dtype(df["region"])
+    assert not pd.api.types.is_numeric_dtype(coerce_decimal_columns(pd.DataFrame({"a": ["x", Decimal(1)]}))["a"])
+
+
+def test_digest_includes_decimal_stats():
+    digester = ResultDigester(max_rows=100)
+    df = _orders()
+    assert digester.needs_digest(df)
+    text = digester.digest(df)
+    assert "数值列统计" in text
+    assert "amount_sum" in text
+    assert "amount:" not in text.split("其他列高频值")[-1].split("按")[0]
+
+
+def test_digest_is_cached_by_content():
+    digester = ResultDigester(max_rows=100)
+    assert digester.digest(_orders()) is digester.digest(_orders())
+    assert len(digester.cache) == 1
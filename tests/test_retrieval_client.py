@@ -0,0 +1,127 @@
+import asyncio
+import json
+
+import pytest
+
+# custompgvector 包导入时会加载 PG_VectorStore 的依赖
+pytest.importorskip("langchain_core")
+
+from custompgvector.retrieval_client import PG_VectorStoreClient
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return json.dumps({"success": True, "data": self.data}).encode("utf-8")
+
+
+class FakeConnection:
+    def __init__(self, server, fail):
+        self.server = server
+        self.fail = fail
+
+    def request(self, method, path, body=None, headers=None):
+        self.server.requests.append((method, path))
+        if self.fail:
+            raise ConnectionResetError("keep-alive closed")
+
+    def getresponse(self):
+        if self.server.requests[-1][1] == "/retrieve":
+            sql = [[{"question": "q", "sql": f"select {len(self.server.requests)}"}, 0.1]]
+            return FakeResponse({"sql": sql, "ddl": [], "documentation": []})
+        return FakeResponse({"id": "1-sql"})
+
+    def close(self):
+        pass
+
+
+class FakeServer:
+    def __init__(self, failures):
+        self.failures = failures
+        self.requests = []
+
+    def connect(self):
+        fail = self.failures > 0
+        self.failures -= 1
+        return FakeConnection(self, fail)
+
+
+class ChatlessClient(PG_VectorStoreClient):
+    """PG_VectorStoreClient 通常与LLM类组合使用，这里补上抽象方法"""
+
+    def system_message(self, message):
+        return message
+
+    def user_message(self, message):
+        return message
+
+    def assistant_message(self, message):
+        return message
+
+    def submit_prompt(self, prompt, **kwargs):
+        return ""
+
+
+def _client(failures=0):
+    client = ChatlessClient(config={"retrieval_service_url": "http://127.0.0.1:8091"})
+    server = FakeServer(failures)
+    client._get_connection = lambda: getattr(client._local, "connection", None) or server.connect()
+    return client, server
+
+
+def test_reads_are_retried_once():
+    client, server = _client(failures=1)
+    assert client.get_similar_question_sql("q") == [{"question": "q", "sql": "select 2"}]
+    assert server.requests == [("POST", "/retrieve"), ("POST", "/retrieve")]
+
+
+def test_writes_are_not_retried():
+    client, server = _client(failures=1)
+    with pytest.raises(ConnectionResetError):
+        client.add_question_sql("q", "select 1")
+    assert server.requests == [("POST", "/add")]
+
+
+def test_retrieval_memo_is_keyed_on_question_and_kwargs():
+    client, server = _client()
+    with client.retrieval_scope():
+        first = client.get_similar_question_sql("q", allow_llm_to_see_data=False)
+        client.get_related_ddl("q", allow_llm_to_see_data=False)
+        assert client.get_similar_question_sql_with_distances("q", allow_llm_to_see_data=False) == [(first[0], 0.1)]
+        assert len(server.requests) == 1
+        assert client.get_similar_question_sql("q", allow_llm_to_see_data=True) != first
+        client.get_similar_question_sql("other", allow_llm_to_see_data=True)
+        assert len(server.requests) == 3
+
+
+def test_retrieval_memo_does_not_outlive_scope():
+    client, server = _client()
+    with client.retrieval_scope():
+        first = client.get_similar_question_sql("q")
+    # 下一次请求(例如训练数据已被其他进程修改)重新检索
+    assert client.get_similar_question_sql("q") != first
+    assert client.get_similar_question_sql("q") != first
+    assert len(server.requests) == 3
+
+
+def test_writes_clear_retrieval_memo():
+    client, server = _client()
+    with client.retrieval_scope():
+        first = client.get_similar_question_sql("q")
+        client.add_question_sql("q", "select 1")
+        assert client.get_similar_question_sql("q") != first
+    assert [path for _, path in server.requests] == ["/retrieve", "/add", "/retrieve"]
+
+
+def test_retrieval_memo_is_shared_with_worker_threads():
+    client, server = _client()
+
+    async def generate():
+        with client.retrieval_scope():
+            await asyncio.to_thread(client.get_similar_question_sql, "q")
+            await asyncio.to_thread(client.get_related_ddl, "q")
+
+    asyncio.run(generate())
+    assert len(server.requests) == 1
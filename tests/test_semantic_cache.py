@@ -0,0 +1,47 @@
+from common.semantic_cache import SemanticCache, value_tokens
+
+
+def test_value_tokens():
+    assert value_tokens("2024年3月各地区的销售额") == ["2024", "3"]
+    assert value_tokens("去年销售额最高的前十个客户") == ["去年", "十"]
+    assert value_tokens("上个月的订单数") == ["上个月"]
+    assert value_tokens("各地区的销售额") == []
+
+
+def test_hit_requires_same_values():
+    cache = SemanticCache(similarity_threshold=0.9)
+    cache.add([1.0, 0.0], "2024年各地区的销售额", "select 2024")
+    assert cache.lookup([1.0, 0.01], question="2024年各区域的销售额")["sql"] == "select 2024"
+    assert cache.lookup([1.0, 0.01], question="2023年各地区的销售额") is None
+
+
+def test_falls_back_to_next_similar_entry_with_same_values():
+    cache = SemanticCache(similarity_threshold=0.9)
+    cache.add([1.0, 0.0], "2024年各地区的销售额", "select 2024")
+    cache.add([1.0, 0.1], "2023年各地区的销售额", "select 2023")
+    assert cache.lookup([1.0, 0.0], question="2023年各地区的销售额")["sql"] == "select 2023"
+
+
+def test_scope_change_clears_cache():
+    cache = SemanticCache(similarity_threshold=0.9)
+    cache.add([1.0, 0.0], "q", "select 1", scope=("default", 10, 100))
+    assert cache.lookup([1.0, 0.0], scope=("default", 10, 100), question="q") is not None
+    assert cache.lookup([1.0, 0.0], scope=("default", 11, 101), question="q") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_rebase_keeps_entries_only_from_expected_scope():
+    cache = SemanticCache(similarity_threshold=0.9)
+    cache.add([1.0, 0.0], "q", "select 1", scope=1)
+    cache.rebase(1, 2)
+    assert cache.lookup([1.0, 0.0], scope=2, question="q") is not None
+    cache.rebase(1, 3)
+    assert cache.lookup([1.0, 0.0], scope=3, question="q") is None
+
+
+def test_add_after_invalidation_is_skipped():
+    cache = SemanticCache(similarity_threshold=0.9)
+    generation = cache.generation
+    cache.invalidate()
+    cache.add([1.0, 0.0], "q", "select 1", generation=generation)
+    assert cache.stats()["size"] == 0
@@ -0,0 +1,146 @@
+import threading
+
+import pytest
+import sqlparse
+
+from common.sql_guard import SQLGuard, SQLGuardError, apply_limit, is_aggregate_query, summarize_plan
+
+
+def _is_aggregate(sql):
+    return is_aggregate_query(sqlparse.parse(sql)[0])
+
+
+def test_apply_limit_to_plain_select():
+    assert apply_limit("SELECT * FROM t -- 全部\n;", 100) == "SELECT * FROM t\nLIMIT 100"
+
+
+def test_apply_limit_keeps_existing_limit_and_aggregates():
+    for sql in (
+        "SELECT * FROM t LIMIT 10",
+        "SELECT count(*) FROM t",
+        "SELECT a, sum(b) FROM t GROUP BY a",
+    ):
+        assert apply_limit(sql, 100) == sql
+    assert apply_limit("SELECT * FROM t", 0) == "SELECT * FROM t"
+
+
+def test_limit_in_subquery_is_not_top_level():
+    sql = "SELECT * FROM (SELECT * FROM t LIMIT 5) s JOIN u ON s.id = u.id"
+    assert apply_limit(sql, 100).endswith("LIMIT 100")
+
+
+def test_window_functions_are_not_aggregates():
+    assert not _is_aggregate("SELECT id, count(*) OVER (PARTITION BY a) AS c FROM t")
+    assert not _is_aggregate("SELECT id, sum(x) OVER (ORDER BY id) FROM t")
+    assert _is_aggregate("SELECT count(*) FROM t")
+    assert apply_limit("SELECT id, rank() OVER (ORDER BY x), max(x) OVER () FROM t", 50).endswith("LIMIT 50")
+
+
+def test_rejects_non_select_and_multiple_statements():
+    with pytest.raises(SQLGuardError):
+        apply_limit("DELETE FROM t", 100)
+    with pytest.raises(SQLGuardError):
+        apply_limit("SELECT 1; SELECT 2", 100)
+
+
+def test_summarize_plan():
+    plan = {"Plan": {
+        "Node Type": "Aggregate", "Total Cost": 1200.5, "Plan Rows": 1,
+        "Plans": [{
+            "Node Type": "Append", "Total Cost": 1000, "Plan Rows": 5000,
+            "Plans": [
+                {"Node Type": "Seq Scan", "Relation Name": "orders_2023", "Schema": "public", "Plan Rows": 2000},
+                {"Node Type": "Seq Scan", "Relation Name": "orders_2024", "Schema": "public", "Plan Rows": 3000},
+                {"Node Type": "Index Scan", "Relation Name": "orders_2025", "Plan Rows": 10},
+            ],
+        }],
+    }}
+    summary = summarize_plan(plan)
+    assert summary["top_node"] == "Aggregate"
+    assert summary["total_cost"] == 1200.5
+    assert summary["node_types"] == {"Aggregate": 1, "Append": 1, "Seq Scan": 2, "Index Scan": 1}
+    assert [scan["relation"] for scan in summary["seq_scans"]] == ["orders_2024", "orders_2023"]
+    assert summary["max_append_children"] == 3
+
+
+class FakeCursor:
+    description = [("id", 23)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchall(self):
+        return [(1,)]
+
+
+class FakeConnection:
+    closed = 0
+
+    def cursor(self):
+        return FakeCursor()
+
+    def rollback(self):
+        pass
+
+
+class FakePool:
+    """与ThreadedConnectionPool一样，连接用完时抛出异常"""
+
+    def __init__(self, size):
+        self.available = size
+
+    def getconn(self):
+        if self.available == 0:
+            raise AssertionError("pool exhausted")
+        self.available -= 1
+        return FakeConnection()
+
+    def putconn(self, connection, close=False):
+        self.available += 1
+
+
+def test_callers_wait_for_a_free_connection():
+    guard = SQLGuard({}, pool_size=1, pool_timeout=5)
+    guard._pool = FakePool(1)
+    guard._pool_slots.acquire()
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(guard._execute("SELECT 1")))
+    waiter.start()
+    waiter.join(0.1)
+    assert waiter.is_alive()
+
+    guard._pool_slots.release()
+    waiter.join(5)
+    assert results == [([(1,)], [("id", 23)])]
+    assert guard._pool.available == 1
+
+
+def test_pool_timeout_raises_guard_error():
+    guard = SQLGuard({}, pool_size=1, pool_timeout=0.05)
+    guard._pool = FakePool(1)
+    guard._pool_slots.acquire()
+    with pytest.raises(SQLGuardError):
+        guard._execute("SELECT 1")
+
+
+def test_plan_summary_has_no_side_effects_and_is_reused_by_check():
+    guard = SQLGuard({}, max_total_cost=100)
+    explained = []
+
+    def explain(sql):
+        explained.append(sql)
+        return {"Plan": {"Node Type": "Seq Scan", "Relation Name": "t", "Total Cost": 500, "Plan Rows": 10}}
+    guard.explain = explain
+
+    assert guard.plan_summary("SELECT * FROM t")["total_cost"] == 500
+    assert guard.stats()["limited"] == 0 and guard.stats()["rejected"] == 0
+    with pytest.raises(SQLGuardError):
+        guard.check("SELECT * FROM t")
+    assert explained == ["SELECT * FROM t\nLIMIT 1000"]
+    assert guard.stats()["limited"] == 1 and guard.stats()["rejected"] == 1
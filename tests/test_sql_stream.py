@@ -0,0 +1,29 @@
+from common.sql_stream import SqlStreamDetector, finalize_sql_response, is_complete_sql_response
+
+
+def test_complete_fenced_sql():
+    assert is_complete_sql_response("```sql\nSELECT 1;\n```")
+    assert not is_complete_sql_response("```sql\nSELECT 1;\n")
+
+
+def test_complete_bare_statement():
+    assert is_complete_sql_response("SELECT a FROM t WHERE b = ';';")
+    assert not is_complete_sql_response("SELECT a FROM t WHERE b = ';'")
+    assert not is_complete_sql_response("SELECT count(*) FROM (SELECT 1; ")
+    assert not is_complete_sql_response("下面是查询;")
+
+
+def test_detector_stops_after_fence():
+    detector = SqlStreamDetector()
+    tokens = ["```sql\n", "SELECT *", " FROM t", ";\n", "```", "\n解释"]
+    fed = []
+    for token in tokens:
+        fed.append(token)
+        if detector.feed(token):
+            break
+    assert "".join(fed) == "```sql\nSELECT * FROM t;\n```"
+
+
+def test_finalize_restores_stop_sequence():
+    assert finalize_sql_response("```sql\nSELECT 1") == "```sql\nSELECT 1;\n```"
+    assert finalize_sql_response("```sql\nSELECT 1;\n```") == "```sql\nSELECT 1;\n```"
@@ -0,0 +1,111 @@
+import pytest
+
+from common import token_counter
+from common.token_counter import (
+    INTERMEDIATE_SQL_DOC_PREFIX,
+    MESSAGE_OVERHEAD_TOKENS,
+    count_message_tokens,
+    count_tokens,
+    estimate_tokens,
+    fit_prompt_items,
+    get_tokenizer,
+    load_tokenizer,
+)
+
+
+@pytest.fixture(autouse=True)
+def estimated_counts(monkeypatch):
+    # 默认按估算计数；需要分词器的测试自己加载
+    monkeypatch.setattr(token_counter, "_tokenizer", None)
+    monkeypatch.setattr(token_counter, "_tokenizer_loaded", True)
+
+
+@pytest.fixture
+def word_tokenizer(tmp_path):
+    tokenizers = pytest.importorskip("tokenizers")
+    vocab = {"[UNK]": 0, "客户": 1, "余额": 2, "select": 3, "from": 4, "t": 5}
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    path = tmp_path / "tokenizer.json"
+    tokenizer.save(str(path))
+    return path
+
+
+def test_estimate_counts_cjk_per_character():
+    assert estimate_tokens("客户余额") == 4
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("客户 id") == 2 + 1
+
+
+def test_count_tokens_handles_empty_and_non_string():
+    assert count_tokens("") == 0
+    assert count_tokens(None) == 0
+    assert count_tokens(12345678) == 2
+
+
+def test_count_message_tokens_adds_overhead():
+    messages = [{"role": "system", "content": "abcd"}, {"role": "user", "content": ""}]
+    assert count_message_tokens(messages) == 1 + 2 * MESSAGE_OVERHEAD_TOKENS
+
+
+def test_fit_within_budget_keeps_everything():
+    result = fit_prompt_items([{"question": "q", "sql": "s"}], ["ddl"], ["doc"], budget=10_000)
+    assert result == ([{"question": "q", "sql": "s"}], ["ddl"], ["doc"], 0)
+
+
+def test_fit_drops_lowest_ranked_docs_first():
+    docs = ["x" * 400, "y" * 400, "z" * 400]
+    _, ddls, kept_docs, dropped = fit_prompt_items([], ["d" * 40], docs, budget=250)
+    assert ddls == ["d" * 40]
+    assert kept_docs == ["x" * 400, "y" * 400]
+    assert dropped == 1
+
+
+def test_fit_always_keeps_first_ddl():
+    _, ddls, _, dropped = fit_prompt_items([], ["d" * 4000, "e" * 40], [], budget=10)
+    assert ddls == ["d" * 4000]
+    assert dropped == 1
+
+
+def test_fit_keeps_intermediate_sql_result_doc():
+    result_doc = f"{INTERMEDIATE_SQL_DOC_PREFIX} SELECT DISTINCT branch FROM t: \n" + "| a |\n" * 200
+    docs = ["x" * 400, "y" * 400, result_doc]
+    examples = [{"question": "q" * 40, "sql": "s" * 400}]
+    kept_examples, _, kept_docs, _ = fit_prompt_items(examples, ["d" * 40], docs, budget=count_tokens(result_doc) + 40)
+    assert kept_docs == [result_doc]
+    assert kept_examples == []
+
+
+def test_count_tokens_uses_loaded_tokenizer(word_tokenizer):
+    assert load_tokenizer(str(word_tokenizer)) is not None
+    assert get_tokenizer() is not None
+    assert count_tokens("客户 余额") == 2
+    assert count_tokens("select x from t") == 4
+
+
+def test_load_tokenizer_accepts_model_directory(word_tokenizer):
+    assert load_tokenizer(str(word_tokenizer.parent)) is not None
+    assert count_tokens("客户") == 1
+
+
+def test_missing_tokenizer_falls_back_to_estimate(tmp_path):
+    assert load_tokenizer(str(tmp_path / "missing" / "tokenizer.json")) is None
+    assert count_tokens("客户余额") == estimate_tokens("客户余额")
+
+
+def test_tokenizer_loaded_once_from_config(monkeypatch, word_tokenizer):
+    calls = []
+    monkeypatch.setattr(token_counter, "_tokenizer_loaded", False)
+    monkeypatch.setattr(token_counter, "_configured_tokenizer_path", lambda: calls.append(1) or str(word_tokenizer))
+    assert count_tokens("客户 余额") == 2
+    assert count_tokens("select t") == 2
+    assert calls == [1]
+
+
+def test_fit_budget_counts_with_tokenizer(word_tokenizer):
+    load_tokenizer(str(word_tokenizer))
+    docs = ["客户 " * 100, "余额 " * 100]
+    # 按估算每个文档约225个token，超出预算；分词器计为100个
+    _, _, kept_docs, dropped = fit_prompt_items([], ["t"], docs, budget=220)
+    assert kept_docs == docs
+    assert dropped == 0
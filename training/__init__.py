@@ -8,6 +8,7 @@ from .vanna_trainer import (
     train_ddl,
     train_documentation,
     train_sql_example,
+    train_sql_examples_batch,
     train_question_sql_pair,
     flush_training,
     shutdown_trainer
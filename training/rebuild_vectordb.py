@@ -0,0 +1,136 @@
+# rebuild_vectordb.py
+"""
+蓝绿方式重建PgVector向量库：
+
+1. 在新的影子版本集合中重新训练(可以同时更换embedding模型或维度)
+2. 校验影子版本的数据
+3. 在一个事务中把影子版本切换为active，运行中的应用在 version_check_interval 内自动切换
+4. 清理旧版本
+
+与 reset_vectordb.py 不同，重建期间线上应用一直使用旧版本，不会出现检索结果为空的窗口。
+"""
+import os
+import sys
+import argparse
+from datetime import datetime
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# training目录下的脚本通过 `from vanna_trainer import ...` 相互导入
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='蓝绿方式重建PgVector向量库')
+    parser.add_argument('--data_path', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'),
+                        help='训练数据目录路径 (默认: training/data)')
+    parser.add_argument('--plan', action='store_true',
+                        help='同时从业务数据库的information_schema生成表结构训练数据')
+    parser.add_argument('--version', type=str, default=None,
+                        help='影子版本名称 (默认: v+当前时间)')
+    parser.add_argument('--min_items', type=int, default=1,
+                        help='校验时影子版本至少需要的条目数')
+    parser.add_argument('--keep', type=int, default=2,
+                        help='保留的非active旧版本数量，用于回滚')
+    parser.add_argument('--no_swap', action='store_true',
+                        help='只构建和校验影子版本，不切换')
+    return parser.parse_args()
+
+
+def validate_version(engine, version, min_items):
+    """
+    校验影子版本：条目总数不少于min_items，且没有零向量
+
+    Returns:
+        bool: 校验是否通过
+    """
+    from custompgvector.collection_version import count_version_items
+
+    counts = count_version_items(engine, version)
+    print(f"\n===== 影子版本 {version} 校验 =====")
+    total_items = 0
+    total_zero = 0
+    for name, stats in counts.items():
+        print(f"{name}: {stats['items']} 条, 零向量 {stats['zero_vectors']} 条")
+        total_items += stats["items"]
+        total_zero += stats["zero_vectors"]
+
+    if total_items < min_items:
+        print(f"校验失败: 共 {total_items} 条，少于 {min_items} 条")
+        return False
+    if total_zero > 0:
+        print(f"校验失败: 存在 {total_zero} 条零向量，请检查embedding服务")
+        return False
+    print("校验通过")
+    return True
+
+
+def main():
+    args = parse_args()
+    version = args.version or datetime.now().strftime("v%Y%m%d_%H%M%S")
+
+    # 必须在导入app_config之前设置，之后创建的vanna实例都固定读写影子版本
+    os.environ["VECTOR_COLLECTION_VERSION"] = version
+
+    import app_config
+    from sqlalchemy import create_engine
+    from custompgvector.collection_version import (
+        register_version,
+        activate_version,
+        garbage_collect_versions,
+    )
+
+    if app_config.VECTOR_DB_TYPE.lower() != "pgvector":
+        print("错误: 当前配置的向量数据库类型不是pgvector")
+        print(f"当前配置: {app_config.VECTOR_DB_TYPE}")
+        sys.exit(1)
+
+    db_cfg = app_config.PGVECTOR_CONFIG
+    connection_string = (
+        f"postgresql://{db_cfg['user']}:{db_cfg['password']}@"
+        f"{db_cfg['host']}:{db_cfg['port']}/{db_cfg['dbname']}"
+    )
+    engine = create_engine(connection_string)
+
+    print(f"\n===== 开始构建影子版本: {version} =====")
+    print(f"Embedding模型: {app_config.EMBEDDING_CONFIG['model_name']}, 维度: {app_config.EMBEDDING_CONFIG['embedding_dimension']}")
+    register_version(
+        engine,
+        version,
+        app_config.EMBEDDING_CONFIG["model_name"],
+        app_config.EMBEDDING_CONFIG["embedding_dimension"],
+    )
+
+    import run_training
+    from vanna_trainer import flush_training, shutdown_trainer
+
+    run_training.check_embedding_model_connection()
+
+    # 先处理训练文件，run_training_plan 结束时会关闭批处理器
+    run_training.process_training_files(args.data_path)
+    flush_training()
+    if args.plan:
+        import run_plan_schema
+        run_plan_schema.run_training_plan()
+    shutdown_trainer()
+
+    if not validate_version(engine, version, args.min_items):
+        print(f"\n===== 影子版本 {version} 未切换，线上继续使用当前版本 =====")
+        sys.exit(1)
+
+    if args.no_swap:
+        print(f"\n===== 影子版本 {version} 已构建完成，未切换 (--no_swap) =====")
+        return
+
+    activate_version(engine, version)
+    print(f"\n===== 已切换active版本为: {version} =====")
+
+    dropped = garbage_collect_versions(engine, keep=args.keep)
+    if dropped:
+        print(f"已清理旧版本: {', '.join(dropped)}")
+    else:
+        print("没有需要清理的旧版本")
+
+
+if __name__ == "__main__":
+    main()
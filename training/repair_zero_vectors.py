@@ -0,0 +1,173 @@
+# repair_zero_vectors.py
+"""
+查找并修复PgVector中的零向量：
+
+历史上embedding接口失败时会写入零向量，这些条目会污染相似度检索。
+本脚本扫描所有集合中范数接近0的向量(以及之前被隔离的条目)，分批重新生成embedding并原地更新；
+重新生成仍然失败的条目会在cmetadata中标记为quarantined，检索时跳过，下次运行时再重试。
+"""
+import os
+import sys
+import argparse
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app_config
+from sqlalchemy import create_engine, text
+
+from embedding_function import get_embedding_function, is_zero_vector, ZERO_NORM_THRESHOLD
+from custompgvector.collection_version import VERSION_TABLE
+
+
+def find_invalid_vectors(engine, threshold):
+    """
+    查找所有集合中的零向量和已隔离的条目
+
+    Returns:
+        list: [{"id", "document", "collection"}, ...]
+    """
+    query = text("""
+    SELECT e.id, e.document, c.name AS collection
+    FROM langchain_pg_embedding e
+    JOIN langchain_pg_collection c ON e.collection_id = c.uuid
+    WHERE e.embedding IS NULL
+       OR vector_norm(e.embedding) < :threshold
+       OR COALESCE((e.cmetadata ->> 'quarantined')::boolean, false)
+    ORDER BY c.name
+    """)
+    with engine.connect() as conn:
+        rows = conn.execute(query, {"threshold": threshold}).mappings().fetchall()
+    return [dict(row) for row in rows]
+
+
+def get_foreign_model_collections(engine, model_name):
+    """
+    返回使用其他embedding模型构建的版本的集合前缀，这些集合不能用当前模型重新生成向量
+    """
+    with engine.connect() as conn:
+        exists = conn.execute(text("SELECT to_regclass(:table_name)"), {"table_name": VERSION_TABLE}).scalar()
+        if not exists:
+            return []
+        rows = conn.execute(text(f"""
+        SELECT version FROM {VERSION_TABLE}
+        WHERE embedding_model IS NOT NULL AND embedding_model <> :model_name
+        """), {"model_name": model_name}).fetchall()
+    return [f"{row[0]}__" for row in rows]
+
+
+def embed_batch(embedding_function, texts):
+    """
+    批量生成向量；整批失败时逐条重试，定位具体失败的条目
+
+    Returns:
+        list: 与texts一一对应的 (向量 或 None, 错误信息 或 None)
+    """
+    try:
+        return [(vector, None) for vector in embedding_function(texts)]
+    except Exception:
+        results = []
+        for item in texts:
+            try:
+                results.append((embedding_function([item])[0], None))
+            except Exception as e:
+                results.append((None, str(e)))
+        return results
+
+
+def repair_zero_vectors(threshold=ZERO_NORM_THRESHOLD, batch_size=10, dry_run=False):
+    """
+    扫描并修复零向量
+
+    Returns:
+        dict: 统计信息 found / repaired / quarantined / skipped
+    """
+    db_cfg = app_config.PGVECTOR_CONFIG
+    connection_string = (
+        f"postgresql://{db_cfg['user']}:{db_cfg['password']}@"
+        f"{db_cfg['host']}:{db_cfg['port']}/{db_cfg['dbname']}"
+    )
+    engine = create_engine(connection_string)
+    embedding_function = get_embedding_function()
+
+    rows = find_invalid_vectors(engine, threshold)
+    stats = {"found": len(rows), "repaired": 0, "quarantined": 0, "skipped": 0}
+    print(f"找到 {len(rows)} 条零向量或已隔离的条目")
+
+    foreign_prefixes = get_foreign_model_collections(engine, embedding_function.model_name)
+    candidates = []
+    for row in rows:
+        if any(row["collection"].startswith(prefix) for prefix in foreign_prefixes):
+            stats["skipped"] += 1
+            continue
+        if not row["document"]:
+            stats["skipped"] += 1
+            continue
+        candidates.append(row)
+
+    if stats["skipped"]:
+        print(f"跳过 {stats['skipped']} 条 (文档为空或属于使用其他embedding模型的版本)")
+
+    if dry_run:
+        for row in candidates:
+            print(f"[dry_run] {row['collection']}: {row['id']}")
+        return stats
+
+    update_query = text("""
+    UPDATE langchain_pg_embedding
+    SET embedding = CAST(:embedding AS vector),
+        cmetadata = COALESCE(cmetadata, '{}'::jsonb) - 'quarantined' - 'quarantine_reason'
+    WHERE id = :id
+    """)
+    quarantine_query = text("""
+    UPDATE langchain_pg_embedding
+    SET cmetadata = COALESCE(cmetadata, '{}'::jsonb)
+        || jsonb_build_object('quarantined', true, 'quarantine_reason', CAST(:reason AS text))
+    WHERE id = :id
+    """)
+
+    for start in range(0, len(candidates), batch_size):
+        batch = candidates[start:start + batch_size]
+        results = embed_batch(embedding_function, [row["document"] for row in batch])
+
+        with engine.begin() as conn:
+            for row, (vector, error) in zip(batch, results):
+                if vector is not None and not is_zero_vector(vector, threshold):
+                    embedding = "[" + ",".join(str(float(value)) for value in vector) + "]"
+                    conn.execute(update_query, {"embedding": embedding, "id": row["id"]})
+                    stats["repaired"] += 1
+                else:
+                    reason = error or "embedding接口返回零向量"
+                    conn.execute(quarantine_query, {"reason": reason[:500], "id": row["id"]})
+                    stats["quarantined"] += 1
+
+        print(f"已处理 {min(start + batch_size, len(candidates))}/{len(candidates)} 条")
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='查找并修复PgVector中的零向量')
+    parser.add_argument('--threshold', type=float, default=ZERO_NORM_THRESHOLD,
+                        help=f'范数低于该值视为零向量 (默认: {ZERO_NORM_THRESHOLD})')
+    parser.add_argument('--batch_size', type=int, default=app_config.BATCH_SIZE,
+                        help='每批重新生成embedding的条目数')
+    parser.add_argument('--dry_run', action='store_true',
+                        help='只列出需要修复的条目，不做修改')
+    args = parser.parse_args()
+
+    if app_config.VECTOR_DB_TYPE.lower() not in ("pgvector", "pgvector_service"):
+        print("错误: 当前配置的向量数据库类型不是pgvector")
+        print(f"当前配置: {app_config.VECTOR_DB_TYPE}")
+        sys.exit(1)
+
+    stats = repair_zero_vectors(threshold=args.threshold, batch_size=args.batch_size, dry_run=args.dry_run)
+
+    print("\n===== 零向量修复统计 =====")
+    print(f"发现: {stats['found']} 条")
+    print(f"修复: {stats['repaired']} 条")
+    print(f"隔离: {stats['quarantined']} 条")
+    print(f"跳过: {stats['skipped']} 条")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ import sys
 import argparse
 from pathlib import Path
 import pandas as pd
+from vanna.types import TrainingPlanItem
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -45,6 +46,91 @@ def check_embedding_model_connection():
         print("训练过程终止。请检查配置和API服务可用性。")
         sys.exit(1)
 
+TABLE_SCHEMA_QUERY = """
+SELECT c.table_schema, c.table_name, c.column_name, c.data_type, c.is_nullable, c.ordinal_position,
+       col_description(format('%I.%I', c.table_schema, c.table_name)::regclass, c.ordinal_position) AS column_comment,
+       obj_description(format('%I.%I', c.table_schema, c.table_name)::regclass, 'pg_class') AS table_comment
+FROM information_schema.columns c
+WHERE c.table_schema = 'public'
+ORDER BY c.table_schema, c.table_name, c.ordinal_position;
+"""
+
+# 表摘要中最多列出的列数，保证摘要足够精简
+MAX_SUMMARY_COLUMNS = 30
+
+def build_table_schema_items(df_columns):
+    """
+    将information_schema.columns(含注释)按表拆分为 (表名, 表摘要, 详细DDL) 列表
+    
+    Args:
+        df_columns (pd.DataFrame): TABLE_SCHEMA_QUERY 的查询结果
+        
+    Returns:
+        list: [(table_name, summary, ddl), ...]
+    """
+    items = []
+    for (schema, table), df_table in df_columns.groupby(["table_schema", "table_name"], sort=False):
+        table_name = f"{schema}.{table}"
+        table_comment = df_table["table_comment"].iloc[0]
+
+        # 摘要：表名、表注释和列名(带注释)，用于第一阶段的向量检索
+        column_labels = []
+        for _, col in df_table.head(MAX_SUMMARY_COLUMNS).iterrows():
+            if pd.notna(col["column_comment"]) and col["column_comment"]:
+                column_labels.append(f"{col['column_name']}({col['column_comment']})")
+            else:
+                column_labels.append(col["column_name"])
+        if len(df_table) > MAX_SUMMARY_COLUMNS:
+            column_labels.append(f"...共{len(df_table)}列")
+        summary = f"表 {table_name}"
+        if pd.notna(table_comment) and table_comment:
+            summary += f"（{table_comment}）"
+        summary += "：" + ", ".join(column_labels)
+
+        # 详细DDL：第二阶段按表名直接取出
+        column_lines = []
+        for _, col in df_table.iterrows():
+            line = f"    {col['column_name']} {col['data_type']}"
+            if col["is_nullable"] == "NO":
+                line += " NOT NULL"
+            if pd.notna(col["column_comment"]) and col["column_comment"]:
+                line += f" -- {col['column_comment']}"
+            column_lines.append(line)
+        ddl = f"CREATE TABLE {table_name} (\n" + ",\n".join(column_lines) + "\n);"
+        if pd.notna(table_comment) and table_comment:
+            ddl += f"\nCOMMENT ON TABLE {table_name} IS '{table_comment}';"
+
+        items.append((table_name, summary, ddl))
+    return items
+
+def run_catalog_sql(vn, sql):
+    """查询表结构：SQL执行前检查会给非聚合查询加默认LIMIT，表结构必须完整，绕过检查执行"""
+    run = getattr(vn, "run_unguarded_sql", vn.run_sql)
+    return run(sql)
+
+def run_hierarchical_schema_training(vn):
+    """
+    为分层检索生成表摘要和详细DDL
+    
+    Returns:
+        bool: 是否成功
+    """
+    print("\n===== 正在生成分层检索的表摘要和DDL =====")
+    df_columns = run_catalog_sql(vn, TABLE_SCHEMA_QUERY)
+    if df_columns is None or df_columns.empty:
+        print("错误: 无法获取数据库表结构信息")
+        return False
+
+    items = build_table_schema_items(df_columns)
+    print(f"共 {len(items)} 张表")
+    for idx, (table_name, summary, ddl) in enumerate(items, start=1):
+        try:
+            vn.add_table_schema(table_name=table_name, summary=summary, ddl=ddl)
+            print(f"[{idx}/{len(items)}] 已写入表: {table_name}")
+        except Exception as e:
+            print(f"错误：表 {table_name} - {e}")
+    return True
+
 def run_training_plan():
     """
     执行Vanna的training plan功能
@@ -63,7 +149,7 @@ def run_training_plan():
         # 获取数据库表结构信息
         print("\n===== 正在从数据库获取表结构信息 =====")
         # SELECT * FROM INFORMATION_SCHEMA.COLUMNS;
-        df_information_schema = vn.run_sql("SELECT * FROM information_schema.columns WHERE table_schema = 'public';")
+        df_information_schema = run_catalog_sql(vn, "SELECT * FROM information_schema.columns WHERE table_schema = 'public';")
                 
         
         if df_information_schema is None or df_information_schema.empty:
@@ -81,6 +167,12 @@ def run_training_plan():
             return False
             
         print(f"成功生成训练计划")
+
+        # 启用分层检索时，按表写入摘要和详细DDL，替代计划中平铺的DDL，计划中的其他条目照常训练
+        if getattr(vn, "hierarchical_ddl", False):
+            if not run_hierarchical_schema_training(vn):
+                return False
+            plan._plan = [item for item in plan._plan if item.item_type != TrainingPlanItem.ITEM_TYPE_DDL]
         
         # 打印训练计划概要
         if hasattr(plan, '_plan') and hasattr(plan._plan, '__len__'):
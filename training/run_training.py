@@ -15,9 +15,11 @@ from vanna_trainer import (
     train_ddl,
     train_documentation,
     train_sql_example,
+    train_sql_examples_batch,
     train_question_sql_pair,
     flush_training,
-    shutdown_trainer
+    shutdown_trainer,
+    QUESTION_GENERATION_CONFIG
 )
 
 def check_embedding_model_connection():
@@ -154,7 +156,14 @@ def train_sql_examples(sql_file):
     if not os.path.exists(sql_file):
         print(f" SQL 示例文件不存在: {sql_file}")
         return
-    for idx, sql in enumerate(read_file_by_delimiter(sql_file, ";"), start=1):
+    sqls = read_file_by_delimiter(sql_file, ";")
+    if QUESTION_GENERATION_CONFIG.get("batch_enabled"):
+        # 批量生成问题，一个提示词处理多条SQL
+        failed = train_sql_examples_batch(sqls)
+        if failed:
+            print(f" 错误：{failed} 条SQL未能生成问题")
+        return
+    for idx, sql in enumerate(sqls, start=1):
         try:
             print(f"\n SQL 示例训练 {idx}")
             train_sql_example(sql)
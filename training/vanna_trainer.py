@@ -17,6 +17,8 @@ project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 # 创建vanna实例
 from vanna_llm_factory import create_vanna_instance
+from common.question_gen import BATCH_QUESTION_SYSTEM_PROMPT, generate_questions_batched, normalize_question
+from common.question_cache import QuestionCache, question_cache_version
 
 vn = create_vanna_instance()
 
@@ -35,6 +37,26 @@ print("==============================")
 BATCH_PROCESSING_ENABLED = app_config.BATCH_PROCESSING_ENABLED
 BATCH_SIZE = app_config.BATCH_SIZE
 MAX_WORKERS = app_config.MAX_WORKERS
+QUESTION_GENERATION_CONFIG = getattr(app_config, "QUESTION_GENERATION_CONFIG", {})
+QUESTION_CACHE_CONFIG = getattr(app_config, "QUESTION_CACHE_CONFIG", {})
+
+
+def create_question_cache():
+    """按生成问题实际使用的模型和提示词版本创建缓存，未启用时返回None"""
+    if not QUESTION_CACHE_CONFIG.get("enabled"):
+        return None
+    router = getattr(vn, "llm_router", None)
+    route = router.resolve("question") if router is not None else None
+    model = route["model"] if route else vn.config.get("model")
+    # 批量和逐条生成问题的提示词变化时自动失效；使用vanna默认提示词的LLM类没有 QUESTION_SYSTEM_PROMPT
+    prompts = (BATCH_QUESTION_SYSTEM_PROMPT, getattr(vn, "QUESTION_SYSTEM_PROMPT", ""))
+    version = question_cache_version(model, QUESTION_CACHE_CONFIG.get("prompt_version", "1"), prompts)
+    cache = QuestionCache(QUESTION_CACHE_CONFIG["path"], version)
+    print(f"[DEBUG] 问题缓存: {QUESTION_CACHE_CONFIG['path']} (版本 {cache.version})")
+    return cache
+
+
+question_cache = create_question_cache()
 
 
 # 数据批处理器
@@ -177,12 +199,14 @@ def train_sql_example(sql: str):
     print(f"[SQL] Training on SQL:\n{sql}")
     
     try:
-        # 直接调用generate_question方法
-        question = vn.generate_question(sql=sql)
-        
-        question = question.strip()
-        if not question.endswith("?") and not question.endswith("？"):
-            question += "?"
+        question = question_cache.get(sql) if question_cache is not None else None
+        if question is None:
+            # 直接调用generate_question方法
+            question = normalize_question(vn.generate_question(sql=sql))
+            if question_cache is not None:
+                question_cache.set(sql, question)
+        else:
+            print("[DEBUG] 问题缓存命中")
             
     except Exception as e:
         print(f"[ERROR] 生成问题时出错: {e}")
@@ -192,6 +216,48 @@ def train_sql_example(sql: str):
     # 使用标准方式存储问题-SQL对
     batch_processor.add_item('question_sql', {'question': question, 'sql': sql})
 
+def train_sql_examples_batch(sqls: List[str]):
+    """
+    批量训练SQL示例：多条SQL放在一个提示词中生成问题，多个批次并发执行(QUESTION_GENERATION_CONFIG)
+    
+    Returns:
+        int: 未能生成问题而跳过的SQL数
+    """
+    print(f"[SQL] Training on {len(sqls)} SQL examples (batched)")
+    # 先查问题缓存，只为没有缓存的SQL调用LLM
+    questions = [None] * len(sqls)
+    if question_cache is not None:
+        for index, question in question_cache.get_many(sqls).items():
+            questions[index] = question
+    missing = [index for index, question in enumerate(questions) if question is None]
+    if question_cache is not None:
+        print(f"[INFO] 问题缓存命中 {len(sqls) - len(missing)}/{len(sqls)} 条")
+
+    generated = []
+    if missing:
+        generated = generate_questions_batched(
+            vn,
+            [sqls[index] for index in missing],
+            batch_size=QUESTION_GENERATION_CONFIG.get("batch_size", 20),
+            max_workers=QUESTION_GENERATION_CONFIG.get("max_workers", 4),
+            requests_per_minute=QUESTION_GENERATION_CONFIG.get("requests_per_minute"),
+            max_batch_tokens=QUESTION_GENERATION_CONFIG.get("max_batch_tokens"),
+        )
+    for index, question in zip(missing, generated):
+        questions[index] = question
+    if question_cache is not None:
+        question_cache.set_many([(sqls[index], question) for index, question in zip(missing, generated)])
+
+    failed = 0
+    for sql, question in zip(sqls, questions):
+        if question is None:
+            failed += 1
+            print(f"[ERROR] 无法为SQL生成问题，跳过:\n{sql}")
+            continue
+        print(f"[SQL] 生成问题: {question}")
+        batch_processor.add_item('question_sql', {'question': question, 'sql': sql})
+    return failed
+
 def train_question_sql_pair(question: str, sql: str):
     print(f"[Q-S] Training on:\nquestion: {question}\nsql: {sql}")
     batch_processor.add_item('question_sql', {'question': question, 'sql': sql})
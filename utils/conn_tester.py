@@ -191,11 +191,8 @@ def test_llm_connection() -> Dict[str, Any]:
                 return result
             
             # 执行简单测试
-            from openai import OpenAI
-            client = OpenAI(
-                api_key=config["api_key"], 
-                base_url="https://api.deepseek.com/v1"
-            )
+            from common.llm_client import DEEPSEEK_BASE_URL, get_openai_client
+            client = get_openai_client(config["api_key"], config.get("base_url", DEEPSEEK_BASE_URL))
             
             response = client.chat.completions.create(
                 model=config["model"],
@@ -225,15 +222,8 @@ def test_llm_connection() -> Dict[str, Any]:
                 return result
             
             # 执行简单测试
-            from openai import OpenAI
-            base_url = "https://dashscope.aliyuncs.com/compatible-mode/v1"
-            if "base_url" in config:
-                base_url = config["base_url"]
-                
-            client = OpenAI(
-                api_key=config["api_key"],
-                base_url=base_url
-            )
+            from common.llm_client import QWEN_BASE_URL, get_openai_client
+            client = get_openai_client(config["api_key"], config.get("base_url", QWEN_BASE_URL))
             
             response = client.chat.completions.create(
                 model=config["model"],
@@ -1,22 +1,728 @@
 """
 Vanna LLM 工厂文件，支持 ChromaDB 和 PGVector，自动组合 LLM 和 VectorStore。
 """
+from vanna.base import VannaBase
 from vanna.chromadb import ChromaDB_VectorStore
 from customqianwen.Custom_QianwenAI_chat import QianWenAI_Chat
 from customdeepseek.custom_deepseek_chat import DeepSeekChat
 from custompgvector.custom_pgvector import PG_VectorStore
+from custompgvector.retrieval_client import PG_VectorStoreClient
 from embedding_function import get_embedding_function
+from common.semantic_cache import SemanticCache
+from common.llm_cache import create_response_cache, get_prompt_type, prompt_cache_key
+from common.llm_router import LLMRouter
+from common.llm_provider import ChatClient, ProviderPool
+from common.token_counter import INTERMEDIATE_SQL_DOC_PREFIX, count_message_tokens, count_tokens, fit_prompt_items
+from common.sql_stream import SQL_STOP_SEQUENCES, finalize_sql_response
+from common.ddl_compactor import DDLCompactor
+from common.result_digest import ResultDigester
+from common.sql_guard import SQLGuard, SQLGuardError
+from common.plan_feedback import PlanFeedback
+from common.llm_client import DEEPSEEK_BASE_URL, QWEN_BASE_URL, get_openai_client
+from common.llm_usage import provider_of, usage_meter
+from common.logger import get_logger, log_payload, setup_logging
 import app_config
+import asyncio
+import contextlib
+import contextvars
 import os
+import threading
+
+logger = get_logger(__name__)
+
 
 def CustomVannaDynamic(vectorstore_cls, llm_cls):
     class _CustomVanna(vectorstore_cls, llm_cls):
         def __init__(self, config=None):
             vectorstore_cls.__init__(self, config=config)
             llm_cls.__init__(self, config=config)
+            cache_cfg = (config or {}).get("semantic_cache") or {}
+            self.semantic_cache = None
+            if cache_cfg.get("enabled"):
+                self.semantic_cache = SemanticCache(
+                    similarity_threshold=cache_cfg.get("similarity_threshold", 0.99),
+                    ttl=cache_cfg.get("ttl", 3600),
+                    max_size=cache_cfg.get("max_size", 1000),
+                )
+            self.llm_router = (config or {}).get("llm_router")
+            self.provider_pool = (config or {}).get("provider_pool")
+            self.response_cache = create_response_cache((config or {}).get("response_cache"))
+            compaction_cfg = (config or {}).get("ddl_compaction") or {}
+            self.ddl_compactor = None
+            self.ddl_embedding_match = compaction_cfg.get("embedding_match", False)
+            if compaction_cfg.get("enabled"):
+                self.ddl_compactor = DDLCompactor(
+                    max_columns=compaction_cfg.get("max_columns", 30),
+                    embedding_function=self.generate_embedding if self.ddl_embedding_match else None,
+                    similarity_threshold=compaction_cfg.get("similarity_threshold", 0.5),
+                )
+            digest_cfg = (config or {}).get("result_digest") or {}
+            self.result_digester = None
+            if digest_cfg.get("enabled"):
+                self.result_digester = ResultDigester(
+                    max_rows=digest_cfg.get("max_rows", 200),
+                    max_bytes=digest_cfg.get("max_bytes", 1_000_000),
+                    top_k=digest_cfg.get("top_k", 5),
+                    sample_rows=digest_cfg.get("sample_rows", 5),
+                    max_group_cardinality=digest_cfg.get("max_group_cardinality", 20),
+                    cache_size=digest_cfg.get("cache_size", 128),
+                )
+            # 提示词开头保持固定(说明 -> 按固定顺序排列的DDL和文档 -> 示例和问题)，便于服务商的上下文缓存命中
+            self.stable_prompt_prefix = ((config or {}).get("prompt_cache") or {}).get("stable_prefix", False)
+            budget_cfg = (config or {}).get("prompt_budget") or {}
+            self.prompt_budget_enabled = budget_cfg.get("enabled", False)
+            self.max_prompt_tokens = budget_cfg.get("max_prompt_tokens", self.max_tokens)
+            sql_stream_cfg = (config or {}).get("sql_stream") or {}
+            self.sql_early_stop = sql_stream_cfg.get("early_stop", False)
+            self.sql_stop_sequences = sql_stream_cfg.get("stop_sequences", SQL_STOP_SEQUENCES)
+            exact_cfg = (config or {}).get("exact_match") or {}
+            self.exact_match_enabled = exact_cfg.get("enabled", False)
+            self.exact_match_max_distance = exact_cfg.get("max_distance", 0.02)
+            # 记录当前线程(或asyncio任务)最近一次generate_sql走的路径: exact_match / semantic_cache / llm
+            self._sql_path = contextvars.ContextVar(f"sql_path_{id(self)}", default=None)
+            self.sql_guard_config = (config or {}).get("sql_guard") or {}
+            self.sql_guard = None
+            # 启用SQL检查前vanna设置的run_sql，训练和维护脚本查询系统目录时使用
+            self._unguarded_run_sql = None
+            self.plan_feedback_config = (config or {}).get("sql_plan_feedback") or {}
+            self.plan_feedback = None
+            # 当前线程(或asyncio任务)最近一次run_sql被执行前检查拒绝的原因
+            self._sql_guard_error = contextvars.ContextVar(f"sql_guard_error_{id(self)}", default=None)
+            # 最近一次run_sql的结果被自动加上的LIMIT截断时为该LIMIT
+            self._sql_guard_limit = contextvars.ContextVar(f"sql_guard_limit_{id(self)}", default=None)
+
+        def log(self, message: str, title: str = "Info"):
+            # vanna的generate_sql会用log输出完整的提示词和LLM响应，改为抽样的DEBUG日志
+            log_payload(logger, title, message)
+
+        def get_last_sql_path(self) -> str | None:
+            return self._sql_path.get()
+
+        def get_last_sql_guard_error(self) -> SQLGuardError | None:
+            return self._sql_guard_error.get()
+
+        def get_last_sql_guard_limit(self) -> int | None:
+            return self._sql_guard_limit.get()
+
+        def reset_sql_guard_state(self):
+            """请求开始时调用：线程会被后续请求复用，上一个请求的拒绝原因不能带到本次请求"""
+            self._sql_guard_error.set(None)
+            self._sql_guard_limit.set(None)
+
+        def connect_to_postgres(self, host=None, dbname=None, user=None, password=None, port=None, **kwargs):
+            super().connect_to_postgres(host=host, dbname=dbname, user=user, password=password, port=port, **kwargs)
+            if not self.sql_guard_config.get("enabled"):
+                return
+            self.sql_guard = SQLGuard(
+                dict(host=host, dbname=dbname, user=user, password=password, port=port, **kwargs),
+                max_total_cost=self.sql_guard_config.get("max_total_cost", 1e7),
+                max_plan_rows=self.sql_guard_config.get("max_plan_rows", 1e7),
+                statement_timeout_ms=self.sql_guard_config.get("statement_timeout_ms", 30000),
+                default_limit=self.sql_guard_config.get("default_limit", 1000),
+                pool_size=self.sql_guard_config.get("pool_size", 10),
+                pool_timeout=self.sql_guard_config.get("pool_timeout", 30),
+                plan_cache_ttl=self.sql_guard_config.get("plan_cache_ttl", 60),
+            )
+            # vanna的ask、flask接口和中间SQL都通过self.run_sql执行；训练脚本使用 run_unguarded_sql
+            self._unguarded_run_sql = self.run_sql
+            self.run_sql = self._guarded_run_sql
+            logger.info("已启用SQL执行前检查: %s", self.sql_guard.stats())
+            if self.plan_feedback_config.get("enabled"):
+                self.plan_feedback = PlanFeedback(
+                    self.sql_guard,
+                    cost_threshold=self.plan_feedback_config.get("cost_threshold", 1e6),
+                    big_table_rows=self.plan_feedback_config.get("big_table_rows", 1e6),
+                    max_partitions=self.plan_feedback_config.get("max_partitions", 8),
+                    max_indexes=self.plan_feedback_config.get("max_indexes", 30),
+                )
+
+        def _guarded_run_sql(self, sql: str):
+            self.reset_sql_guard_state()
+            try:
+                df = self.sql_guard.run(sql)
+            except SQLGuardError as e:
+                self._sql_guard_error.set(e)
+                raise
+            limit = df.attrs.get("limit")
+            if limit and len(df) >= limit:
+                self._sql_guard_limit.set(limit)
+            return df
+
+        def run_unguarded_sql(self, sql: str):
+            """
+            训练和维护脚本使用：查询information_schema等系统目录，结果必须完整，
+            不经过SQL执行前检查，也不加默认LIMIT
+            """
+            if self._unguarded_run_sql is not None:
+                return self._unguarded_run_sql(sql)
+            return self.run_sql(sql)
+
+        def _improve_sql_plan(self, question: str, sql: str, **kwargs) -> str:
+            """EXPLAIN估算代价过高时让LLM改写为更便宜的等价查询，失败时保留原SQL"""
+            if self.plan_feedback is None or not self.is_sql_valid(sql):
+                return sql
+            # 改写的输出不推送给流式接口
+            kwargs = {key: value for key, value in kwargs.items() if key not in ("on_token", "on_llm_call")}
+            kwargs["prompt_type"] = "sql"
+            try:
+                return self.plan_feedback.improve(
+                    question, sql, lambda prompt: self.extract_sql(self.submit_prompt(
+                        [self.system_message(prompt)], **kwargs
+                    ))
+                )
+            except Exception as e:
+                logger.warning("执行计划反馈改写失败，保留原SQL: %s", e)
+                return sql
+
+        def _match_question_sql(self, question: str):
+            """
+            训练集中与问题几乎相同的问题(余弦距离不超过阈值)
+
+            Returns:
+                tuple: (匹配的question_sql或None, 检索到的question_sql列表或None)；
+                    未匹配时检索结果留给随后的LLM生成使用，不再重复检索
+            """
+            # 只有PgVector检索结果带有距离，其他向量库不走快速路径
+            if not hasattr(self, "get_similar_question_sql_with_distances"):
+                return None, None
+            try:
+                similar = self.get_similar_question_sql_with_distances(question)
+            except Exception as e:
+                logger.warning("精确匹配检索失败，跳过快速路径: %s", e)
+                return None, None
+            question_sql_list = [item for item, _ in similar]
+            if not similar or similar[0][1] > self.exact_match_max_distance:
+                return None, question_sql_list
+            top, distance = similar[0]
+            logger.debug("精确匹配训练问题 (距离 %.4f): %s", distance, top["question"])
+            return top, question_sql_list
+
+        def _question_embedding(self, question: str) -> list:
+            # PG_VectorStore 的问题向量缓存与随后的检索共用，未命中时不会重复计算
+            if hasattr(self, "_embed_question"):
+                return self._embed_question(question)
+            return self.generate_embedding(question)
+
+        def _sql_generation_steps(self, question: str, allow_llm_to_see_data=False, question_sql_list=None, **kwargs):
+            """
+            与vanna的generate_sql相同的生成步骤，生成的SQL无效时用路由中配置的更强的模型再试一次。
+            检索、调用LLM和执行中间SQL不在这里完成，而是yield (步骤, 参数)，由 _generate_sql_with_llm
+            和 agenerate_sql 分别以同步、异步方式执行后send回结果，两条路径共用提示词和回退逻辑
+            """
+            initial_prompt = self.config.get("initial_prompt", None) if self.config is not None else None
+            question_sql_list, ddl_list, doc_list = yield "retrieve", (question, question_sql_list)
+
+            for route_fallback in (False, True):
+                prompt = self.get_sql_prompt(
+                    initial_prompt=initial_prompt,
+                    question=question,
+                    question_sql_list=question_sql_list,
+                    ddl_list=ddl_list,
+                    doc_list=doc_list,
+                    **kwargs,
+                )
+                self.log(title="SQL Prompt", message=prompt)
+                llm_response = yield "submit", (prompt, route_fallback)
+                self.log(title="LLM Response", message=llm_response)
+
+                if "intermediate_sql" in llm_response:
+                    if not allow_llm_to_see_data:
+                        return "The LLM is not allowed to see the data in your database. Your question requires database introspection to generate the necessary SQL. Please set allow_llm_to_see_data=True to enable this."
+                    intermediate_sql = self.extract_sql(llm_response)
+                    self.log(title="Running Intermediate SQL", message=intermediate_sql)
+                    try:
+                        df = yield "run_sql", (intermediate_sql,)
+                    except Exception as e:
+                        return f"Error running intermediate SQL: {e}"
+                    prompt = self.get_sql_prompt(
+                        initial_prompt=initial_prompt,
+                        question=question,
+                        question_sql_list=question_sql_list,
+                        ddl_list=ddl_list,
+                        doc_list=doc_list + [f"{INTERMEDIATE_SQL_DOC_PREFIX} {intermediate_sql}: \n" + df.to_markdown()],
+                        **kwargs,
+                    )
+                    self.log(title="Final SQL Prompt", message=prompt)
+                    llm_response = yield "submit", (prompt, route_fallback)
+                    self.log(title="LLM Response", message=llm_response)
+
+                sql = self.extract_sql(llm_response)
+                if route_fallback or not self._should_fallback(question, sql):
+                    return sql
+                logger.debug("生成的SQL无效，使用备用模型重新生成")
+
+        @staticmethod
+        def _advance(steps, value=None, error=None):
+            """把上一步的结果(或异常)交给 _sql_generation_steps，返回下一步；生成结束时返回 (None, SQL)"""
+            try:
+                return steps.throw(error) if error is not None else steps.send(value)
+            except StopIteration as stop:
+                return None, stop.value
+
+        def _generate_sql_with_llm(self, question: str, allow_llm_to_see_data=False, question_sql_list=None,
+                                   **kwargs) -> str:
+            kwargs = {**kwargs, "prompt_type": "sql"}
+            steps = self._sql_generation_steps(question, allow_llm_to_see_data, question_sql_list, **kwargs)
+            step, args = self._advance(steps)
+            while step is not None:
+                value = error = None
+                try:
+                    if step == "retrieve":
+                        value = self._retrieve_context(*args, **kwargs)
+                    elif step == "submit":
+                        prompt, route_fallback = args
+                        value = self.submit_prompt(prompt, route_fallback=route_fallback, **kwargs)
+                    else:
+                        value = self.run_sql(*args)
+                except Exception as e:
+                    # 只有执行中间SQL的异常由生成步骤处理，其余异常会原样抛出
+                    error = e
+                step, args = self._advance(steps, value, error)
+            return args
+
+        def _should_fallback(self, question: str, sql: str) -> bool:
+            return bool(
+                question
+                and self.llm_router is not None
+                and self.llm_router.has_fallback("sql")
+                and not self.is_sql_valid(sql)
+            )
+
+        def _lookup_cached_sql(self, question: str):
+            """
+            依次尝试精确匹配训练问题和语义缓存
+
+            Returns:
+                tuple: (SQL或None, 路径, 语义缓存上下文, 已检索的question_sql列表或None)；
+                    未命中时SQL为None，语义缓存上下文用于在LLM生成后写入缓存
+            """
+            question_sql_list = None
+            if self.exact_match_enabled:
+                matched, question_sql_list = self._match_question_sql(question)
+                if matched is not None:
+                    return matched["sql"], "exact_match", None, None
+
+            if self.semantic_cache is None:
+                return None, "llm", None, question_sql_list
+
+            generation = self.semantic_cache.generation
+            try:
+                scope = self._semantic_cache_scope()
+                embedding = self._question_embedding(question)
+            except Exception as e:
+                logger.warning("语义缓存读取训练数据版本或计算问题向量失败，跳过缓存: %s", e)
+                return None, "llm", None, question_sql_list
+
+            cached = self.semantic_cache.lookup(embedding, scope=scope, question=question)
+            if cached is not None:
+                logger.debug("语义缓存命中 (相似度 %.4f): %s", cached["similarity"], cached["question"])
+                return cached["sql"], "semantic_cache", None, None
+            return None, "llm", (embedding, scope, generation), question_sql_list
+
+        def _semantic_cache_scope(self):
+            """
+            语义缓存的作用域：向量库提供 training_data_stamp 时为整个库的训练数据版本，
+            其他进程或训练脚本修改训练数据后缓存随之失效；否则只跟随集合版本和本进程内的训练
+            """
+            if hasattr(self, "training_data_stamp"):
+                return self.training_data_stamp()
+            if hasattr(self, "refresh_collection_version"):
+                return self.refresh_collection_version()
+            return getattr(self, "collection_version", None)
+
+        def _store_cached_sql(self, question: str, sql: str, cache_context):
+            if cache_context is None or not sql or not self.is_sql_valid(sql):
+                return
+            embedding, scope, generation = cache_context
+            self.semantic_cache.add(embedding, question, sql, scope=scope, generation=generation)
+
+        def _retrieval_scope(self):
+            """一次generate_sql内共用检索结果(检索服务客户端)，其他向量库不需要"""
+            if hasattr(self, "retrieval_scope"):
+                return self.retrieval_scope()
+            return contextlib.nullcontext()
+
+        def generate_sql(self, question: str, **kwargs) -> str:
+            self._sql_path.set("llm")
+            with self._retrieval_scope():
+                if not question or not question.strip():
+                    return self._generate_sql_with_llm(question, **kwargs)
+
+                sql, path, cache_context, question_sql_list = self._lookup_cached_sql(question)
+                self._sql_path.set(path)
+                if sql is not None:
+                    return sql
+
+                sql = self._generate_sql_with_llm(question, question_sql_list=question_sql_list, **kwargs)
+                sql = self._improve_sql_plan(question, sql, **kwargs)
+            self._store_cached_sql(question, sql, cache_context)
+            return sql
+
+        def _retrieve_context(self, question: str, question_sql_list=None, **kwargs):
+            # prompt_type 只用于选择LLM，不传给向量库，检索参数与精确匹配时相同，检索服务客户端可以复用结果
+            kwargs.pop("prompt_type", None)
+            # 精确匹配未命中时已经检索过question_sql，直接复用
+            if question_sql_list is None:
+                question_sql_list = self.get_similar_question_sql(question, **kwargs)
+            return (
+                question_sql_list,
+                self.get_related_ddl(question, **kwargs),
+                self.get_related_documentation(question, **kwargs),
+            )
+
+        async def agenerate_sql(self, question: str, allow_llm_to_see_data=False, **kwargs) -> str:
+            """
+            generate_sql 的异步版本：等待LLM时不占用线程，检索、执行中间SQL等阻塞操作放到线程池中。
+            任务被取消时会关闭正在进行的LLM请求
+            """
+            self._sql_path.set("llm")
+            cache_context = question_sql_list = None
+            with self._retrieval_scope():
+                if question and question.strip():
+                    sql, path, cache_context, question_sql_list = await asyncio.to_thread(
+                        self._lookup_cached_sql, question
+                    )
+                    self._sql_path.set(path)
+                    if sql is not None:
+                        return sql
+
+                kwargs = {**kwargs, "prompt_type": "sql"}
+                steps = self._sql_generation_steps(question, allow_llm_to_see_data, question_sql_list, **kwargs)
+                step, args = self._advance(steps)
+                while step is not None:
+                    value = error = None
+                    try:
+                        if step == "retrieve":
+                            value = await asyncio.to_thread(self._retrieve_context, *args, **kwargs)
+                        elif step == "submit":
+                            prompt, route_fallback = args
+                            value = await self.asubmit_prompt(prompt, route_fallback=route_fallback, **kwargs)
+                        else:
+                            value = await asyncio.to_thread(self.run_sql, *args)
+                    except Exception as e:
+                        error = e
+                    step, args = self._advance(steps, value, error)
+
+                sql = await asyncio.to_thread(self._improve_sql_plan, question, args, **kwargs)
+            self._store_cached_sql(question, sql, cache_context)
+            return sql
+
+        def str_to_approx_token_count(self, string: str) -> int:
+            # vanna默认按 len/4 估算，中文会少算很多
+            return count_tokens(string)
+
+        def get_sql_prompt(self, initial_prompt=None, question=None, question_sql_list=None,
+                           ddl_list=None, doc_list=None, **kwargs):
+            question_sql_list = list(question_sql_list or [])
+            ddl_list = list(ddl_list or [])
+            doc_list = list(doc_list or [])
+            if self.ddl_compactor is not None and ddl_list:
+                # 宽表只保留关键列和与问题相关的列，先裁剪再计算预算
+                question_embedding = None
+                if self.ddl_embedding_match:
+                    try:
+                        question_embedding = self._question_embedding(question)
+                    except Exception as e:
+                        logger.warning("计算问题向量失败，只按词匹配裁剪DDL: %s", e)
+                ddl_list = self.ddl_compactor.compact_list(ddl_list, question, question_embedding)
+            if self.prompt_budget_enabled:
+                # 先计算不含检索结果的提示词长度，剩余的预算分给DDL、文档和示例
+                base_prompt = super().get_sql_prompt(
+                    initial_prompt=initial_prompt, question=question,
+                    question_sql_list=[], ddl_list=[], doc_list=[], **kwargs
+                )
+                budget = self.max_prompt_tokens - count_message_tokens(base_prompt)
+                question_sql_list, ddl_list, doc_list, dropped = fit_prompt_items(
+                    question_sql_list, ddl_list, doc_list, budget
+                )
+                if dropped:
+                    logger.debug("提示词超出预算 %s tokens，丢弃排名靠后的 %d 条检索结果", self.max_prompt_tokens, dropped)
+            if self.stable_prompt_prefix:
+                # 按检索排名排列(最相关的在前，中间SQL的查询结果文档保持在最后)，只去掉重复条目
+                ddl_list = list(dict.fromkeys(ddl_list))
+                doc_list = list(dict.fromkeys(doc_list))
+            message_log = super().get_sql_prompt(
+                initial_prompt=initial_prompt, question=question,
+                question_sql_list=question_sql_list, ddl_list=ddl_list, doc_list=doc_list, **kwargs
+            )
+            if self.stable_prompt_prefix and llm_cls.get_sql_prompt is VannaBase.get_sql_prompt:
+                return self._stable_sql_prompt(message_log)
+            return message_log
+
+        def _stable_sql_prompt(self, message_log: list) -> list:
+            """
+            把vanna提示词中固定的回答要求(===Response Guidelines)移到DDL和文档之前。
+            vanna原来的顺序中要求位于DDL之后，不同问题的提示词只有第一句相同，服务商的前缀缓存很难命中
+            """
+            system_prompt = message_log[0]["content"]
+            guidelines_start = system_prompt.find("===Response Guidelines")
+            context_starts = [
+                index for index in (system_prompt.find("\n===Tables"), system_prompt.find("\n===Additional Context"))
+                if index != -1
+            ]
+            if guidelines_start == -1 or not context_starts or min(context_starts) > guidelines_start:
+                return message_log
+            context_start = min(context_starts)
+            system_prompt = (
+                system_prompt[:context_start] + "\n" + system_prompt[guidelines_start:]
+                + system_prompt[context_start:guidelines_start]
+            )
+            return [self.system_message(system_prompt)] + message_log[1:]
+
+        def _route(self, kwargs: dict) -> dict:
+            """按提示词类型在调用参数中加入路由选择的客户端和模型"""
+            if self.llm_router is None or "client" in kwargs:
+                return kwargs
+            route = self.llm_router.resolve(get_prompt_type(kwargs), fallback=bool(kwargs.get("route_fallback")))
+            if route is None:
+                return kwargs
+            return {**kwargs, "client": route["client"], "model": route["model"]}
+
+        def _sql_stream_kwargs(self, kwargs: dict) -> dict:
+            """SQL提示词加上停止序列和流式提前结束"""
+            if get_prompt_type(kwargs) != "sql":
+                return kwargs
+            extra = {}
+            if self.sql_stop_sequences and "stop" not in kwargs:
+                extra["stop"] = self.sql_stop_sequences
+            if self.sql_early_stop:
+                extra["sql_early_stop"] = True
+            return {**kwargs, **extra}
+
+        def _response_cache_key(self, prompt, kwargs: dict) -> str | None:
+            """启用了该提示词类型的响应缓存时返回缓存键，否则返回None"""
+            if self.response_cache is None or not self.response_cache.enabled_for(get_prompt_type(kwargs)):
+                return None
+            model = kwargs.get("model") or self.config.get("model")
+            temperature = kwargs.get("temperature", getattr(self, "temperature", None))
+            return prompt_cache_key(prompt, model, temperature)
+
+        def _get_cached_response(self, key, kwargs: dict) -> str | None:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                logger.debug("LLM响应缓存命中: %s", get_prompt_type(kwargs))
+                on_token = kwargs.get("on_token")
+                if on_token is not None:
+                    on_token(cached)
+            return cached
+
+        @staticmethod
+        def _notify_llm_call(kwargs: dict) -> dict:
+            """流式接口通过on_llm_call区分同一次生成中的多次LLM调用(中间SQL、备用模型)"""
+            on_llm_call = kwargs.pop("on_llm_call", None)
+            if on_llm_call is not None:
+                on_llm_call()
+            return kwargs
+
+        def submit_prompt(self, prompt, **kwargs) -> str:
+            kwargs = self._sql_stream_kwargs(self._route(self._notify_llm_call(kwargs)))
+            key = self._response_cache_key(prompt, kwargs)
+            if key is None:
+                return self._submit_with_provider_pool(prompt, **kwargs)
+
+            cached = self._get_cached_response(key, kwargs)
+            if cached is not None:
+                return cached
+            response = self._submit_with_provider_pool(prompt, **kwargs)
+            self.response_cache.set(key, response)
+            return response
+
+        @staticmethod
+        def _secondary_kwargs(kwargs: dict) -> dict:
+            # 路由选择的客户端和模型属于主服务商，备用服务商使用自己的默认模型
+            return {key: value for key, value in kwargs.items() if key not in ("client", "model")}
+
+        def _submit_with_provider_pool(self, prompt, **kwargs) -> str:
+            response = self._call_provider_pool(prompt, **kwargs)
+            if get_prompt_type(kwargs) == "sql":
+                # 停止序列会截掉SQL结尾的分号和代码块标记
+                response = finalize_sql_response(response)
+            return response
+
+        def _provider_attempts(self, kwargs: dict, primary_call, secondary_call) -> list:
+            # 熔断和耗时统计计入实际使用的服务商：模型路由可能把调用发给了其他服务商的客户端
+            primary = provider_of(kwargs.get("client") or self.client)
+            attempts = [(primary, primary_call)]
+            secondary = self.provider_pool.secondary_chat
+            if secondary is not None and provider_of(secondary.client) != primary:
+                attempts.append((provider_of(secondary.client), secondary_call))
+            return attempts
+
+        @staticmethod
+        def _track_emitted_tokens(kwargs: dict):
+            """
+            包装on_token回调，记录是否已经把片段交给调用方
+            Returns:
+                tuple: (新的kwargs, 是否还能切换服务商的函数；没有on_token时为None)
+            """
+            on_token = kwargs.get("on_token")
+            if on_token is None:
+                return kwargs, None
+            emitted = threading.Event()
+
+            def tracked_on_token(token):
+                emitted.set()
+                on_token(token)
+            return {**kwargs, "on_token": tracked_on_token}, lambda: not emitted.is_set()
+
+        def _call_provider_pool(self, prompt, **kwargs) -> str:
+            parent_submit = super().submit_prompt
+            if self.provider_pool is None:
+                return parent_submit(prompt, **kwargs)
+            kwargs, can_failover = self._track_emitted_tokens(kwargs)
+            secondary = self.provider_pool.secondary_chat
+            attempts = self._provider_attempts(
+                kwargs,
+                lambda: parent_submit(prompt, **kwargs),
+                lambda: secondary.submit_prompt(prompt, **self._secondary_kwargs(kwargs)),
+            )
+            return self.provider_pool.call(
+                get_prompt_type(kwargs),
+                attempts,
+                # 流式输出时两个服务商的片段会混在一起：不对冲，发出片段后也不再切换
+                allow_hedge=can_failover is None,
+                can_failover=can_failover,
+            )
+
+        async def _asubmit_with_provider_pool(self, prompt, **kwargs) -> str:
+            parent_asubmit = super().asubmit_prompt
+            if self.provider_pool is None:
+                response = await parent_asubmit(prompt, **kwargs)
+            else:
+                kwargs, can_failover = self._track_emitted_tokens(kwargs)
+                secondary = self.provider_pool.secondary_chat
+                attempts = self._provider_attempts(
+                    kwargs,
+                    lambda: parent_asubmit(prompt, **kwargs),
+                    lambda: secondary.asubmit_prompt(prompt, **self._secondary_kwargs(kwargs)),
+                )
+                response = await self.provider_pool.acall(get_prompt_type(kwargs), attempts, can_failover=can_failover)
+            if get_prompt_type(kwargs) == "sql":
+                response = finalize_sql_response(response)
+            return response
+
+        async def asubmit_prompt(self, prompt, **kwargs) -> str:
+            kwargs = self._sql_stream_kwargs(self._route(self._notify_llm_call(kwargs)))
+            key = self._response_cache_key(prompt, kwargs)
+            if key is None:
+                return await self._asubmit_with_provider_pool(prompt, **kwargs)
+
+            # 磁盘缓存的读写是阻塞操作
+            cached = await asyncio.to_thread(self._get_cached_response, key, kwargs)
+            if cached is not None:
+                return cached
+            response = await self._asubmit_with_provider_pool(prompt, **kwargs)
+            await asyncio.to_thread(self.response_cache.set, key, response)
+            return response
+
+        def generate_question(self, sql: str, **kwargs) -> str:
+            return super().generate_question(sql, prompt_type="question", **kwargs)
+
+        def generate_summary(self, question: str, df, **kwargs) -> str:
+            if self.result_digester is None or not self.result_digester.needs_digest(df):
+                return super().generate_summary(question, df, prompt_type="summary", **kwargs)
+
+            # 结果较大时用统计摘要代替完整的markdown，提示词格式与vanna的generate_summary一致
+            digest = self.result_digester.digest(df)
+            message_log = [
+                self.system_message(
+                    f"You are a helpful data assistant. The user asked the question: '{question}'\n\n"
+                    f"The query returned {len(df)} rows. The following is a statistical digest of the results, "
+                    f"not the full data: \n{digest}\n\n"
+                ),
+                self.user_message(
+                    "Briefly summarize the data based on the question that was asked. "
+                    "Do not respond with any additional explanation beyond the summary." +
+                    self._response_language()
+                ),
+            ]
+            return self.submit_prompt(message_log, prompt_type="summary", **kwargs)
+
+        def generate_followup_questions(self, question: str, sql: str, df, n_questions: int = 5, **kwargs) -> list:
+            return super().generate_followup_questions(
+                question, sql, df, n_questions=n_questions, prompt_type="followup", **kwargs
+            )
+
+        def generate_plotly_code(self, question: str = None, sql: str = None, df_metadata: str = None, **kwargs) -> str:
+            return super().generate_plotly_code(
+                question=question, sql=sql, df_metadata=df_metadata, prompt_type="plotly", **kwargs
+            )
+
+        def _invalidate_semantic_cache(self):
+            if self.semantic_cache is not None:
+                self.semantic_cache.invalidate()
+
+        def add_question_sql(self, question: str, sql: str, **kwargs) -> str:
+            if self.semantic_cache is None:
+                return super().add_question_sql(question, sql, **kwargs)
+            if not self.semantic_cache.contains(question, sql):
+                self.semantic_cache.invalidate()
+                return super().add_question_sql(question, sql, **kwargs)
+
+            # ask() 自动训练会把刚生成的问题和SQL写回训练集，缓存条目仍然有效，跟随写入后的训练数据版本
+            try:
+                before = self._semantic_cache_scope()
+                _id = super().add_question_sql(question, sql, **kwargs)
+                self.semantic_cache.rebase(before, self._semantic_cache_scope())
+            except Exception:
+                self.semantic_cache.invalidate()
+                raise
+            return _id
+
+        def add_ddl(self, ddl: str, **kwargs) -> str:
+            self._invalidate_semantic_cache()
+            return super().add_ddl(ddl, **kwargs)
+
+        def add_documentation(self, documentation: str, **kwargs) -> str:
+            self._invalidate_semantic_cache()
+            return super().add_documentation(documentation, **kwargs)
+
+        def remove_training_data(self, id: str, **kwargs) -> bool:
+            self._invalidate_semantic_cache()
+            return super().remove_training_data(id, **kwargs)
+
+        def remove_collection(self, collection_name: str) -> bool:
+            self._invalidate_semantic_cache()
+            return super().remove_collection(collection_name)
+
     _CustomVanna.__name__ = f"CustomVanna_{vectorstore_cls.__name__}_{llm_cls.__name__}"
     return _CustomVanna
 
+def create_provider_pool(config_module, model_type: str, provider_cfg: dict) -> ProviderPool:
+    """创建主备服务商池；备用服务商没有API密钥时只启用主服务商的熔断和耗时统计"""
+    providers = {
+        "qwen": (config_module.QWEN_CONFIG, QWEN_BASE_URL, "qwen-plus"),
+        "deepseek": (config_module.DEEPSEEK_CONFIG, DEEPSEEK_BASE_URL, "deepseek-chat"),
+    }
+    secondary = "deepseek" if model_type == "qwen" else "qwen"
+    secondary_config, default_base_url, default_model = providers[secondary]
+    secondary_chat = None
+    if secondary_config.get("api_key"):
+        model = provider_cfg.get("secondary_models", {}).get(secondary) or secondary_config.get("model", default_model)
+        secondary_chat = ChatClient(
+            get_openai_client(secondary_config["api_key"], secondary_config.get("base_url", default_base_url)),
+            model,
+            secondary_config.get("temperature", 0.7),
+        )
+        logger.info("已配置备用LLM服务商: %s，使用模型: %s", secondary, model)
+    else:
+        logger.warning("备用LLM服务商 %s 未设置API密钥，不启用失败切换和对冲请求", secondary)
+
+    return ProviderPool(
+        primary=model_type,
+        secondary=secondary,
+        secondary_chat=secondary_chat,
+        failure_threshold=provider_cfg.get("failure_threshold", 5),
+        recovery_timeout=provider_cfg.get("recovery_timeout", 30),
+        latency_window=provider_cfg.get("latency_window", 200),
+        hedge=provider_cfg.get("hedge", True),
+        hedge_prompt_types=provider_cfg.get("hedge_prompt_types", ["sql"]),
+        min_samples=provider_cfg.get("min_samples", 20),
+        default_hedge_delay=provider_cfg.get("default_hedge_delay", 10),
+        min_hedge_delay=provider_cfg.get("min_hedge_delay", 2),
+        max_hedge_delay=provider_cfg.get("max_hedge_delay", 30),
+    )
+
 def create_vanna_instance(config_module=None):
     """
     工厂函数：根据配置创建并初始化一个Vanna实例，支持 ChromaDB 和 PGVector。
@@ -24,6 +730,9 @@ def create_vanna_instance(config_module=None):
     if config_module is None:
         config_module = app_config
 
+    # 聊天类和嵌入函数初始化时就会写日志，先配置日志
+    setup_logging(getattr(config_module, "LOGGING_CONFIG", {}))
+
     model_type = config_module.MODEL_TYPE.lower()
     vector_db_type = getattr(config_module, "VECTOR_DB_TYPE", "chromadb").lower()
 
@@ -61,7 +770,15 @@ def create_vanna_instance(config_module=None):
             f"{db_cfg['host']}:{db_cfg['port']}/{db_cfg['dbname']}"
         )
         config["connection_string"] = connection_string
+        config.update(getattr(config_module, "PGVECTOR_RETRIEVAL_CONFIG", {}))
         print(f"已配置使用PGVector作为向量数据库：{connection_string}")
+    elif vector_db_type == "pgvector_service":
+        # 通过独立的检索服务访问PGVector，所有worker共享一个检索进程
+        vectorstore_cls = PG_VectorStoreClient
+        service_cfg = config_module.RETRIEVAL_SERVICE_CONFIG
+        config["retrieval_service_url"] = service_cfg["url"]
+        config["retrieval_service_timeout"] = service_cfg.get("timeout", 10)
+        print(f"已配置使用检索服务作为向量数据库：{service_cfg['url']}")
     else:
         raise ValueError(f"不支持的向量数据库类型: {vector_db_type}")
 
@@ -70,6 +787,57 @@ def create_vanna_instance(config_module=None):
     config["embedding_function"] = embedding_function
     print(f"已配置嵌入模型: {config_module.EMBEDDING_CONFIG['model_name']}, 维度: {config_module.EMBEDDING_CONFIG['embedding_dimension']}")
 
+    # 配置按提示词类型的模型路由
+    routing_cfg = getattr(config_module, "LLM_ROUTING_CONFIG", {})
+    if routing_cfg.get("enabled"):
+        config["llm_router"] = LLMRouter(
+            routing_cfg.get("routes", {}),
+            {"qwen": config_module.QWEN_CONFIG, "deepseek": config_module.DEEPSEEK_CONFIG},
+        )
+        print(f"已启用模型路由: {config['llm_router']}")
+
+    # 配置主备服务商的熔断和对冲请求
+    provider_cfg = getattr(config_module, "LLM_PROVIDER_CONFIG", {})
+    if provider_cfg.get("enabled"):
+        config["provider_pool"] = create_provider_pool(config_module, model_type, provider_cfg)
+
+    # 配置SQL生成的停止序列和流式提前结束
+    config["sql_stream"] = getattr(config_module, "SQL_STREAM_CONFIG", {})
+
+    # 配置SQL提示词中宽表DDL的裁剪
+    config["ddl_compaction"] = getattr(config_module, "DDL_COMPACTION_CONFIG", {})
+
+    # 配置大查询结果的统计摘要
+    config["result_digest"] = getattr(config_module, "RESULT_DIGEST_CONFIG", {})
+
+    # 配置生成SQL执行前的EXPLAIN代价检查
+    config["sql_guard"] = getattr(config_module, "SQL_GUARD_CONFIG", {})
+
+    # 配置代价过高的SQL的执行计划反馈改写(依赖SQL执行前检查)
+    config["sql_plan_feedback"] = getattr(config_module, "SQL_PLAN_FEEDBACK_CONFIG", {})
+
+    # 配置每次LLM调用的用量和耗时明细记录
+    usage_cfg = getattr(config_module, "LLM_USAGE_CONFIG", {})
+    if usage_cfg.get("log_path"):
+        usage_meter.configure(usage_cfg["log_path"])
+
+    # 配置提示词的前缀缓存布局
+    config["prompt_cache"] = getattr(config_module, "PROMPT_CACHE_CONFIG", {})
+
+    # 配置SQL提示词的token预算
+    config["prompt_budget"] = getattr(config_module, "PROMPT_BUDGET_CONFIG", {})
+
+    # 配置摘要、追问、图表代码的LLM响应缓存
+    config["response_cache"] = getattr(config_module, "LLM_RESPONSE_CACHE_CONFIG", {})
+
+    # 配置generate_sql的精确匹配快速路径
+    config["exact_match"] = getattr(config_module, "EXACT_MATCH_CONFIG", {})
+
+    # 配置generate_sql的语义缓存
+    config["semantic_cache"] = getattr(config_module, "SEMANTIC_CACHE_CONFIG", {})
+    if config["semantic_cache"].get("enabled"):
+        print(f"已启用语义缓存，相似度阈值: {config['semantic_cache'].get('similarity_threshold')}")
+
     # 动态组合实例化
     VannaClass = CustomVannaDynamic(vectorstore_cls, llm_cls)
     vn = VannaClass(config=config)